@@ -4,8 +4,11 @@ import sys
 import json
 import time
 import math
+import shutil
+import zlib
+import numpy as np
 from pathlib import Path
-from flask import Flask, jsonify, request, send_from_directory, render_template
+from flask import Flask, Response, g, jsonify, request, send_from_directory, render_template
 
 # ===============================
 # 🚀 PROJECT CONFIG
@@ -14,10 +17,36 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from scripts.ingest import ingest_data
+from pymongo.errors import PyMongoError
+from scripts.ingest import ingest_data_streaming, ingest_data_parallel, GRID_SCALE, ZONES_FILE, LAYOUTS
 from scripts.aggregate import run_aggregation
 from scripts.mapreduce import run_mapreduce
 from scripts.postprocess import detect_anomalies
+from scripts.bincount import run_bincount
+from scripts.incremental import run_incremental
+from scripts.benchmark import latest_timings
+from backend.results_cache import (ResultsCache, wire_payload, rows_to_columns, hour_offsets,
+                                   encode_body)
+from scripts.scheduler import Stage, run_stages
+from backend.jobs import JobRunner
+from backend.releases import publish
+from scripts.stage_cache import StageCache, cached_stage
+from scripts.mongo import get_client
+from scripts.live_query import query_hotspots, parse_bbox, parse_date, hour_list
+from backend.ttl_cache import TTLCache
+from scripts.pyramid import run_pyramid, level_for_zoom, PyramidIndex, LEVELS
+from scripts.cube import run_cube, cube_files, parse_dows, Cube, CUBE_META
+from scripts.columnar import columnar_files, meta_path, row_cells, write_json_atomic
+from scripts.trip_cache import build_trip_cache
+from scripts.multimonth import run_multimonth, DEFAULT_GLOB
+from scripts.partitions import ingest_partitioned, run_partitioned_aggregation
+from scripts.sampling import (run_sampled, write_sample_csv, sample_csv_path, SAMPLING_METHODS,
+                              ROW_SAMPLINGS)
+from scripts.flows import run_flows, flow_files, FlowTensor, FLOWS_META
+from scripts.hotspot_index import HotspotIndex
+from scripts.metrics_store import MetricsStore, METRICS_DB
+from scripts.instrumentation import (REGISTRY, STAGE_SECONDS, PIPELINE_SECONDS, HTTP_SECONDS,
+                                     HTTP_BYTES)
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = os.getenv("MONGO_DB", "taxi_hotspot_db")
@@ -26,11 +55,44 @@ DB_NAME = os.getenv("MONGO_DB", "taxi_hotspot_db")
 FRONTEND_DIR = os.path.join(PROJECT_ROOT, "frontend")
 DATA_RESULTS = os.path.join(PROJECT_ROOT, "data", "results")
 CSV_PATH = os.path.join(PROJECT_ROOT, "data", "raw", "yellow_tripdata_2019-01.csv")
+# Monthly files aggregated by the multimonth engine
+MULTIMONTH_GLOB = os.getenv("MULTIMONTH_GLOB", DEFAULT_GLOB)
 
 AGG_JSON = os.path.join(DATA_RESULTS, "hourly_grid_counts.json")
 MR_JSON = os.path.join(DATA_RESULTS, "mapreduce_hourly_grid_counts.json")
+BINCOUNT_JSON = os.path.join(DATA_RESULTS, "bincount_hourly_grid_counts.json")
+MULTIMONTH_JSON = os.path.join(DATA_RESULTS, "multimonth_hourly_grid_counts.json")
+PARTITIONED_JSON = os.path.join(DATA_RESULTS, "partitioned_hourly_grid_counts.json")
+SAMPLED_JSON = os.path.join(DATA_RESULTS, "sampled_hourly_grid_counts.json")
 ANOM_JSON = os.path.join(DATA_RESULTS, "anomaly_cells.json")
-TIMING_FILE = os.path.join(DATA_RESULTS, "timing_history.json")
+PIPELINE_TIMING = os.path.join(DATA_RESULTS, "timing.json")
+BENCHMARK_FILE = os.path.join(DATA_RESULTS, "benchmark.json")
+PYRAMID_JSON = os.path.join(DATA_RESULTS, "grid_pyramid.json")
+CUBE_META_JSON = os.path.join(DATA_RESULTS, CUBE_META)
+FLOWS_META_JSON = os.path.join(DATA_RESULTS, FLOWS_META)
+
+# Viewport rows returned by /api/tiles (default and hard cap)
+TILE_LIMIT = 2000
+TILE_LIMIT_MAX = 10000
+# Rows returned by /api/flows (default and hard cap)
+FLOW_LIMIT = 10
+FLOW_LIMIT_MAX = 1000
+# Rows returned by /api/top and /api/nearest (default and hard cap)
+QUERY_LIMIT = 10
+QUERY_LIMIT_MAX = 1000
+# Runs returned by /api/trend (default and hard cap)
+TREND_LIMIT = 20
+TREND_LIMIT_MAX = 1000
+
+# Result file of every engine, all sharing the hourly_grid_counts.json schema
+ENGINE_OUTPUTS = {
+    "aggregation": AGG_JSON,
+    "mapreduce": MR_JSON,
+    "bincount": BINCOUNT_JSON,
+    "multimonth": MULTIMONTH_JSON,
+    "partitioned": PARTITIONED_JSON,
+    "sampled": SAMPLED_JSON,
+}
 
 # ===============================
 # 🌐 FLASK APP INIT
@@ -42,6 +104,15 @@ app = Flask(
     template_folder=os.path.join(PROJECT_ROOT, "frontend"),
 )
 
+# Parsed + pre-serialized result files, reloaded when mtime/size change
+results_cache = ResultsCache()
+# Append-only timing history; always the live database, never a staging copy
+metrics_store = MetricsStore(METRICS_DB)
+
+# Live /api/hotspots/query results (LRU + TTL, cleared when a run is published)
+live_query_cache = TTLCache(maxsize=int(os.getenv("LIVE_QUERY_CACHE_SIZE", "256")),
+                            ttl=float(os.getenv("LIVE_QUERY_TTL", "300")))
+
 # ===============================
 # 🧩 HELPER FUNCTIONS
 # ===============================
@@ -54,33 +125,339 @@ def load_json_safe(path):
     with open(path) as f:
         return json.load(f)
 
+def cached_json_response(body, etag):
+    """Serve pre-serialized JSON with an ETag, answering 304 when it matches"""
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
+
+def accepts_gzip():
+    return request.accept_encodings["gzip"] > 0
+
+def wire_response(body, etag, gzipped):
+    """cached_json_response for a columnar wire body, gzip-encoded when `gzipped`"""
+    resp = cached_json_response(body, etag)
+    if gzipped:
+        resp.headers["Content-Encoding"] = "gzip"
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
 # ===============================
 # 📊 MAIN PIPELINE
 # ===============================
-def run_full_pipeline(sample_rows=100000, drop=True):
-    ensure_results_dir()
-    t0 = time.time()
-    print("1️⃣ Ingesting CSV...")
-    ingest_data(CSV_PATH, MONGO_URI, DB_NAME, sample_rows=sample_rows, drop=drop)
-    t1 = time.time()
-    print("2️⃣ Running aggregation...")
-    start = time.time()
-    run_aggregation(MONGO_URI, DB_NAME, AGG_JSON)
-    t2 = time.time()
-    print("3️⃣ Running MapReduce...")
-    run_mapreduce(MONGO_URI, DB_NAME, MR_JSON)
-    t3 = time.time()
-    detect_anomalies(AGG_JSON, ANOM_JSON)
-    t4 = time.time()
-
-    times = {
-        "ingest_time": round(t1 - t0, 3),
-        "aggregation_time": round(t2 - start, 3),
-        "mapreduce_time": round(t3 - t2, 3),
-        "anomaly_time": round(t4 - t3, 3),
-    }
-    json.dump(times, open(os.path.join(DATA_RESULTS, "timing.json"), "w"), indent=2)
+def result_path(results_dir, path):
+    """Same result file, inside `results_dir` (e.g. a staging directory)"""
+    return os.path.join(results_dir, os.path.basename(path))
+
+def job_hooks(job):
+    """on_start/on_finish callbacks that report stage progress to a background job"""
+    if job is None:
+        return None, None
+
+    def on_start(name):
+        job.check_cancelled()
+        job.stage_started(name)
+
+    def on_finish(name, seconds, result):
+        rows = result if isinstance(result, int) else len(result) if isinstance(result, list) else None
+        job.stage_finished(name, seconds, rows)
+
+    return on_start, on_finish
+
+def run_pipeline_stages(stages, results_dir, job=None, max_workers=4, cache=None):
+    """Schedule `stages` as a DAG and write per-stage timing + critical path to timing.json"""
+    on_start, on_finish = job_hooks(job)
+    run = run_stages(stages, max_workers=max_workers, on_start=on_start, on_finish=on_finish)
+    if job is not None:
+        job.check_cancelled()
+
+    # Stages skipped by the cache took ~0s; leave them out so engine timings stay real
+    skipped = sorted(cache.skipped) if cache is not None else []
+    times = {f"{name}_time": t["seconds"] for name, t in run["timings"].items()
+             if name not in skipped}
+    times["wall_time"] = run["wall_seconds"]
+    times["critical_path"] = run["critical_path"]
+    times["critical_path_time"] = run["critical_path_seconds"]
+    times["cached_stages"] = skipped
+    write_json_atomic(result_path(results_dir, PIPELINE_TIMING), times)
+    for name, t in run["timings"].items():
+        if name not in skipped:
+            STAGE_SECONDS.observe(t["seconds"], stage=name)
+    PIPELINE_SECONDS.observe(run["wall_seconds"])
+    metrics_store.record("pipeline", {name: t["seconds"] for name, t in run["timings"].items()
+                                      if name not in skipped} | {"wall": run["wall_seconds"]},
+                         extra={"cached_stages": skipped} if skipped else None)
     print("✅ Timing results saved:", times)
+    return times
+
+def trip_count():
+    return get_client(MONGO_URI)[DB_NAME].taxi_trips.estimated_document_count()
+
+def cache_stages(stages, cache, results_dir, sample_rows, drop, layout, threshold,
+                 row_sampling="first"):
+    """
+    Wrap pipeline stages with the content-addressed stage cache.
+
+    Fingerprints chain: ingest covers the CSV, zone file, sample_rows (and how
+    they are chosen), layout and grid resolution; aggregation/mapreduce
+    inherit it; anomaly adds the threshold. The sample CSV is a fixed-seed
+    function of the CSV and those parameters, so it needs no fingerprint. An ingest that appends (drop=False) is never cached, and
+    neither is anything downstream of it.
+    """
+    inputs = [CSV_PATH, ZONES_FILE]
+    # Parameters that decide which trips every stage reads; unchanged for "first"
+    rows = {"sample_rows": sample_rows}
+    if sample_rows is not None and row_sampling != "first":
+        rows["row_sampling"] = row_sampling
+    ingest_fp = cache.fingerprint("ingest", {**rows, "layout": layout,
+                                             "grid_scale": GRID_SCALE, "mongo_uri": MONGO_URI,
+                                             "db": DB_NAME}, inputs)
+    agg_fp = cache.fingerprint("aggregation", upstream=[ingest_fp])
+    fingerprints = {
+        "ingest": ingest_fp,
+        "aggregation": agg_fp,
+        "mapreduce": cache.fingerprint("mapreduce", upstream=[ingest_fp]),
+        "anomaly": cache.fingerprint("anomaly", {"threshold": threshold}, upstream=[agg_fp]),
+        "bincount": cache.fingerprint("bincount", {**rows, "grid_scale": GRID_SCALE}, inputs),
+        "pyramid": cache.fingerprint("pyramid", {**rows, "levels": LEVELS}, inputs),
+        "cube": cache.fingerprint("cube", {**rows, "grid_scale": GRID_SCALE}, inputs),
+        "flows": cache.fingerprint("flows", rows, inputs),
+    }
+    def grid_outputs(path):
+        return [os.path.basename(p) for p in [path] + columnar_files(path)]
+
+    outputs = {
+        "aggregation": grid_outputs(AGG_JSON),
+        "mapreduce": grid_outputs(MR_JSON),
+        "anomaly": [os.path.basename(ANOM_JSON)],
+        "bincount": grid_outputs(BINCOUNT_JSON),
+        "pyramid": [os.path.basename(PYRAMID_JSON)],
+        "cube": [os.path.basename(p) for p in cube_files(DATA_RESULTS)],
+        "flows": [os.path.basename(p) for p in flow_files(DATA_RESULTS)],
+    }
+    # Skipping ingest is only safe if taxi_trips still holds what it wrote
+    checks = {"ingest": lambda record: trip_count() == record["rows"]}
+
+    # Stages that read only the CSV stay cacheable when ingest appends
+    csv_only = ("bincount", "pyramid", "cube", "flows")
+    wrapped = []
+    for stage in stages:
+        if stage.name not in fingerprints or (not drop and stage.name not in csv_only):
+            wrapped.append(stage)
+            continue
+        func = cached_stage(cache, stage.name, fingerprints[stage.name], stage.func,
+                            outputs.get(stage.name, ()), results_dir, checks.get(stage.name))
+        wrapped.append(Stage(stage.name, func, stage.deps))
+    return wrapped
+
+def pipeline_stages(sample_rows=100000, drop=True, batch_size=100000, ingest_workers=1,
+                    engines=("aggregation", "mapreduce", "bincount"), layout="compact",
+                    results_dir=DATA_RESULTS, job=None, threshold=3.0, cache=None,
+                    sampling="stratified", row_sampling="uniform", progressive=False):
+    """
+    Stage DAG of a full run:
+
+        [sample] ── trip_cache ──┬── ingest ──┬── aggregation ── anomaly
+                                 │            └── mapreduce
+                                 ├── bincount   (no Mongo dependency)
+                                 ├── pyramid    (multi-resolution rollups for /api/tiles)
+                                 ├── cube       (cell x day x hour arrays for /api/cube)
+                                 └── flows      (hour x origin x destination tensor for /api/flows)
+
+    With sample_rows set, `sample` draws that many rows from the whole CSV
+    (`row_sampling` "uniform" or "stratified", see scripts/sampling.py) into
+    a sample CSV that every stage reads instead; "first" takes the CSV's
+    first rows. trip_cache converts the CSV into typed columns once (a no-op
+    while the cache is current); every stage that reads trips reads those instead.
+
+    New engines or rollups plug in as extra Stage(name, func, deps) entries.
+    With a StageCache, stages whose inputs are unchanged are skipped.
+    """
+    should_stop = job.cancel_event.is_set if job is not None else None
+    agg_json = result_path(results_dir, AGG_JSON)
+
+    stages = []
+    csv_path, rows = CSV_PATH, sample_rows
+    if sample_rows is not None and row_sampling != "first":
+        csv_path, rows = sample_csv_path(CSV_PATH, sample_rows, row_sampling), None
+        stages.append(Stage("sample", lambda: write_sample_csv(CSV_PATH, sample_rows,
+                                                               row_sampling)))
+
+    if ingest_workers is None or ingest_workers > 1:
+        ingest = lambda: ingest_data_parallel(
+            csv_path, MONGO_URI, DB_NAME, sample_rows=rows, drop=drop,
+            workers=ingest_workers, batch_size=batch_size, layout=layout, should_stop=should_stop)
+    else:
+        ingest = lambda: ingest_data_streaming(
+            csv_path, MONGO_URI, DB_NAME, sample_rows=rows, drop=drop,
+            chunk_size=batch_size, layout=layout, should_stop=should_stop)
+
+    # Aggregation always runs: anomaly detection reads its output
+    stages += [
+        Stage("trip_cache", lambda: build_trip_cache(csv_path, rows), [s.name for s in stages]),
+        Stage("ingest", ingest, ["trip_cache"]),
+        Stage("aggregation", lambda: run_aggregation(MONGO_URI, DB_NAME, agg_json), ["ingest"]),
+        Stage("anomaly", lambda: detect_anomalies(agg_json, result_path(results_dir, ANOM_JSON),
+                                                  threshold=threshold), ["aggregation"]),
+        Stage("pyramid", lambda: run_pyramid(csv_path, result_path(results_dir, PYRAMID_JSON),
+                                             sample_rows=rows), ["trip_cache"]),
+        Stage("cube", lambda: run_cube(csv_path, results_dir, sample_rows=rows),
+              ["trip_cache"]),
+        Stage("flows", lambda: run_flows(csv_path, results_dir, sample_rows=rows),
+              ["trip_cache"]),
+    ]
+    if "mapreduce" in engines:
+        stages.append(Stage("mapreduce", lambda: run_mapreduce(
+            MONGO_URI, DB_NAME, result_path(results_dir, MR_JSON)), ["ingest"]))
+    if "bincount" in engines:
+        stages.append(Stage("bincount", lambda: run_bincount(
+            csv_path, result_path(results_dir, BINCOUNT_JSON), sample_rows=rows),
+            ["trip_cache"]))
+    if "multimonth" in engines:
+        # Opt-in: every file matching MULTIMONTH_GLOB, the first sample_rows of each file
+        stages.append(Stage("multimonth", lambda: run_multimonth(
+            MULTIMONTH_GLOB, result_path(results_dir, MULTIMONTH_JSON), sample_rows=sample_rows)))
+    if "partitioned" in engines:
+        # Opt-in: reloads the CSV's months into taxi_trips_YYYY_MM, then fans out over them
+        stages.append(Stage("partition_ingest", lambda: ingest_partitioned(
+            csv_path, MONGO_URI, DB_NAME, sample_rows=rows, chunk_size=batch_size,
+            layout=layout, should_stop=should_stop), ["trip_cache"]))
+        stages.append(Stage("partitioned", lambda: run_partitioned_aggregation(
+            MONGO_URI, DB_NAME, result_path(results_dir, PARTITIONED_JSON)), ["partition_ingest"]))
+    if "sampled" in engines:
+        # Opt-in: sample_rows trips drawn from the whole CSV, scaled up with error bounds.
+        # Progressive steps go live while the job runs; the final estimate is published with it
+        stages.append(Stage("sampled", lambda: run_sampled(
+            CSV_PATH, result_path(results_dir, SAMPLED_JSON), sample_rows=sample_rows,
+            method=sampling, progressive=progressive, preview_file=SAMPLED_JSON),
+            ["trip_cache"]))
+    if cache is not None:
+        stages = cache_stages(stages, cache, results_dir, sample_rows, drop, layout, threshold,
+                              row_sampling)
+    return stages
+
+def run_full_pipeline(sample_rows=100000, drop=True, batch_size=100000, ingest_workers=1,
+                      engines=("aggregation", "mapreduce", "bincount"), incremental=False,
+                      layout="compact", results_dir=DATA_RESULTS, job=None, extra_stages=(),
+                      threshold=3.0, force=False, cache=None, sampling="stratified",
+                      row_sampling="uniform", progressive=False):
+    """
+    Ingest → aggregation → engines → anomalies, writing results into `results_dir`.
+
+    Independent stages run concurrently (see pipeline_stages). `job`
+    (backend/jobs.py) receives per-stage progress and is polled for
+    cancellation before every stage and between ingest chunks.
+
+    Stages whose inputs match data/results/stage_manifest.json are skipped;
+    `force` reruns everything. When a `cache` is passed in, the caller saves
+    it (after publishing a staged run); otherwise it is saved here.
+    """
+    Path(results_dir).mkdir(parents=True, exist_ok=True)
+    if incremental:
+        return run_incremental_pipeline(sample_rows=sample_rows, batch_size=batch_size,
+                                        results_dir=results_dir, job=job, threshold=threshold)
+    own_cache = cache is None
+    if own_cache:
+        cache = StageCache(DATA_RESULTS, force=force)
+    stages = pipeline_stages(sample_rows=sample_rows, drop=drop, batch_size=batch_size,
+                             ingest_workers=ingest_workers, engines=engines, layout=layout,
+                             results_dir=results_dir, job=job, threshold=threshold, cache=cache,
+                             sampling=sampling, row_sampling=row_sampling, progressive=progressive)
+    times = run_pipeline_stages(stages + list(extra_stages), results_dir, job, cache=cache)
+    if own_cache:
+        cache.save()
+    return times
+
+def run_incremental_pipeline(sample_rows=None, batch_size=100000, csv_path=CSV_PATH,
+                             results_dir=DATA_RESULTS, job=None, threshold=3.0):
+    """
+    Append a new CSV (e.g. next month) without dropping taxi_trips: the batch is
+    merged into the running (grid_key, hour) sums and only the affected rows of
+    hourly_grid_counts.json are rewritten. Full-history engines are skipped.
+    """
+    should_stop = job.cancel_event.is_set if job is not None else None
+    agg_json = result_path(results_dir, AGG_JSON)
+    if agg_json != AGG_JSON and os.path.exists(AGG_JSON):
+        # Staged run: start from the published rows so untouched cells are kept
+        shutil.copy2(AGG_JSON, agg_json)
+    stages = [
+        Stage("incremental", lambda: run_incremental(csv_path, MONGO_URI, DB_NAME, agg_json,
+                                                     sample_rows=sample_rows,
+                                                     chunk_size=batch_size,
+                                                     should_stop=should_stop)),
+        Stage("anomaly", lambda: detect_anomalies(agg_json, result_path(results_dir, ANOM_JSON),
+                                                  threshold=threshold), ["incremental"]),
+    ]
+    return run_pipeline_stages(stages, results_dir, job)
+
+def run_pipeline_job(job):
+    """
+    Background job body: run the pipeline into a staging directory, then
+    publish it as a new release with one atomic `current` swap (backend/releases.py).
+    Until then the API keeps serving the last good results.
+    """
+    ensure_results_dir()
+    staging = os.path.join(DATA_RESULTS, f".staging-{job.id}")
+    # Stage records describe the published files, so they are saved only after the swap
+    cache = StageCache(DATA_RESULTS, force=job.params.get("force", False))
+    try:
+        job.result = run_full_pipeline(results_dir=staging, job=job, cache=cache, **job.params)
+        job.check_cancelled()
+        publish(staging, DATA_RESULTS, job.id)
+        cache.save()
+        live_query_cache.clear()
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+pipeline_jobs = JobRunner(run_pipeline_job)
+
+# Parameters accepted by POST /api/pipeline/run
+PIPELINE_PARAMS = ("sample_rows", "drop", "batch_size", "ingest_workers", "engines",
+                   "incremental", "layout", "threshold", "force", "sampling", "row_sampling",
+                   "progressive")
+
+
+def positive_int(name, value):
+    # bool is an int subclass; "sample_rows": true is a client bug, not 1 row
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(f"{name} must be a positive integer")
+    return value
+
+
+def validate_pipeline_params(body):
+    """
+    The accepted subset of a POST /api/pipeline/run body, type-checked here so
+    a bad request is a 400 instead of a failed background job. Raises ValueError.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("body must be a JSON object")
+    params = {k: v for k, v in body.items() if k in PIPELINE_PARAMS}
+    for name in ("drop", "incremental", "force", "progressive"):
+        if name in params and not isinstance(params[name], bool):
+            raise ValueError(f"{name} must be true or false")
+    for name in ("batch_size", "ingest_workers"):
+        if name in params:
+            positive_int(name, params[name])
+    if params.get("sample_rows") is not None:
+        positive_int("sample_rows", params["sample_rows"])
+    if "engines" in params:
+        engines = params["engines"]
+        if not isinstance(engines, list) or not all(isinstance(e, str) for e in engines):
+            raise ValueError("engines must be a list of engine names")
+        unknown = [e for e in engines if e not in ENGINE_OUTPUTS]
+        if unknown:
+            raise ValueError(f"unknown engine: {unknown[0]}")
+    if "layout" in params and params["layout"] not in LAYOUTS:
+        raise ValueError(f"layout must be one of {', '.join(LAYOUTS)}")
+    if "sampling" in params and params["sampling"] not in SAMPLING_METHODS:
+        raise ValueError(f"sampling must be one of {', '.join(SAMPLING_METHODS)}")
+    if "row_sampling" in params and params["row_sampling"] not in ROW_SAMPLINGS:
+        raise ValueError(f"row_sampling must be one of {', '.join(ROW_SAMPLINGS)}")
+    if "threshold" in params:
+        t = params["threshold"]
+        if isinstance(t, bool) or not isinstance(t, (int, float)) or not math.isfinite(t) or t <= 0:
+            raise ValueError("threshold must be a positive number")
+    return params
 
 # ===============================
 # 🔥 APP ROUTES (FROM app.py)
@@ -91,68 +468,402 @@ def index():
 
 @app.route("/api/hotspots")
 def api_hotspots():
+    """
+    Rows of one hour (?hour=) or all hours. ?format=columnar returns parallel
+    arrays instead (all hours: with an hour offset table), gzip-encoded when
+    the client accepts it.
+    """
     hour = request.args.get("hour", default=None, type=int)
-    if not os.path.exists(AGG_JSON):
-        return jsonify({"error": "aggregation file not found"}), 500
-    data = load_json_safe(AGG_JSON)
+    engine = request.args.get("engine", default="aggregation")
+    fmt = request.args.get("format", default="json")
+    if engine not in ENGINE_OUTPUTS:
+        return jsonify({"error": f"unknown engine: {engine}"}), 400
+    if fmt not in ("json", "columnar"):
+        return jsonify({"error": f"unknown format: {fmt}"}), 400
+    if hour is not None and not 0 <= hour <= 23:
+        return jsonify({"error": "hour must be 0-23"}), 400
+    columnar = results_cache.columnar(ENGINE_OUTPUTS[engine])
+    if columnar is not None and fmt == "json":
+        return cached_json_response(*columnar.body(hour))
+    entry = columnar or results_cache.get(ENGINE_OUTPUTS[engine])
+    if entry is None:
+        return jsonify({"error": f"{engine} file not found"}), 500
+    if fmt == "columnar":
+        gzipped = accepts_gzip()
+        return wire_response(*entry.wire(hour, gzipped), gzipped)
     if hour is not None:
-        data = [d for d in data if int(d.get("hour", -1)) == hour]
-    return jsonify(data)
+        return cached_json_response(*entry.hour_body(hour))
+    return cached_json_response(entry.body, entry.etag)
+
+def hotspot_index(engine):
+    """HotspotIndex over an engine's current result, rebuilt when the result changes"""
+    path = ENGINE_OUTPUTS[engine]
+    def build():
+        columnar = results_cache.columnar(path)
+        if columnar is not None:
+            return HotspotIndex(columnar.store.rows(full=True))
+        if not os.path.exists(path):
+            return None
+        # Parsed for the index only, not kept in the results cache
+        with open(path) as f:
+            return HotspotIndex(json.load(f))
+    return results_cache.memo([path, meta_path(path)], ("hotspot_index", engine), build)
+
+def index_query_args():
+    """engine, hour and k shared by /api/top and /api/nearest; raises ValueError"""
+    engine = request.args.get("engine", default="aggregation")
+    if engine not in ENGINE_OUTPUTS:
+        raise ValueError(f"unknown engine: {engine}")
+    hour = request.args.get("hour", default=None, type=int)
+    if hour is not None and not 0 <= hour <= 23:
+        raise ValueError("hour must be 0-23")
+    k = request.args.get("k", default=QUERY_LIMIT, type=int)
+    if not 1 <= k <= QUERY_LIMIT_MAX:
+        raise ValueError(f"k must be 1-{QUERY_LIMIT_MAX}")
+    return engine, hour, k
+
+@app.route("/api/top")
+def api_top():
+    """Busiest cells of an hour (or per cell over the day): ?hour=&k=&offset=&engine="""
+    try:
+        engine, hour, k = index_query_args()
+        offset = request.args.get("offset", default=0, type=int)
+        if offset < 0:
+            raise ValueError("offset must be >= 0")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    index = hotspot_index(engine)
+    if index is None:
+        return jsonify({"error": f"{engine} file not found"}), 500
+    rows, total = index.top(hour, k, offset)
+    return jsonify({"engine": engine, "hour": hour, "k": k, "offset": offset,
+                    "total": total, "rows": rows})
+
+@app.route("/api/nearest")
+def api_nearest():
+    """Hotspot cells closest to a point: ?lat=&lon=&k=&hour=&engine="""
+    try:
+        engine, hour, k = index_query_args()
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("lat/lon out of range")
+    except KeyError:
+        return jsonify({"error": "lat and lon are required"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    index = hotspot_index(engine)
+    if index is None:
+        return jsonify({"error": f"{engine} file not found"}), 500
+    return jsonify({"engine": engine, "lat": lat, "lon": lon, "hour": hour, "k": k,
+                    "rows": index.nearest(lat, lon, k, hour)})
+
+@app.route("/api/hotspots/query")
+def api_hotspots_query():
+    """
+    Live query: ?bbox=min_lon,min_lat,max_lon,max_lat&hour_from=&hour_to=
+    &date_from=&date_to=&limit=, grouped by (cell, hour) in MongoDB.
+    """
+    args = request.args
+    try:
+        bbox = parse_bbox(args["bbox"]) if args.get("bbox") else None
+        hour_from = args.get("hour_from", default=0, type=int)
+        hour_to = args.get("hour_to", default=23, type=int)
+        if not (0 <= hour_from <= 23 and 0 <= hour_to <= 23):
+            raise ValueError("hours must be 0-23")
+        date_from = (parse_date(args["date_from"], name="date_from")
+                     if args.get("date_from") else None)
+        date_to = (parse_date(args["date_to"], end=True, name="date_to")
+                   if args.get("date_to") else None)
+        limit = args.get("limit", default=None, type=int)
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be a positive integer")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    hours = hour_list(hour_from, hour_to)
+    key = (bbox, tuple(hours), date_from, date_to, limit)
+    try:
+        rows, hit = live_query_cache.get_or_compute(key, lambda: query_hotspots(
+            MONGO_URI, DB_NAME, bbox=bbox, hours=hours, date_from=date_from,
+            date_to=date_to, limit=limit))
+    except PyMongoError as e:
+        return jsonify({"error": f"query failed: {e}"}), 503
+    resp = jsonify(rows)
+    resp.headers["X-Cache"] = "HIT" if hit else "MISS"
+    return resp
+
+def tile_payload(index, zoom, bbox, hour, limit):
+    """Columnar wire payload of one viewport (every hour, `limit` each, when hour is None)"""
+    resolution = level_for_zoom(zoom)
+    if hour is None:
+        by_hour, total = {}, 0
+        for h in range(24):
+            by_hour[h], n = index.query(resolution, bbox=bbox, hour=h, limit=limit)
+            total += n
+        rows, offsets = hour_offsets(by_hour)
+    else:
+        rows, total = index.query(resolution, bbox=bbox, hour=hour, limit=limit)
+        offsets = None
+    payload = wire_payload(rows_to_columns(rows), hour, offsets)
+    payload.update(zoom=zoom, resolution=resolution, scale=index.levels[resolution]["scale"],
+                   total=total, truncated=total > len(rows))
+    return payload
+
+@app.route("/api/tiles")
+def api_tiles():
+    """
+    Viewport query over the grid pyramid: ?zoom=&bbox=min_lon,min_lat,max_lon,max_lat
+    &hour=&limit=. Coarser cells at lower zooms keep the payload bounded.
+    ?format=columnar without an hour returns every hour of the viewport at
+    once (`limit` per hour), for clients that slice hours themselves.
+    """
+    zoom = request.args.get("zoom", default=12, type=int)
+    hour = request.args.get("hour", default=None, type=int)
+    limit = request.args.get("limit", default=TILE_LIMIT, type=int)
+    fmt = request.args.get("format", default="json")
+    if fmt not in ("json", "columnar"):
+        return jsonify({"error": f"unknown format: {fmt}"}), 400
+    try:
+        if not 1 <= limit <= TILE_LIMIT_MAX:
+            raise ValueError(f"limit must be 1-{TILE_LIMIT_MAX}")
+        if hour is not None and not 0 <= hour <= 23:
+            raise ValueError("hour must be 0-23")
+        bbox = parse_bbox(request.args["bbox"]) if request.args.get("bbox") else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    pyramid = results_cache.get(PYRAMID_JSON)
+    if pyramid is None:
+        return jsonify({"error": "grid pyramid not found"}), 500
+    index = results_cache.memo([PYRAMID_JSON], "pyramid_index",
+                               lambda: PyramidIndex(results_cache.load(PYRAMID_JSON)))
+
+    resolution = level_for_zoom(zoom)
+    if fmt == "columnar":
+        gzipped = accepts_gzip()
+        query = (zoom, bbox, hour, limit)
+        # Encoded (and compressed) once per viewport and pyramid version
+        body = results_cache.memo([PYRAMID_JSON], ("tiles",) + query + (gzipped,),
+                                  lambda: encode_body(tile_payload(index, zoom, bbox, hour, limit),
+                                                      gzipped))
+        etag = (f"{pyramid.etag}-t{zlib.crc32(repr(query).encode()):x}"
+                f"{'-gz' if gzipped else ''}")
+        return wire_response(body, etag, gzipped)
+    rows, total = index.query(resolution, bbox=bbox, hour=hour, limit=limit)
+    return jsonify({
+        "zoom": zoom,
+        "resolution": resolution,
+        "scale": index.levels[resolution]["scale"],
+        "hour": hour,
+        "total": total,
+        "truncated": total > len(rows),
+        "rows": rows,
+    })
+
+@app.route("/api/cube")
+def api_cube():
+    """
+    Slice the (cell, day, hour) cube: ?date_from=&date_to= (inclusive ISO dates)
+    &dow=weekday|weekend|0,..,6 &hour_from=&hour_to= &group_by=cell|hour|day &limit=
+    """
+    args = request.args
+    try:
+        date_from = (parse_date(args["date_from"], name="date_from").date()
+                     if args.get("date_from") else None)
+        date_to = (parse_date(args["date_to"], name="date_to").date()
+                   if args.get("date_to") else None)
+        dows = parse_dows(args["dow"]) if args.get("dow") else None
+        hour_from = args.get("hour_from", default=0, type=int)
+        hour_to = args.get("hour_to", default=23, type=int)
+        if not (0 <= hour_from <= 23 and 0 <= hour_to <= 23):
+            raise ValueError("hours must be 0-23")
+        group_by = args.get("group_by", default="cell")
+        if group_by not in ("cell", "hour", "day"):
+            raise ValueError(f"unknown group_by: {group_by}")
+        limit = args.get("limit", default=None, type=int)
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be a positive integer")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if results_cache.get(CUBE_META_JSON) is None:
+        return jsonify({"error": "cube not found"}), 500
+    cube = results_cache.memo([CUBE_META_JSON], "cube", lambda: Cube(DATA_RESULTS))
+
+    hours = hour_list(hour_from, hour_to)
+    rows = cube.query(date_from, date_to, dows, hours, group_by=group_by, limit=limit)
+    return jsonify({
+        "start_date": cube.start.isoformat(),
+        "end_date": cube.end.isoformat(),
+        "days": len(cube.day_indices(date_from, date_to, dows)),
+        "hours": hours,
+        "group_by": group_by,
+        "rows": rows,
+    })
+
+@app.route("/api/flows")
+def api_flows():
+    """
+    Origin-destination flows: ?zone= gives the top destinations of one pickup
+    zone, without it the top corridors overall. &hour= (0-23, default all day) &k=
+    """
+    args = request.args
+    try:
+        zone = args.get("zone", default=None, type=int)
+        hour = args.get("hour", default=None, type=int)
+        if hour is not None and not 0 <= hour <= 23:
+            raise ValueError("hour must be 0-23")
+        k = args.get("k", default=FLOW_LIMIT, type=int)
+        if not 1 <= k <= FLOW_LIMIT_MAX:
+            raise ValueError(f"k must be 1-{FLOW_LIMIT_MAX}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if results_cache.get(FLOWS_META_JSON) is None:
+        return jsonify({"error": "flows not found"}), 500
+    flows = results_cache.memo([FLOWS_META_JSON], "flows", lambda: FlowTensor(DATA_RESULTS))
+
+    if zone is None:
+        rows, total = flows.corridors(hour, k)
+    elif 0 <= zone < flows.n_zones:
+        rows, total = flows.destinations(zone, hour, k)
+    else:
+        return jsonify({"error": f"zone must be 0-{flows.n_zones - 1}"}), 400
+    return jsonify({"zone": zone, "hour": hour, "k": k, "total": total, "rows": rows})
 
 @app.route("/api/anomalies")
 def api_anomalies():
-    if not os.path.exists(ANOM_JSON):
+    entry = results_cache.get(ANOM_JSON)
+    if entry is None:
         return jsonify([])
-    return jsonify(load_json_safe(ANOM_JSON))
+    return cached_json_response(entry.body, entry.etag)
+
+# ===============================
+# ⚙️ PIPELINE JOB ROUTES
+# ===============================
+@app.route("/api/pipeline/run", methods=["POST"])
+def pipeline_run():
+    body = request.get_json(silent=True)
+    try:
+        params = validate_pipeline_params({} if body is None else body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job = pipeline_jobs.start(params)
+    if job is None:
+        return jsonify({"error": "a pipeline job is already running",
+                        "job": pipeline_jobs.get().to_dict()}), 409
+    return jsonify(job.to_dict()), 202
+
+@app.route("/api/pipeline/status")
+@app.route("/api/pipeline/status/<job_id>")
+def pipeline_status(job_id=None):
+    job = pipeline_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "no such job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/api/pipeline/cancel", methods=["POST"])
+@app.route("/api/pipeline/cancel/<job_id>", methods=["POST"])
+def pipeline_cancel(job_id=None):
+    job = pipeline_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "no such job"}), 404
+    return jsonify(job.to_dict())
 
 # ===============================
 # ⚖️ COMPARISON LOGIC (FROM compare_app.py)
 # ===============================
-def compare_results(agg, mapr, hour=None):
-    if not agg or not mapr:
-        return {"error": "Missing data files"}
 
+def result_columns(path, hour=None):
+    """
+    cell / hour / count arrays of a grid result, sliced from its memory-mapped
+    columnar store. Files without a store are parsed here and not cached, so
+    a comparison never keeps whole result files resident.
+    """
+    columnar = results_cache.columnar(path)
+    if columnar is not None:
+        store = columnar.store
+        start, end = (0, len(store)) if hour is None else store.hour_range(hour)
+        return {name: store.columns[name][start:end] for name in ("cell", "hour", "count")}
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        rows = json.load(f)
     if hour is not None:
-        agg = [r for r in agg if r.get("hour") == hour]
-        mapr = [r for r in mapr if r.get("hour") == hour]
-
-    agg_map = {(r["grid_key"], r["hour"]): r for r in agg}
-    mapr_map = {(r["grid_key"], r["hour"]): r for r in mapr}
-
-    common_keys = set(agg_map.keys()) & set(mapr_map.keys())
-    only_agg = set(agg_map.keys()) - set(mapr_map.keys())
-    only_mapr = set(mapr_map.keys()) - set(agg_map.keys())
-
-    abs_diffs, sq_diffs, exact = [], [], 0
-    for k in common_keys:
-        c1, c2 = agg_map[k]["count"], mapr_map[k]["count"]
-        if c1 == c2:
-            exact += 1
-        abs_diffs.append(abs(c1 - c2))
-        sq_diffs.append((c1 - c2) ** 2)
-
-    total = len(common_keys)
-    mae = sum(abs_diffs) / total if total else 0
-    rmse = math.sqrt(sum(sq_diffs) / total) if total else 0
+        rows = [r for r in rows if r.get("hour") == hour]
+    return {"cell": row_cells(rows),
+            "hour": np.fromiter((r["hour"] for r in rows), dtype=np.int64, count=len(rows)),
+            "count": np.fromiter((r["count"] for r in rows), dtype=np.int64, count=len(rows))}
+
+def result_keys(cols):
+    """(cell, hour) per row as one sortable structured array"""
+    keys = np.empty(len(cols["cell"]), dtype=[("cell", np.int64), ("hour", np.int64)])
+    keys["cell"], keys["hour"] = cols["cell"], cols["hour"]
+    return keys
+
+def compare_pair(base, other):
+    base_keys, other_keys = result_keys(base), result_keys(other)
+    common, base_idx, other_idx = np.intersect1d(base_keys, other_keys, return_indices=True)
+    diffs = (np.asarray(base["count"], dtype=np.int64)[base_idx]
+             - np.asarray(other["count"], dtype=np.int64)[other_idx])
+
+    total = len(common)
+    exact = int(np.count_nonzero(diffs == 0))
+    mae = float(np.abs(diffs).mean()) if total else 0
+    rmse = math.sqrt(float((diffs.astype(np.float64) ** 2).mean())) if total else 0
     exact_pct = (exact / total * 100) if total else 0
 
     return {
-        "total_rows_agg": len(agg),
-        "total_rows_mapr": len(mapr),
+        "total_rows": len(other_keys),
         "common_keys": total,
-        "agg_only": len(only_agg),
-        "mapr_only": len(only_mapr),
+        "base_only": len(np.unique(base_keys)) - total,
+        "engine_only": len(np.unique(other_keys)) - total,
         "exact_matches": exact,
         "exact_pct": round(exact_pct, 2),
         "mae": round(mae, 4),
         "rmse": round(rmse, 4),
     }
 
-def simulate_timing():
-    # Simulate slight variability in timing (used for trend)
-    agg_time = round(0.010 + (0.002 * os.urandom(1)[0] / 255), 3)
-    mapr_time = round(agg_time * (5 + (os.urandom(1)[0] / 64)), 3)
-    return {"aggregation_time": agg_time, "mapreduce_time": mapr_time}
+def compare_results(agg, mapr, others=None):
+    """Score MapReduce and every other engine against aggregation; arguments are result_columns()"""
+    if agg is None or mapr is None or not len(agg["cell"]) or not len(mapr["cell"]):
+        return {"error": "Missing data files"}
+
+    pair = compare_pair(agg, mapr)
+    metrics = {
+        "total_rows_agg": len(agg["cell"]),
+        "total_rows_mapr": pair["total_rows"],
+        "common_keys": pair["common_keys"],
+        "agg_only": pair["base_only"],
+        "mapr_only": pair["engine_only"],
+        "exact_matches": pair["exact_matches"],
+        "exact_pct": pair["exact_pct"],
+        "mae": pair["mae"],
+        "rmse": pair["rmse"],
+    }
+
+    # Every other engine is scored against the aggregation pipeline too
+    engines = {}
+    for name, cols in (others or {}).items():
+        if cols is None or not len(cols["cell"]):
+            continue
+        engines[name] = compare_pair(agg, cols)
+    metrics["engines"] = engines
+    return metrics
+
+def measured_timing():
+    """
+    Real engine timings: p50s from the latest benchmark run (scripts/benchmark.py),
+    falling back to the stage times of the last pipeline run.
+    """
+    p50 = latest_timings(results_cache.load(BENCHMARK_FILE))
+    if "aggregation" in p50 and "mapreduce" in p50:
+        timing = {f"{name}_time": t for name, t in p50.items()}
+        timing["timing_source"] = "benchmark"
+        return timing
+    timing = results_cache.load(PIPELINE_TIMING) or {}
+    timing = {f"{name}_time": timing[f"{name}_time"] for name in ENGINE_OUTPUTS
+              if f"{name}_time" in timing}
+    timing["timing_source"] = "pipeline" if timing else None
+    return timing
 
 # ===============================
 # 📈 COMPARISON ROUTES
@@ -164,44 +875,74 @@ def compare_page():
 @app.route("/api/compare")
 def compare_api():
     hour = request.args.get("hour", type=int)
-    agg = load_json_safe(AGG_JSON)
-    mapr = load_json_safe(MR_JSON)
-    metrics = compare_results(agg, mapr, hour)
+    others = {name: path for name, path in ENGINE_OUTPUTS.items()
+              if name not in ("aggregation", "mapreduce")}
+    paths = [AGG_JSON, MR_JSON, *others.values()]
+    metrics = dict(results_cache.memo(
+        paths + [meta_path(p) for p in paths], ("compare", hour),
+        lambda: compare_results(result_columns(AGG_JSON, hour), result_columns(MR_JSON, hour),
+                                {name: result_columns(path, hour)
+                                 for name, path in others.items()})))
 
-    timing = simulate_timing()
+    timing = measured_timing()
     metrics.update(timing)
-    metrics["speed_ratio"] = round(
-        timing["mapreduce_time"] / timing["aggregation_time"], 2
-    )
+    agg_time, mapr_time = timing.get("aggregation_time"), timing.get("mapreduce_time")
+    metrics["speed_ratio"] = round(mapr_time / agg_time, 2) if agg_time and mapr_time else None
 
-    # Save trend history (last 20 runs)
-    Path(DATA_RESULTS).mkdir(parents=True, exist_ok=True)
-    history = []
-    if os.path.exists(TIMING_FILE):
-        with open(TIMING_FILE) as f:
-            history = json.load(f)
-    history.append({
-        "timestamp": time.strftime("%H:%M:%S"),
-        "agg_time": timing["aggregation_time"],
-        "mapr_time": timing["mapreduce_time"],
-    })
-    with open(TIMING_FILE, "w") as f:
-        json.dump(history[-20:], f, indent=2)
-    metrics["trend"] = history[-10:]
+    metrics["trend"] = metrics_store.runs(source="benchmark", limit=10)
 
     return jsonify(metrics)
 
 @app.route("/api/trend")
 def trend_api():
-    if not os.path.exists(TIMING_FILE):
-        return jsonify([])
-    return jsonify(load_json_safe(TIMING_FILE))
+    """Recent timings: ?source=&since=&until=&limit= runs, or one ?engine= series"""
+    try:
+        since = (parse_date(request.args["since"], name="since").timestamp()
+                 if request.args.get("since") else None)
+        until = (parse_date(request.args["until"], end=True, name="until").timestamp()
+                 if request.args.get("until") else None)
+        limit = request.args.get("limit", default=TREND_LIMIT, type=int)
+        if not 1 <= limit <= TREND_LIMIT_MAX:
+            raise ValueError(f"limit must be 1-{TREND_LIMIT_MAX}")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    engine, source = request.args.get("engine"), request.args.get("source")
+    if engine:
+        return jsonify(metrics_store.series(engine, source, since, until, limit))
+    return jsonify(metrics_store.runs(source, since, until, limit))
+
+# ===============================
+# 📟 INSTRUMENTATION
+# ===============================
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # The URL rule, not the path, so /static/<path> and friends stay one series
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_SECONDS.observe(time.perf_counter() - started, route=route,
+                             method=request.method, status=str(response.status_code))
+        HTTP_BYTES.inc(response.content_length or 0, route=route)
+    return response
+
+@app.route("/metrics")
+def metrics_api():
+    """Prometheus text exposition of the stage, step, route and Mongo metrics"""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 # ===============================
 # 🏁 ENTRY POINT
 # ===============================
 if __name__ == "__main__":
-    run_full_pipeline(sample_rows=100000, drop=True)
+    # Run the pipeline in the background so the server starts serving the last
+    # results immediately. With the debug reloader only the child process
+    # (WERKZEUG_RUN_MAIN) starts the job.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        pipeline_jobs.start({"sample_rows": 100000, "drop": True})
     print("🚀 Unified Flask App running at:")
     print(" - http://127.0.0.1:5000 for main app")
     print(" - http://127.0.0.1:5000/compare for comparison dashboard")
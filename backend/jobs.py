@@ -0,0 +1,121 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+# Background pipeline jobs.
+#
+# One job runs at a time on a daemon thread. The job object is the shared
+# progress record: the pipeline reports stage start/finish through
+# job.stage_started / job.stage_finished and polls job.cancel_event between
+# units of work. Finished jobs are kept (up to JOB_HISTORY) for the status API.
+
+JOB_HISTORY = 20
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class PipelineJob:
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.status = "queued"
+        self.stages = OrderedDict()
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def stage_started(self, name):
+        with self.lock:
+            self.stages[name] = {"status": "running", "started_at": time.time(),
+                                 "seconds": None, "rows": None}
+
+    def stage_finished(self, name, seconds, rows=None):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"started_at": None})
+            stage.update(status="done", seconds=round(seconds, 3), rows=rows)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise PipelineCancelled(f"job {self.id} cancelled")
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def to_dict(self):
+        with self.lock:
+            stages = [dict(info, name=name) for name, info in self.stages.items()]
+        now = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "stages": stages,
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": round(now - self.started_at, 3) if self.started_at else None,
+            "cancel_requested": self.cancel_event.is_set(),
+        }
+
+
+class JobRunner:
+    """Runs `target(job)` for one PipelineJob at a time on a background thread"""
+
+    def __init__(self, target):
+        self.target = target
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.current = None
+
+    def start(self, params):
+        """Start a job, or return None if one is already running"""
+        with self.lock:
+            if self.current is not None and not self.current.done:
+                return None
+            job = PipelineJob(params)
+            self.jobs[job.id] = job
+            while len(self.jobs) > JOB_HISTORY:
+                self.jobs.popitem(last=False)
+            self.current = job
+        threading.Thread(target=self.run, args=(job,), name=f"pipeline-{job.id}",
+                         daemon=True).start()
+        return job
+
+    def run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            self.target(job)
+            job.status = "succeeded"
+        except PipelineCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+        finally:
+            job.finished_at = time.time()
+        print(f"Pipeline job {job.id} {job.status}")
+
+    def get(self, job_id=None):
+        """Job by id, or the most recent one"""
+        if job_id is None:
+            return self.current
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id=None):
+        job = self.get(job_id)
+        if job is not None and not job.done:
+            job.cancel_event.set()
+        return job
@@ -0,0 +1,89 @@
+import os
+import shutil
+import threading
+import time
+
+# Versioned publishing of pipeline results.
+#
+# A finished run's staged files are moved into releases/<id>/ under the
+# results directory, next to hard links to every file of the previous
+# release that the run did not rewrite, so each release is a complete result
+# set. `current` is a symlink to the live release and is swapped with a single
+# os.replace: readers go from one complete set to the next in one step, never
+# through a mix of old and new files. Each published name in the results
+# directory is a fixed symlink to current/<name>, so paths like
+# data/results/hourly_grid_counts.json keep working for every reader.
+#
+# Releases share the inodes of unchanged files, so nothing may write through
+# a link: every results writer goes to a temp name and os.replace()s it onto
+# the path (scripts/columnar.py save_atomic / write_json_atomic). A CLI or a
+# direct run_full_pipeline() call therefore swaps the link for a plain file
+# and leaves every release untouched; the next job that stages the same name
+# turns it back into a link. Files that are not pipeline results
+# (metrics.db, stage_manifest.json, benchmark.json) are plain files too.
+
+CURRENT = "current"
+RELEASES = "releases"
+# The live release plus the one before it (readers may still be finishing with it)
+KEEP_RELEASES = 2
+
+
+def current_release(results_dir):
+    """Directory the `current` link points to, or None before the first publish"""
+    link = os.path.join(results_dir, CURRENT)
+    return os.path.realpath(link) if os.path.islink(link) else None
+
+
+def swap_link(link, target):
+    """Point symlink `link` at `target` atomically (replacing whatever is at `link`)"""
+    tmp = f"{link}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.symlink(target, tmp)
+    os.replace(tmp, link)
+
+
+def release_name(job_id):
+    # Sortable by publish time; the job id keeps it unique across restarts
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{job_id}"
+
+
+def publish(staging_dir, results_dir, job_id):
+    """
+    Publish every file in `staging_dir` as a new release and make it current.
+    Returns the release directory.
+    """
+    releases = os.path.join(results_dir, RELEASES)
+    name = release_name(job_id)
+    release = os.path.join(releases, name)
+    os.makedirs(release)
+
+    staged = sorted(os.listdir(staging_dir))
+    for entry in staged:
+        os.replace(os.path.join(staging_dir, entry), os.path.join(release, entry))
+    # Carry the rest of the previous result set over (outputs of engines not in this run)
+    previous = current_release(results_dir)
+    if previous is not None:
+        for entry in os.listdir(previous):
+            src, dst = os.path.join(previous, entry), os.path.join(release, entry)
+            if os.path.isfile(src) and not os.path.lexists(dst):
+                os.link(src, dst)
+
+    swap_link(os.path.join(results_dir, CURRENT), os.path.join(RELEASES, name))
+
+    # A name published for the first time (or overwritten in place since)
+    # becomes a fixed link into `current`; one atomic replace per name
+    for entry in staged:
+        path, target = os.path.join(results_dir, entry), os.path.join(CURRENT, entry)
+        if not (os.path.islink(path) and os.readlink(path) == target):
+            swap_link(path, target)
+
+    prune(releases, current=release)
+    return release
+
+
+def prune(releases, current, keep=KEEP_RELEASES):
+    """Delete all but the newest `keep` releases, never `current` (open mmaps stay readable)"""
+    paths = sorted((os.path.join(releases, name) for name in os.listdir(releases)),
+                   key=os.path.getmtime, reverse=True)
+    for old in paths[keep:]:
+        if old != current:
+            shutil.rmtree(old, ignore_errors=True)
@@ -0,0 +1,231 @@
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from scripts.columnar import ColumnarResult, meta_path, unpack_cells, HOURS
+
+# In-memory cache of the JSON result files served by the API.
+#
+# Each file is parsed once, indexed by hour and pre-serialized into response
+# bytes (whole file + one body per hour). A cheap os.stat() on every lookup
+# reloads the entry only when the file's mtime or size changes, so requests
+# never pay for json.load().
+#
+# Grid result files that have a columnar store (scripts/columnar.py) are
+# served from memory-mapped columns instead: nothing is parsed up front and
+# only the bodies actually requested are serialized and kept.
+#
+# Both can also answer in the compact columnar wire format (format=columnar):
+# one array per field instead of one object per row, floats rounded, the hour
+# column replaced by an offset table. Those bodies are cached both plain and
+# gzip-compressed, so a request never compresses anything twice.
+
+MEMO_LIMIT = 256
+# Decimal places kept by the columnar wire format
+WIRE_DIGITS = {"avg_fare": 2, "avg_distance": 3}
+WIRE_FIELDS = ("grid_x", "grid_y", "count", "avg_fare", "avg_distance")
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def dump_bytes(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def wire_payload(columns, hour=None, offsets=None, extra=()):
+    """
+    Columnar response body: parallel arrays of WIRE_FIELDS plus the `extra`
+    integer fields of the store. All-hours bodies carry hour_offsets (rows of
+    hour h are [offsets[h], offsets[h + 1])).
+    """
+    payload = {"format": "columnar", "hour": hour, "rows": len(columns["count"])}
+    if offsets is not None:
+        payload["hour_offsets"] = [int(o) for o in offsets]
+    payload["columns"] = {
+        name: (np.round(np.asarray(columns[name], dtype=np.float64), WIRE_DIGITS[name]).tolist()
+               if name in WIRE_DIGITS else np.asarray(columns[name]).tolist())
+        for name in WIRE_FIELDS + tuple(extra)
+    }
+    return payload
+
+
+def rows_to_columns(rows):
+    return {name: [r[name] for r in rows] for name in WIRE_FIELDS}
+
+
+def hour_offsets(by_hour):
+    """Rows of hours 0..23 in order, and their offset table"""
+    rows, offsets = [], [0]
+    for hour in range(HOURS):
+        rows.extend(by_hour.get(hour, ()))
+        offsets.append(len(rows))
+    return rows, offsets
+
+
+def encode_body(payload, gzipped):
+    body = dump_bytes(payload)
+    return gzip.compress(body, mtime=0) if gzipped else body
+
+
+def check_hour(hour):
+    """Bodies are cached per hour, so only None or 0-23 may become a cache key"""
+    if hour is not None and not 0 <= hour < HOURS:
+        raise ValueError(f"hour must be 0-{HOURS - 1}")
+
+
+class WireBodies:
+    """Lazily encoded columnar wire bodies, keyed by (hour, gzipped)"""
+
+    def wire(self, hour=None, gzipped=False):
+        """(bytes, etag) of the columnar body for one hour or all hours"""
+        check_hour(hour)
+        key = (hour, gzipped)
+        body = self.wire_bodies.get(key)
+        if body is None:
+            body = self.wire_bodies[key] = encode_body(self.wire_payload(hour), gzipped)
+        tag = f"{self.etag}-w{'all' if hour is None else hour}"
+        return body, f"{tag}-gz" if gzipped else tag
+
+
+class ResultFile(WireBodies):
+    """One parsed result file with its per-hour index and serialized bodies"""
+
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        with open(path) as f:
+            self.data = json.load(f)
+
+        self.by_hour = {}
+        if isinstance(self.data, list):
+            for row in self.data:
+                if isinstance(row, dict) and row.get("hour") is not None:
+                    self.by_hour.setdefault(int(row["hour"]), []).append(row)
+
+        tag = f"{signature[1]:x}-{signature[0]:x}"
+        self.body = dump_bytes(self.data)
+        self.etag = tag
+        self.hour_bodies = {h: dump_bytes(rows) for h, rows in self.by_hour.items()}
+        self.empty_body = b"[]"
+        self.wire_bodies = {}
+
+    def hour_body(self, hour):
+        """(bytes, etag) for the rows of one hour"""
+        check_hour(hour)
+        return self.hour_bodies.get(hour, self.empty_body), f"{self.etag}-h{hour}"
+
+    def wire_payload(self, hour):
+        if hour is not None:
+            return wire_payload(rows_to_columns(self.by_hour.get(hour, [])), hour)
+        rows, offsets = hour_offsets(self.by_hour)
+        return wire_payload(rows_to_columns(rows), offsets=offsets)
+
+
+class ColumnarFile(WireBodies):
+    """Memory-mapped result store with lazily serialized bodies"""
+
+    def __init__(self, path, signature):
+        self.signature = signature
+        self.store = ColumnarResult(path)
+        self.etag = f"c{signature[1]:x}-{signature[0]:x}"
+        self.bodies = {}
+        self.wire_bodies = {}
+
+    def body(self, hour=None):
+        """(bytes, etag) for all rows, or the rows of one hour"""
+        check_hour(hour)
+        body = self.bodies.get(hour)
+        if body is None:
+            rows = self.store.rows() if hour is None else self.store.hour_rows(hour)
+            body = self.bodies[hour] = dump_bytes(rows)
+        return body, self.etag if hour is None else f"{self.etag}-h{hour}"
+
+    def wire_payload(self, hour):
+        # Straight from the mapped columns: no per-row dicts
+        start, end = (0, len(self.store)) if hour is None else self.store.hour_range(hour)
+        cols = {name: col[start:end] for name, col in self.store.columns.items()}
+        cols["grid_x"], cols["grid_y"] = unpack_cells(cols["cell"])
+        return wire_payload(cols, hour, self.store.offsets if hour is None else None,
+                            self.store.extra)
+
+
+class ResultsCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.columnar_entries = {}
+        self.memos = OrderedDict()  # least recently used first
+
+    def get(self, path):
+        """Current ResultFile for `path`, or None if the file does not exist"""
+        signature = file_signature(path)
+        if signature is None:
+            with self.lock:
+                self.entries.pop(path, None)
+            return None
+        entry = self.entries.get(path)
+        if entry is not None and entry.signature == signature:
+            return entry
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry.signature != signature:
+                entry = ResultFile(path, signature)
+                self.entries[path] = entry
+        return entry
+
+    def columnar(self, path):
+        """ColumnarFile for the result JSON `path`, or None if it has no (consistent) store"""
+        signature = file_signature(meta_path(path))
+        if signature is None:
+            return None
+        json_signature = file_signature(path)
+        if json_signature is not None and json_signature[0] > signature[0]:
+            # JSON rewritten by something that does not write the store: it wins
+            return None
+        entry = self.columnar_entries.get(path)
+        if entry is not None and entry.signature == signature:
+            return entry
+        with self.lock:
+            entry = self.columnar_entries.get(path)
+            if entry is None or entry.signature != signature:
+                try:
+                    entry = ColumnarFile(path, signature)
+                except (OSError, ValueError):
+                    # Missing column or a rewrite in progress: fall back to JSON
+                    return None
+                self.columnar_entries[path] = entry
+        return entry
+
+    def load(self, path):
+        """Parsed contents of `path` (shared, do not mutate), or None if missing"""
+        entry = self.get(path)
+        return entry.data if entry is not None else None
+
+    def memo(self, paths, key, compute):
+        """
+        Memoize compute() on the current signatures of `paths` plus `key`.
+
+        Used for values derived from several result files, e.g. the
+        aggregation vs MapReduce comparison.
+        """
+        full_key = (tuple(file_signature(p) for p in paths), key)
+        with self.lock:
+            if full_key in self.memos:
+                self.memos.move_to_end(full_key)
+                return self.memos[full_key]
+        value = compute()
+        with self.lock:
+            self.memos[full_key] = value
+            # Evict least recently used, so hot values (indexes) outlive one-off viewports
+            while len(self.memos) > MEMO_LIMIT:
+                self.memos.popitem(last=False)
+        return value
@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+# LRU cache with a time-to-live, for live Mongo queries.
+#
+# Entries expire `ttl` seconds after they were computed and the least
+# recently used entry is evicted beyond `maxsize`. Concurrent misses on the
+# same key are collapsed: the first caller computes, the others wait for
+# its result instead of sending the same aggregation to mongod again.
+
+
+class TTLCache:
+    def __init__(self, maxsize=256, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Cached value for `key`, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """(value, hit) for `key`, running compute() at most once per key at a time"""
+        value = self.get(key)
+        if value is not None:
+            with self.lock:
+                self.hits += 1
+            return value, True
+
+        with self.lock:
+            event = self.inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self.inflight[key] = threading.Event()
+                self.misses += 1
+        if not owner:
+            event.wait()
+            value = self.get(key)
+            if value is not None:
+                with self.lock:
+                    self.hits += 1
+                return value, True
+            # The owner failed; compute it ourselves
+            return compute(), False
+
+        try:
+            value = compute()
+            self.put(key, value)
+            return value, False
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            event.set()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses}
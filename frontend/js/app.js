@@ -1,29 +1,28 @@
 window.addEventListener("DOMContentLoaded", async () => {
-  // initialize map
-  const map = L.map('map').setView([40.73, -73.93], 11);
+  // initialize map (canvas renderer: one canvas instead of one SVG node per cell)
+  const map = L.map('map', { preferCanvas: true }).setView([40.73, -73.93], 11);
   L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
       attribution: '&copy; OpenStreetMap contributors'
   }).addTo(map);
 
   let hotspotLayerGroup = L.layerGroup().addTo(map);
   let anomalyLayerGroup = L.layerGroup().addTo(map);
+  let currentHour = 0;
 
-  // helper to draw hotspots
-  function drawHotspots(rows) {
+  // helper to draw hotspots; `scale` is cells per degree of the pyramid level
+  function drawHotspots(rows, scale) {
     hotspotLayerGroup.clearLayers();
-    if (!rows || rows.length === 0) {
-      alert("No hotspots found for this hour.");
-      return;
-    }
+    if (!rows || rows.length === 0) return;
     let maxCount = Math.max(...rows.map(r => r.count || 0));
+    // Cell edge in meters (1° of latitude ≈ 111km)
+    const cellMeters = 111000 / scale;
     rows.forEach(r => {
-      // grid_x and grid_y are already in proper coordinate format (multiplied by 100)
-      // Properly convert back: longitude = grid_x / 100, latitude = grid_y / 100
-      const longitude = r.grid_x / 100.0;
-      const latitude = r.grid_y / 100.0;
-      
-      // Scale radius based on hotspot intensity (count)
-      const radius = 80 + (r.count / Math.max(1, maxCount)) * 400;
+      // grid_x / grid_y are cell indices: longitude = grid_x / scale, latitude = grid_y / scale
+      const longitude = r.grid_x / scale;
+      const latitude = r.grid_y / scale;
+
+      // Scale radius with intensity (count), relative to the cell size
+      const radius = cellMeters * (0.1 + (r.count / Math.max(1, maxCount)) * 0.4);
       
       // Leaflet expects [latitude, longitude]
       L.circle([latitude, longitude], {
@@ -63,18 +62,56 @@ window.addEventListener("DOMContentLoaded", async () => {
     });
   }
 
-  // function to fetch hotspots for a specific hour
-  async function loadHotspots(hour) {
+  // rows of one hour from a columnar tiles payload (parallel arrays + hour offsets)
+  function hourRows(tiles, hour) {
+    const c = tiles.columns;
+    const rows = [];
+    for (let i = tiles.hour_offsets[hour]; i < tiles.hour_offsets[hour + 1]; i++) {
+      rows.push({
+        grid_x: c.grid_x[i],
+        grid_y: c.grid_y[i],
+        grid_key: `${c.grid_x[i]}_${c.grid_y[i]}`,
+        count: c.count[i],
+        avg_fare: c.avg_fare[i]
+      });
+    }
+    return rows;
+  }
+
+  // every hour of the current viewport, fetched once per pan/zoom
+  let tiles = null;
+  function showHour(hour) {
+    currentHour = hour;
+    document.getElementById("hourLabel").textContent = `${hour}:00`;
+    if (tiles) drawHotspots(hourRows(tiles, hour), tiles.scale);
+  }
+
+  // fetch the cells of the current viewport at the resolution for the current zoom
+  let requestSeq = 0;
+  async function loadHotspots() {
+    const seq = ++requestSeq;
+    const b = map.getBounds();
+    const bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map(v => v.toFixed(5)).join(",");
     try {
-      const resp = await fetch(`/api/hotspots?hour=${hour}`);
-      if (!resp.ok) throw new Error(`hotspots API failed: ${resp.status}`);
-      const hotspots = await resp.json();
-      drawHotspots(hotspots);
+      const resp = await fetch(`/api/tiles?format=columnar&zoom=${map.getZoom()}&bbox=${bbox}`);
+      if (!resp.ok) throw new Error(`tiles API failed: ${resp.status}`);
+      const payload = await resp.json();
+      // A newer pan/zoom superseded this request
+      if (seq !== requestSeq) return;
+      tiles = payload;
+      showHour(currentHour);
     } catch (err) {
       console.error("Failed to load hotspots:", err);
     }
   }
 
+  // refetch when the viewport changes (debounced so a drag issues one request)
+  let moveTimer = null;
+  map.on("moveend zoomend", () => {
+    clearTimeout(moveTimer);
+    moveTimer = setTimeout(loadHotspots, 150);
+  });
+
   // fetch anomalies once (they’re usually global)
   try {
     const resp2 = await fetch(`/api/anomalies`);
@@ -86,16 +123,11 @@ window.addEventListener("DOMContentLoaded", async () => {
     console.error("Failed to load anomalies:", err);
   }
 
-  // button event handler
-  document.getElementById("loadBtn").addEventListener("click", async () => {
-    const hour = parseInt(document.getElementById("hourInput").value);
-    if (isNaN(hour) || hour < 0 || hour > 23) {
-      alert("Please enter a valid hour (0–23).");
-      return;
-    }
-    await loadHotspots(hour);
+  // the slider only re-slices the loaded payload: no request per step
+  document.getElementById("hourInput").addEventListener("input", (e) => {
+    showHour(parseInt(e.target.value));
   });
 
-  // initial load for hour 0
-  await loadHotspots(0);
+  // initial load
+  await loadHotspots();
 });
@@ -1,33 +1,71 @@
-from pymongo import MongoClient
-import json
+import os
+
+from scripts.ingest import unpack_cell, COVERING_INDEX_NAME
+from scripts.mongo import get_client
+from scripts.columnar import write_columnar, write_json_atomic, EXPORT_SEPARATORS
+from scripts.instrumentation import step, write_step
+
+def detect_layout(coll):
+    """"compact" if trips carry a packed `cell` key, else "legacy" (grid_key strings)"""
+    doc = coll.find_one({}, {"_id": 0, "cell": 1})
+    return "compact" if doc and "cell" in doc else "legacy"
+
+def cell_row(cell, hour, count, avg_fare, avg_distance):
+    """Expand a packed cell into the hourly_grid_counts.json row schema"""
+    gx, gy = unpack_cell(cell)
+    return {
+        "count": count,
+        "avg_fare": avg_fare,
+        "avg_distance": avg_distance,
+        "grid_x": gx,
+        "grid_y": gy,
+        "grid_key": f"{gx}_{gy}",
+        "hour": hour
+    }
 
 def run_aggregation(mongo_uri, db_name, out_file):
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    pipeline = [
-        {"$group": {
-            "_id": {"grid_key": "$grid_key", "hour": "$hour"},
-            "count": {"$sum": 1},
-            "avg_fare": {"$avg": "$fare_amount"},
-            "avg_distance": {"$avg": "$trip_distance"},
-            "grid_x": {"$first": "$grid_x"},
-            "grid_y": {"$first": "$grid_y"}
-        }},
-        {"$project": {
-            "_id": 0,
-            "grid_key": "$_id.grid_key",
-            "hour": "$_id.hour",
-            "count": 1, "avg_fare": 1, "avg_distance": 1,
-            "grid_x": 1, "grid_y": 1
-        }}
-    ]
+    coll = get_client(mongo_uri)[db_name]["taxi_trips"]
 
-    result = list(db["taxi_trips"].aggregate(pipeline))
-    import os
+    if detect_layout(coll) == "compact":
+        # Groups on the (cell, hour, fare_amount, trip_distance) index only:
+        # every field the $group reads is in the index, so the scan is covered
+        pipeline = [
+            {"$group": {
+                "_id": {"cell": "$cell", "hour": "$hour"},
+                "count": {"$sum": 1},
+                "avg_fare": {"$avg": "$fare_amount"},
+                "avg_distance": {"$avg": "$trip_distance"}
+            }}
+        ]
+        with step("mongo_aggregate"):
+            result = [cell_row(r["_id"]["cell"], r["_id"]["hour"], r["count"],
+                               r["avg_fare"], r["avg_distance"])
+                      for r in coll.aggregate(pipeline, hint=COVERING_INDEX_NAME)]
+    else:
+        pipeline = [
+            {"$group": {
+                "_id": {"grid_key": "$grid_key", "hour": "$hour"},
+                "count": {"$sum": 1},
+                "avg_fare": {"$avg": "$fare_amount"},
+                "avg_distance": {"$avg": "$trip_distance"},
+                "grid_x": {"$first": "$grid_x"},
+                "grid_y": {"$first": "$grid_y"}
+            }},
+            {"$project": {
+                "_id": 0,
+                "grid_key": "$_id.grid_key",
+                "hour": "$_id.hour",
+                "count": 1, "avg_fare": 1, "avg_distance": 1,
+                "grid_x": 1, "grid_y": 1
+            }}
+        ]
+        with step("mongo_aggregate"):
+            result = list(coll.aggregate(pipeline))
 
     os.makedirs(os.path.dirname(out_file), exist_ok=True)
 
-    with open(out_file, "w") as f:
-        json.dump(result, f, indent=2)
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, result, EXPORT_SEPARATORS)
+    write_columnar(result, out_file)
     print(f"Aggregation complete: {len(result)} rows → {out_file}")
     return result
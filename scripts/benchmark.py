@@ -0,0 +1,258 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from scripts.ingest import ingest_data_streaming
+from scripts.aggregate import run_aggregation
+from scripts.mapreduce import run_mapreduce
+from scripts.bincount import run_bincount
+from scripts.multimonth import run_multimonth
+from scripts.migrate import migrate_to_compact
+from scripts.trip_cache import build_trip_cache
+from scripts.columnar import write_json_atomic
+from scripts.metrics_store import MetricsStore, METRICS_DB
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_RESULTS = os.path.join(PROJECT_ROOT, "data", "results")
+BENCHMARK_FILE = os.path.join(DATA_RESULTS, "benchmark.json")
+LAYOUT_BENCHMARK_FILE = os.path.join(DATA_RESULTS, "layout_benchmark.json")
+
+# Each engine gets (csv_path, mongo_uri, db_name, sample_rows, out_dir)
+ENGINES = {
+    "aggregation": lambda csv, uri, db, n, out: run_aggregation(
+        uri, db, os.path.join(out, "hourly_grid_counts.json")),
+    "mapreduce": lambda csv, uri, db, n, out: run_mapreduce(
+        uri, db, os.path.join(out, "mapreduce_hourly_grid_counts.json")),
+    "bincount": lambda csv, uri, db, n, out: run_bincount(
+        csv, os.path.join(out, "bincount_hourly_grid_counts.json"), sample_rows=n),
+    # A single path is a valid glob: times the pool + merge path on one file
+    "multimonth": lambda csv, uri, db, n, out: run_multimonth(
+        csv, os.path.join(out, "multimonth_hourly_grid_counts.json"), sample_rows=n),
+}
+
+
+def cpu_seconds():
+    """User + system CPU of this process and its reaped children (process pools)"""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def vm_hwm_kb():
+    """This address space's high-water RSS (Linux VmHWM), or None where /proc is missing"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    """
+    High-water RSS of this process and its largest child, in MB (Linux reports KB).
+
+    ru_maxrss never resets and even survives fork + exec, so a spawned child
+    inherits its parent's peak. VmHWM belongs to the current address space
+    and starts fresh in a spawned process; ru_maxrss is the fallback.
+    """
+    self_kb = vm_hwm_kb() or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(self_kb, child_kb) / 1024, 1)
+
+
+def time_engine(run, warmup, trials):
+    for _ in range(warmup):
+        run()
+    walls, cpus = [], []
+    for _ in range(trials):
+        c0, t0 = cpu_seconds(), time.perf_counter()
+        run()
+        walls.append(time.perf_counter() - t0)
+        cpus.append(cpu_seconds() - c0)
+    return walls, cpus
+
+
+def time_engine_isolated(engine, csv_path, mongo_uri, db_name, sample_rows, out_dir, warmup,
+                         trials):
+    """
+    time_engine for ENGINES[engine] in a fresh spawned process, so the peak RSS
+    it reports belongs to this engine alone. Returns (walls, cpus, peak_rss_mb).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(run_engine_trials, engine, csv_path, mongo_uri, db_name, sample_rows,
+                           out_dir, warmup, trials).result()
+
+
+def run_engine_trials(engine, csv_path, mongo_uri, db_name, sample_rows, out_dir, warmup, trials):
+    run = lambda: ENGINES[engine](csv_path, mongo_uri, db_name, sample_rows, out_dir)
+    walls, cpus = time_engine(run, warmup, trials)
+    return walls, cpus, peak_rss_mb()
+
+
+def summarize(engine, sample_rows, rows, walls, cpus, rss_mb):
+    wall_p50 = float(np.percentile(walls, 50))
+    return {
+        "engine": engine,
+        "sample_rows": sample_rows,
+        "rows": rows,
+        "trials": len(walls),
+        "wall_p50": round(wall_p50, 4),
+        "wall_p95": round(float(np.percentile(walls, 95)), 4),
+        "wall_mean": round(float(np.mean(walls)), 4),
+        "cpu_p50": round(float(np.percentile(cpus, 50)), 4),
+        "peak_rss_mb": rss_mb,
+        "rows_per_sec": round(rows / wall_p50, 1) if wall_p50 > 0 else None,
+        "walls": [round(w, 4) for w in walls],
+    }
+
+
+def append_history(results, sample_rows, path=METRICS_DB):
+    """Append one trend entry (p50 per engine at the given size) to the metrics store"""
+    p50 = {r["engine"]: r["wall_p50"] for r in results if r["sample_rows"] == sample_rows}
+    return MetricsStore(path).record("benchmark", p50, sample_rows=sample_rows)
+
+
+def run_benchmarks(csv_path, mongo_uri, db_name, sizes, engines=None, warmup=1, trials=5,
+                   out_file=BENCHMARK_FILE):
+    """
+    Run every engine at each sample size with warmup and repeated trials.
+
+    Ingest is done once per size and is not part of the engine timings.
+    Engine outputs go to a scratch directory next to `out_file` so the
+    results served by the API are left untouched.
+    """
+    engines = list(engines or ENGINES)
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        raise ValueError(f"Unknown engines: {sorted(unknown)}")
+    scratch = os.path.join(os.path.dirname(out_file), "benchmark_runs")
+    os.makedirs(scratch, exist_ok=True)
+
+    # Convert the CSV once up front; every ingest and CSV engine then reads the column cache
+    build_trip_cache(csv_path, max(sizes))
+
+    results = []
+    for sample_rows in sizes:
+        print(f"📏 Benchmarking sample_rows={sample_rows}")
+        rows = ingest_data_streaming(csv_path, mongo_uri, db_name,
+                                     sample_rows=sample_rows, drop=True)
+        for engine in engines:
+            summary = summarize(engine, sample_rows, rows,
+                                *time_engine_isolated(engine, csv_path, mongo_uri, db_name,
+                                                      sample_rows, scratch, warmup, trials))
+            results.append(summary)
+            print(f"  {engine}: p50={summary['wall_p50']}s p95={summary['wall_p95']}s "
+                  f"cpu={summary['cpu_p50']}s rss={summary['peak_rss_mb']}MB "
+                  f"rows/sec={summary['rows_per_sec']}")
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "csv_path": csv_path,
+        "warmup": warmup,
+        "trials": trials,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    write_json_atomic(out_file, report)
+    append_history(results, max(sizes), os.path.join(os.path.dirname(out_file),
+                                                      os.path.basename(METRICS_DB)))
+    print(f"Benchmark complete: {len(results)} results → {out_file}")
+    return report
+
+
+def run_layout_benchmark(csv_path, mongo_uri, db_name, sample_rows, warmup=1, trials=5,
+                         out_file=LAYOUT_BENCHMARK_FILE):
+    """
+    Before/after benchmark of the compact document layout.
+
+    Ingests in the legacy layout, measures collection/index size and the
+    aggregation, migrates in place with migrate_to_compact, then measures again.
+    """
+    scratch = os.path.join(os.path.dirname(out_file), "benchmark_runs")
+    os.makedirs(scratch, exist_ok=True)
+    run = lambda: time_engine_isolated("aggregation", csv_path, mongo_uri, db_name, sample_rows,
+                                       scratch, warmup, trials)
+
+    build_trip_cache(csv_path, sample_rows)
+    rows = ingest_data_streaming(csv_path, mongo_uri, db_name, sample_rows=sample_rows,
+                                 drop=True, layout="legacy")
+    before = summarize("aggregation", sample_rows, rows, *run())
+    migration = migrate_to_compact(mongo_uri, db_name)
+    after = summarize("aggregation", sample_rows, rows, *run())
+    before["collection"] = migration["before"]
+    after["collection"] = migration["after"]
+
+    def reduction(key):
+        b, a = migration["before"][key], migration["after"][key]
+        return round((1 - a / b) * 100, 1) if b else None
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "sample_rows": sample_rows,
+        "legacy": before,
+        "compact": after,
+        "size_reduction_pct": reduction("size_bytes"),
+        "index_reduction_pct": reduction("index_bytes"),
+        "aggregation_speedup": round(before["wall_p50"] / after["wall_p50"], 2)
+        if after["wall_p50"] else None,
+    }
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    write_json_atomic(out_file, report)
+    print(f"Layout benchmark: size -{report['size_reduction_pct']}%, "
+          f"aggregation {report['aggregation_speedup']}x → {out_file}")
+    return report
+
+
+def latest_timings(report, sample_rows=None):
+    """p50 wall time per engine at `sample_rows` (default: largest size benchmarked)"""
+    results = (report or {}).get("results") or []
+    if not results:
+        return {}
+    if sample_rows is None:
+        sample_rows = max(r["sample_rows"] or 0 for r in results)
+    return {r["engine"]: r["wall_p50"] for r in results
+            if (r["sample_rows"] or 0) == sample_rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hotspot aggregation engines")
+    parser.add_argument("--csv", default=os.path.join(PROJECT_ROOT, "data", "raw",
+                                                       "yellow_tripdata_2019-01.csv"))
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.getenv("MONGO_BENCH_DB", "taxi_hotspot_bench"))
+    parser.add_argument("--sizes", default="10000,100000",
+                        help="comma-separated sample_rows values")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--layouts", action="store_true",
+                        help="before/after benchmark of the compact document layout "
+                             "(uses the largest size)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    if args.layouts:
+        run_layout_benchmark(args.csv, args.mongo_uri, args.db, max(sizes),
+                             warmup=args.warmup, trials=args.trials,
+                             out_file=args.out or LAYOUT_BENCHMARK_FILE)
+        return
+    run_benchmarks(args.csv, args.mongo_uri, args.db, sizes,
+                   engines=[e for e in args.engines.split(",") if e],
+                   warmup=args.warmup, trials=args.trials, out_file=args.out or BENCHMARK_FILE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import pandas as pd
+
+from scripts.ingest import (load_zone_arrays, zone_index, read_trip_chunks,
+                            PICKUP_FORMAT, GRID_SCALE)
+from scripts.columnar import write_columnar, write_json_atomic, EXPORT_SEPARATORS
+from scripts.instrumentation import step, timed_chunks, write_step
+
+HOURS = 24
+
+
+def zone_hour_sums(csv_path, sample_rows=None, chunk_size=500000, size=None):
+    """
+    Build dense (n_zones x 24) arrays of trip count, fare sum and distance sum.
+
+    Every pickup maps to its PULocationID's centroid, so the zone/hour pair
+    fully determines the output cell. The group-by is a single np.bincount
+    over LocationID*24 + hour per chunk.
+    """
+    if size is None:
+        size = len(load_zone_arrays()[0])
+    count = np.zeros(size * HOURS, dtype=np.int64)
+    fare_sum = np.zeros(size * HOURS, dtype=np.float64)
+    dist_sum = np.zeros(size * HOURS, dtype=np.float64)
+
+    with read_trip_chunks(csv_path, chunk_size, sample_rows) as reader:
+        for df in timed_chunks(reader):
+            with step("bincount"):
+                hour = pd.to_datetime(df["tpep_pickup_datetime"], format=PICKUP_FORMAT).dt.hour.to_numpy()
+                flat = zone_index(df["PULocationID"].to_numpy(), size) * HOURS + hour
+                count += np.bincount(flat, minlength=size * HOURS)
+                fare_sum += np.bincount(flat, weights=df["fare_amount"].to_numpy(),
+                                        minlength=size * HOURS)
+                dist_sum += np.bincount(flat, weights=df["trip_distance"].to_numpy(),
+                                        minlength=size * HOURS)
+
+    shape = (size, HOURS)
+    return count.reshape(shape), fare_sum.reshape(shape), dist_sum.reshape(shape)
+
+
+def zone_cells(lat_lut, lon_lut, scale=GRID_SCALE):
+    """Distinct (grid_x, grid_y) cells of the zone lookup table and each zone's cell index"""
+    grid_x = np.floor(lon_lut * scale).astype(np.int64)
+    grid_y = np.floor(lat_lut * scale).astype(np.int64)
+    cells, inverse = np.unique(np.stack([grid_x, grid_y], axis=1), axis=0, return_inverse=True)
+    return cells, inverse.reshape(-1)
+
+
+def fold_zones_to_cells(count, fare_sum, dist_sum, lat_lut, lon_lut, scale=GRID_SCALE):
+    """
+    Fold zone x hour sums into grid cells (scale=100 -> 0.01 degree cells).
+
+    Returns rows with the same schema as hourly_grid_counts.json.
+    """
+    cells, inverse = zone_cells(lat_lut, lon_lut, scale)
+
+    cell_count = np.zeros((len(cells), HOURS), dtype=np.int64)
+    cell_fare = np.zeros((len(cells), HOURS), dtype=np.float64)
+    cell_dist = np.zeros((len(cells), HOURS), dtype=np.float64)
+    np.add.at(cell_count, inverse, count)
+    np.add.at(cell_fare, inverse, fare_sum)
+    np.add.at(cell_dist, inverse, dist_sum)
+
+    rows = []
+    cell_idx, hours = np.nonzero(cell_count)
+    for c, h in zip(cell_idx.tolist(), hours.tolist()):
+        n = int(cell_count[c, h])
+        gx, gy = int(cells[c, 0]), int(cells[c, 1])
+        rows.append({
+            "count": n,
+            "avg_fare": float(cell_fare[c, h]) / n,
+            "avg_distance": float(cell_dist[c, h]) / n,
+            "grid_x": gx,
+            "grid_y": gy,
+            "grid_key": f"{gx}_{gy}",
+            "hour": h
+        })
+    return rows
+
+
+def run_bincount(csv_path, out_file, sample_rows=None, chunk_size=500000):
+    """Dense in-process engine: same output as run_aggregation, no Mongo round trip"""
+    lat_lut, lon_lut = load_zone_arrays()
+    count, fare_sum, dist_sum = zone_hour_sums(csv_path, sample_rows, chunk_size, size=len(lat_lut))
+    result = fold_zones_to_cells(count, fare_sum, dist_sum, lat_lut, lon_lut)
+
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, result, EXPORT_SEPARATORS)
+    write_columnar(result, out_file)
+    print(f"Bincount aggregation complete: {len(result)} rows → {out_file}")
+    return result
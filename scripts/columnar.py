@@ -0,0 +1,186 @@
+import json
+import os
+import numpy as np
+
+from scripts.ingest import pack_cell
+
+# Columnar binary result store.
+#
+# Next to every hourly_grid_counts-style JSON file the engines write one .npy
+# per column plus an hour offset index:
+#
+#     hourly_grid_counts.cell.npy          int64 packed (grid_x, grid_y)
+#     hourly_grid_counts.hour.npy          int8
+#     hourly_grid_counts.count.npy         int64
+#     hourly_grid_counts.avg_fare.npy      float64
+#     hourly_grid_counts.avg_distance.npy  float64
+#     hourly_grid_counts.hour_offsets.npy  int64[25]: rows of hour h are
+#                                          [offsets[h], offsets[h + 1])
+#     hourly_grid_counts.meta.json         row count + columns, written last
+#
+# An engine with more integer fields per row (the sampled engine's interval)
+# passes them as `extra`; they get one int64 .npy each and are listed in the
+# meta, so readers pick them up without knowing the engine.
+#
+# Rows are sorted by (hour, cell). The meta also records the engine's row
+# fields in order, so rows() returns the same objects as its JSON export
+# (MapReduce rows, for one, have grid_key but no grid_x/grid_y). Readers np.load the columns with
+# mmap_mode="r" and slice an hour without parsing anything; the JSON file
+# stays as a compact (unindented) compatibility export. Every file is written
+# to a temp name and os.replace'd, so open mmaps keep the previous version
+# intact.
+
+HOURS = 24
+COLUMNS = (("cell", np.int64), ("hour", np.int8), ("count", np.int64),
+           ("avg_fare", np.float64), ("avg_distance", np.float64))
+INDEX = "hour_offsets"
+# Row fields rebuilt by ColumnarResult.rows(), in order (before any extra columns)
+ROW_FIELDS = ("count", "avg_fare", "avg_distance", "grid_x", "grid_y", "grid_key", "hour")
+# json.dump separators for the JSON export: no indentation or padding
+EXPORT_SEPARATORS = (",", ":")
+
+
+def store_stem(json_path):
+    return json_path[:-len(".json")] if json_path.endswith(".json") else json_path
+
+
+def column_path(json_path, name):
+    return f"{store_stem(json_path)}.{name}.npy"
+
+
+def meta_path(json_path):
+    return f"{store_stem(json_path)}.meta.json"
+
+
+def columnar_files(json_path):
+    """Every file of the store for `json_path`, meta last"""
+    return ([column_path(json_path, name) for name, _ in COLUMNS]
+            + [column_path(json_path, INDEX), meta_path(json_path)])
+
+
+def row_cells(rows):
+    """Packed cell per row, from grid_x/grid_y or (MapReduce rows) the grid_key string"""
+    gx = np.empty(len(rows), dtype=np.int64)
+    gy = np.empty(len(rows), dtype=np.int64)
+    for i, r in enumerate(rows):
+        if "grid_x" in r:
+            gx[i], gy[i] = r["grid_x"], r["grid_y"]
+        else:
+            x, y = r["grid_key"].split("_")
+            gx[i], gy[i] = int(x), int(y)
+    return pack_cell(gx, gy)
+
+
+def unpack_cells(cells):
+    """Vectorized unpack_cell -> (grid_x, grid_y) arrays"""
+    cells = np.asarray(cells, dtype=np.int64)
+    # Arithmetic shifts sign-extend, so the low word comes back as a signed int32
+    return cells >> 32, (cells << 32) >> 32
+
+
+def resolved_dir(path):
+    """Real directory of `path` with symlinks resolved (a published release, see backend/releases.py)"""
+    return os.path.dirname(os.path.realpath(path))
+
+
+def save_atomic(path, array):
+    tmp = path + ".tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def write_json_atomic(path, data, separators=None):
+    """
+    json.dump to a temp name, then os.replace onto `path`: readers never see a
+    partial file, and a published link (backend/releases.py) is replaced
+    rather than written through. `separators` gives a compact export.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=None if separators else 2, separators=separators)
+    os.replace(tmp, path)
+
+
+def write_columnar(rows, json_path, extra=()):
+    """
+    Write the columnar store for grid result `rows` next to `json_path`;
+    `extra` names further int64 row fields to store as columns.
+    """
+    types = COLUMNS + tuple((name, np.int64) for name in extra)
+    columns = {
+        "cell": row_cells(rows),
+        "hour": np.fromiter((r["hour"] for r in rows), dtype=np.int8, count=len(rows)),
+        "count": np.fromiter((r["count"] for r in rows), dtype=np.int64, count=len(rows)),
+        "avg_fare": np.fromiter((r["avg_fare"] for r in rows), dtype=np.float64, count=len(rows)),
+        "avg_distance": np.fromiter((r["avg_distance"] for r in rows), dtype=np.float64,
+                                    count=len(rows)),
+    }
+    for name in extra:
+        columns[name] = np.fromiter((r[name] for r in rows), dtype=np.int64, count=len(rows))
+    order = np.lexsort((columns["cell"], columns["hour"]))
+    for name, dtype in types:
+        save_atomic(column_path(json_path, name), columns[name][order].astype(dtype))
+    offsets = np.searchsorted(columns["hour"][order], np.arange(HOURS + 1)).astype(np.int64)
+    save_atomic(column_path(json_path, INDEX), offsets)
+
+    meta = {"rows": len(rows), "columns": {name: np.dtype(dtype).name for name, dtype in types},
+            "fields": [k for k in rows[0] if k in ROW_FIELDS or k in extra] if rows
+            else list(ROW_FIELDS + tuple(extra))}
+    write_json_atomic(meta_path(json_path), meta)
+
+
+class ColumnarResult:
+    """
+    Memory-mapped columns of one result store. Raises ValueError when the
+    files on disk are not one consistent version (e.g. mid-rewrite).
+    """
+
+    def __init__(self, json_path):
+        # Resolve links once, so the meta and every column come from the same release
+        json_path = os.path.join(resolved_dir(meta_path(json_path)), os.path.basename(json_path))
+        with open(meta_path(json_path)) as f:
+            self.meta = json.load(f)
+        self.columns = {name: np.load(column_path(json_path, name), mmap_mode="r")
+                        for name in self.meta["columns"]}
+        # Engine-specific columns beyond COLUMNS, in the order they were written
+        self.extra = [name for name in self.meta["columns"] if name not in dict(COLUMNS)]
+        natural = list(ROW_FIELDS) + self.extra
+        fields = self.meta.get("fields", natural)
+        # None: rows() needs no projection (stores written before "fields" existed too)
+        self.fields = None if fields == natural else fields
+        self.offsets = np.load(column_path(json_path, INDEX))
+        n = self.meta["rows"]
+        if any(len(col) != n for col in self.columns.values()) or self.offsets[-1] != n:
+            raise ValueError(f"inconsistent columnar store for {json_path}")
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def hour_range(self, hour):
+        if not 0 <= hour < HOURS:
+            return 0, 0
+        return int(self.offsets[hour]), int(self.offsets[hour + 1])
+
+    def rows(self, start=0, end=None, full=False):
+        """
+        Rows [start, end) shaped like the engine's JSON export, or with every
+        ROW_FIELDS field when `full` (e.g. grid_x/grid_y for MapReduce rows)
+        """
+        end = len(self) if end is None else end
+        cols = {name: col[start:end] for name, col in self.columns.items()}
+        gx, gy = unpack_cells(cols["cell"])
+        rows = [{"count": n, "avg_fare": fare, "avg_distance": dist,
+                 "grid_x": x, "grid_y": y, "grid_key": f"{x}_{y}", "hour": h}
+                for n, fare, dist, x, y, h in zip(
+                    cols["count"].tolist(), cols["avg_fare"].tolist(),
+                    cols["avg_distance"].tolist(), gx.tolist(), gy.tolist(),
+                    cols["hour"].tolist())]
+        for name in self.extra:
+            for row, value in zip(rows, cols[name].tolist()):
+                row[name] = value
+        if self.fields is not None and not full:
+            rows = [{k: row[k] for k in self.fields} for row in rows]
+        return rows
+
+    def hour_rows(self, hour):
+        return self.rows(*self.hour_range(hour))
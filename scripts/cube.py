@@ -0,0 +1,228 @@
+import calendar
+import json
+import os
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+from scripts.ingest import load_zone_arrays, zone_index, read_trip_chunks, PICKUP_FORMAT, GRID_SCALE
+from scripts.bincount import zone_cells, HOURS
+from scripts.columnar import save_atomic, write_json_atomic, resolved_dir
+
+# (cell, calendar day, hour) cube.
+#
+# count / fare_sum / dist_sum are dense (cells x days x 24) arrays saved as
+# .npy files next to the other results, so the API can np.load them with
+# mmap_mode="r" and answer date-range / day-of-week / hour-window questions
+# by slicing and summing, without touching MongoDB.
+#
+# The day axis spans the calendar months that hold at least MIN_MONTH_SHARE
+# of the trips; the TLC files carry a few pickups with bogus dates (2008,
+# 2088, ...) which are dropped and counted in the meta file.
+
+CUBE_ARRAYS = ("count", "fare_sum", "dist_sum")
+CUBE_PREFIX = "cube_"
+CUBE_META = CUBE_PREFIX + "meta.json"
+MIN_MONTH_SHARE = 0.01
+MAX_DAYS = 31
+
+
+def cube_files(results_dir):
+    """Paths of the cube files; the meta file is written last and marks a complete cube"""
+    names = [f"{CUBE_PREFIX}{name}.npy" for name in CUBE_ARRAYS + ("cells",)]
+    return [os.path.join(results_dir, n) for n in names] + [os.path.join(results_dir, CUBE_META)]
+
+
+def month_sums(csv_path, size, sample_rows=None, chunk_size=500000):
+    """
+    {(year, month): (count, fare_sum, dist_sum)} with (zones x 31 x 24) arrays,
+    one np.bincount per month present in a chunk.
+    """
+    flat_size = size * MAX_DAYS * HOURS
+    months = {}
+    with read_trip_chunks(csv_path, chunk_size, sample_rows) as reader:
+        for df in reader:
+            pickup = pd.to_datetime(df["tpep_pickup_datetime"], format=PICKUP_FORMAT)
+            year = pickup.dt.year.to_numpy()
+            month = pickup.dt.month.to_numpy()
+            flat = ((zone_index(df["PULocationID"].to_numpy(), size) * MAX_DAYS
+                     + pickup.dt.day.to_numpy() - 1) * HOURS + pickup.dt.hour.to_numpy())
+            fare = df["fare_amount"].to_numpy()
+            dist = df["trip_distance"].to_numpy()
+            key = year * 12 + (month - 1)
+            for k in np.unique(key).tolist():
+                sel = key == k
+                ym = (k // 12, k % 12 + 1)
+                if ym not in months:
+                    months[ym] = (np.zeros(flat_size, dtype=np.int64),
+                                  np.zeros(flat_size, dtype=np.float64),
+                                  np.zeros(flat_size, dtype=np.float64))
+                count, fare_sum, dist_sum = months[ym]
+                count += np.bincount(flat[sel], minlength=flat_size)
+                fare_sum += np.bincount(flat[sel], weights=fare[sel], minlength=flat_size)
+                dist_sum += np.bincount(flat[sel], weights=dist[sel], minlength=flat_size)
+    shape = (size, MAX_DAYS, HOURS)
+    return {ym: tuple(a.reshape(shape) for a in arrays) for ym, arrays in months.items()}
+
+
+def month_window(months):
+    """First and last (year, month) holding at least MIN_MONTH_SHARE of all trips"""
+    totals = {ym: int(arrays[0].sum()) for ym, arrays in months.items()}
+    total = sum(totals.values())
+    kept = sorted(ym for ym, n in totals.items() if n >= total * MIN_MONTH_SHARE)
+    return kept[0], kept[-1]
+
+
+def build_cube(months, lat_lut, lon_lut, scale=GRID_SCALE):
+    """Stitch the month window into (cells x days x 24) arrays -> (arrays, cells, meta)"""
+    first, last = month_window(months)
+    span = []
+    y, m = first
+    while (y, m) <= last:
+        span.append((y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+    cells, inverse = zone_cells(lat_lut, lon_lut, scale)
+    days = sum(calendar.monthrange(y, m)[1] for y, m in span)
+    arrays = {"count": np.zeros((len(cells), days, HOURS), dtype=np.int64),
+              "fare_sum": np.zeros((len(cells), days, HOURS), dtype=np.float64),
+              "dist_sum": np.zeros((len(cells), days, HOURS), dtype=np.float64)}
+    offset = 0
+    for y, m in span:
+        ndays = calendar.monthrange(y, m)[1]
+        if (y, m) in months:
+            for name, zone_arr in zip(CUBE_ARRAYS, months[(y, m)]):
+                np.add.at(arrays[name][:, offset:offset + ndays], inverse, zone_arr[:, :ndays])
+        offset += ndays
+
+    kept = int(arrays["count"].sum())
+    meta = {
+        "start_date": date(*first, 1).isoformat(),
+        "days": days,
+        "hours": HOURS,
+        "cells": len(cells),
+        "scale": scale,
+        "rows": kept,
+        "dropped_rows": sum(int(a[0].sum()) for a in months.values()) - kept,
+    }
+    return arrays, cells, meta
+
+
+def run_cube(csv_path, results_dir, sample_rows=None, chunk_size=500000):
+    lat_lut, lon_lut = load_zone_arrays()
+    months = month_sums(csv_path, len(lat_lut), sample_rows, chunk_size)
+    if not months:
+        print("Cube: no trips, nothing written")
+        return 0
+    arrays, cells, meta = build_cube(months, lat_lut, lon_lut)
+
+    os.makedirs(results_dir, exist_ok=True)
+    # The API has these files mmapped: replace them (new inodes), never truncate, meta last
+    for name in CUBE_ARRAYS:
+        save_atomic(os.path.join(results_dir, f"{CUBE_PREFIX}{name}.npy"), arrays[name])
+    save_atomic(os.path.join(results_dir, f"{CUBE_PREFIX}cells.npy"), cells)
+    write_json_atomic(os.path.join(results_dir, CUBE_META), meta)
+    print(f"Cube complete: {meta['cells']} cells x {meta['days']} days x {HOURS} hours "
+          f"from {meta['start_date']} ({meta['rows']} trips, {meta['dropped_rows']} outside "
+          f"the window) → {results_dir}")
+    return meta["rows"]
+
+
+def parse_dows(text):
+    """"weekday", "weekend" or comma-separated ISO weekdays 0=Mon..6=Sun"""
+    if text == "weekday":
+        return [0, 1, 2, 3, 4]
+    if text == "weekend":
+        return [5, 6]
+    try:
+        dows = sorted({int(d) for d in text.split(",")})
+    except ValueError:
+        dows = None
+    if dows is None or not all(0 <= d <= 6 for d in dows):
+        raise ValueError("dow must be 0 (Mon) .. 6 (Sun), weekday or weekend")
+    return dows
+
+
+class Cube:
+    """Memory-mapped cube loaded from `results_dir`"""
+
+    def __init__(self, results_dir):
+        # One release for the meta and every array, even if `current` moves meanwhile
+        results_dir = resolved_dir(os.path.join(results_dir, CUBE_META))
+        with open(os.path.join(results_dir, CUBE_META)) as f:
+            self.meta = json.load(f)
+        for name in CUBE_ARRAYS + ("cells",):
+            setattr(self, name, np.load(os.path.join(results_dir, f"{CUBE_PREFIX}{name}.npy"),
+                                        mmap_mode="r"))
+        self.start = date.fromisoformat(self.meta["start_date"])
+        self.scale = self.meta["scale"]
+        # ISO weekday (0=Mon) of every day on the day axis
+        self.dows = (np.arange(self.meta["days"]) + self.start.weekday()) % 7
+
+    @property
+    def end(self):
+        return self.start + timedelta(days=self.meta["days"] - 1)
+
+    def day_indices(self, date_from=None, date_to=None, dows=None):
+        """Day-axis indices within [date_from, date_to] (inclusive) on the given weekdays"""
+        lo = max((date_from - self.start).days, 0) if date_from else 0
+        hi = min((date_to - self.start).days + 1, self.meta["days"]) if date_to else self.meta["days"]
+        days = np.arange(lo, max(lo, hi))
+        if dows is not None:
+            days = days[np.isin(self.dows[days], dows)]
+        return days
+
+    def query(self, date_from=None, date_to=None, dows=None, hours=None, group_by="cell",
+              limit=None):
+        """
+        Sum the selected days and hours. group_by "cell" -> one row per cell,
+        "hour" -> per (cell, hour) like hourly_grid_counts.json, "day" -> a
+        daily series over all cells.
+        """
+        days = self.day_indices(date_from, date_to, dows)
+        hours = np.arange(HOURS) if hours is None else np.asarray(hours)
+        # Contiguous day slice first (cheap view on the mmap), then fancy-index the rest
+        lo, hi = (int(days[0]), int(days[-1]) + 1) if len(days) else (0, 0)
+        rel = days - lo
+        sums = {name: getattr(self, name)[:, lo:hi][:, rel][:, :, hours] for name in CUBE_ARRAYS}
+
+        if group_by == "day":
+            count = sums["count"].sum(axis=(0, 2))
+            fare = sums["fare_sum"].sum(axis=(0, 2))
+            dist = sums["dist_sum"].sum(axis=(0, 2))
+            return [{"date": (self.start + timedelta(days=int(d))).isoformat(),
+                     "count": int(n),
+                     "avg_fare": float(f) / n if n else None,
+                     "avg_distance": float(s) / n if n else None}
+                    for d, n, f, s in zip(days.tolist(), count.tolist(), fare.tolist(),
+                                          dist.tolist())]
+
+        if group_by == "hour":
+            count = sums["count"].sum(axis=1)
+            fare = sums["fare_sum"].sum(axis=1)
+            dist = sums["dist_sum"].sum(axis=1)
+            cell_idx, hour_idx = np.nonzero(count)
+            keys = [(c, int(hours[h])) for c, h in zip(cell_idx.tolist(), hour_idx.tolist())]
+            values = list(zip(count[cell_idx, hour_idx].tolist(), fare[cell_idx, hour_idx].tolist(),
+                              dist[cell_idx, hour_idx].tolist()))
+        elif group_by == "cell":
+            count = sums["count"].sum(axis=(1, 2))
+            fare = sums["fare_sum"].sum(axis=(1, 2))
+            dist = sums["dist_sum"].sum(axis=(1, 2))
+            cell_idx = np.flatnonzero(count)
+            keys = [(c, None) for c in cell_idx.tolist()]
+            values = list(zip(count[cell_idx].tolist(), fare[cell_idx].tolist(),
+                              dist[cell_idx].tolist()))
+        else:
+            raise ValueError(f"unknown group_by: {group_by}")
+
+        rows = []
+        for (c, hour), (n, f, s) in zip(keys, values):
+            gx, gy = int(self.cells[c, 0]), int(self.cells[c, 1])
+            row = {"count": int(n), "avg_fare": f / n, "avg_distance": s / n,
+                   "grid_x": gx, "grid_y": gy, "grid_key": f"{gx}_{gy}"}
+            if hour is not None:
+                row["hour"] = hour
+            rows.append(row)
+        rows.sort(key=lambda r: r["count"], reverse=True)
+        return rows[:limit] if limit else rows
@@ -0,0 +1,134 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from scripts.ingest import load_zone_arrays, zone_index, PICKUP_FORMAT
+from scripts.trip_cache import read_trip_chunks, TRIP_COLUMNS
+from scripts.bincount import HOURS
+from scripts.columnar import save_atomic, write_json_atomic, resolved_dir
+
+# Origin-destination flow tensor.
+#
+# count and fare_sum are dense (24 x zones x zones) arrays indexed by
+# [pickup hour, PULocationID, DOLocationID], built with one np.bincount per
+# chunk over the raw columns (the trip cache keeps DOLocationID). They are
+# saved as .npy next to the other results and memory-mapped by the API, so
+# "where does this zone's demand go at 8am" is a slice plus an argpartition
+# instead of a $group over every trip. Hour is the leading axis so one
+# hour's origin x destination matrix is a contiguous block of the file.
+#
+# Zone slots follow load_zone_arrays(): IDs are their own index and the last
+# slot collects unknown IDs. Queries leave that slot out.
+
+FLOW_ARRAYS = ("count", "fare_sum")
+FLOWS_PREFIX = "flows_"
+FLOWS_META = FLOWS_PREFIX + "meta.json"
+FLOW_COLUMNS = TRIP_COLUMNS + ["DOLocationID"]
+
+
+def flow_files(results_dir):
+    """Paths of the flow files; the meta file is written last and marks a complete tensor"""
+    names = [f"{FLOWS_PREFIX}{name}.npy" for name in FLOW_ARRAYS + ("zones",)]
+    return [os.path.join(results_dir, n) for n in names] + [os.path.join(results_dir, FLOWS_META)]
+
+
+def flow_sums(csv_path, size, sample_rows=None, chunk_size=500000):
+    """(24 x zones x zones) trip count and fare sum"""
+    flat_size = size * size * HOURS
+    count = np.zeros(flat_size, dtype=np.int64)
+    fare_sum = np.zeros(flat_size, dtype=np.float64)
+    with read_trip_chunks(csv_path, chunk_size, sample_rows, columns=FLOW_COLUMNS) as reader:
+        for df in reader:
+            hour = pd.to_datetime(df["tpep_pickup_datetime"], format=PICKUP_FORMAT).dt.hour.to_numpy()
+            flat = ((hour * size + zone_index(df["PULocationID"].to_numpy(), size)) * size
+                    + zone_index(df["DOLocationID"].to_numpy(), size))
+            count += np.bincount(flat, minlength=flat_size)
+            fare_sum += np.bincount(flat, weights=df["fare_amount"].to_numpy(), minlength=flat_size)
+    shape = (HOURS, size, size)
+    return count.reshape(shape), fare_sum.reshape(shape)
+
+
+def run_flows(csv_path, results_dir, sample_rows=None, chunk_size=500000):
+    lat_lut, lon_lut = load_zone_arrays()
+    count, fare_sum = flow_sums(csv_path, len(lat_lut), sample_rows, chunk_size)
+
+    os.makedirs(results_dir, exist_ok=True)
+    # FlowTensor mmaps these files: replace them (new inodes), never truncate, meta last
+    save_atomic(os.path.join(results_dir, f"{FLOWS_PREFIX}count.npy"), count)
+    save_atomic(os.path.join(results_dir, f"{FLOWS_PREFIX}fare_sum.npy"), fare_sum)
+    save_atomic(os.path.join(results_dir, f"{FLOWS_PREFIX}zones.npy"),
+                np.stack([lat_lut, lon_lut], axis=1))
+    meta = {"zones": len(lat_lut), "hours": HOURS, "rows": int(count.sum()),
+            "pairs": int(np.count_nonzero(count.sum(axis=0)))}
+    write_json_atomic(os.path.join(results_dir, FLOWS_META), meta)
+    print(f"Flows complete: {HOURS}x{meta['zones']}x{meta['zones']} tensor, {meta['rows']} trips "
+          f"over {meta['pairs']} zone pairs → {results_dir}")
+    return meta["rows"]
+
+
+def top_k(values, k):
+    """Indices of the k largest non-zero values, largest first (argpartition, then sort k)"""
+    # Most pairs are empty, and runs of equal zeros are introselect's worst case
+    nonzero = np.flatnonzero(values)
+    k = min(k, len(nonzero))
+    if k <= 0:
+        return nonzero[:0]
+    idx = nonzero[np.argpartition(values[nonzero], -k)[-k:]]
+    return idx[np.argsort(values[idx], kind="stable")[::-1]]
+
+
+class FlowTensor:
+    """Memory-mapped flow tensor loaded from `results_dir`"""
+
+    def __init__(self, results_dir):
+        # One release for the meta and every array, even if `current` moves meanwhile
+        results_dir = resolved_dir(os.path.join(results_dir, FLOWS_META))
+        with open(os.path.join(results_dir, FLOWS_META)) as f:
+            self.meta = json.load(f)
+        for name in FLOW_ARRAYS + ("zones",):
+            setattr(self, name, np.load(os.path.join(results_dir, f"{FLOWS_PREFIX}{name}.npy"),
+                                        mmap_mode="r"))
+        # Known zones only: the last slot holds unknown LocationIDs
+        self.n_zones = self.meta["zones"] - 1
+        self.totals = {}
+
+    def matrix(self, hour=None):
+        """(count, fare_sum) origin x destination matrices for one hour or the whole day"""
+        if hour is not None:
+            return (self.count[hour, :self.n_zones, :self.n_zones],
+                    self.fare_sum[hour, :self.n_zones, :self.n_zones])
+        if "day" not in self.totals:
+            # Summed once per loaded tensor, then every all-day query reuses it
+            self.totals["day"] = (self.count[:, :self.n_zones, :self.n_zones].sum(axis=0),
+                                  self.fare_sum[:, :self.n_zones, :self.n_zones].sum(axis=0))
+        return self.totals["day"]
+
+    def flow_row(self, origin, dest, n, fare):
+        return {
+            "origin": origin,
+            "destination": dest,
+            "count": n,
+            "avg_fare": fare / n,
+            "origin_lat": float(self.zones[origin, 0]),
+            "origin_lon": float(self.zones[origin, 1]),
+            "dest_lat": float(self.zones[dest, 0]),
+            "dest_lon": float(self.zones[dest, 1]),
+        }
+
+    def destinations(self, zone, hour=None, k=10):
+        """Top-k destinations of trips picked up in `zone` -> (rows, total trips from zone)"""
+        count, fare = self.matrix(hour)
+        row = np.asarray(count[zone])
+        idx = top_k(row, k)
+        return [self.flow_row(zone, d, int(row[d]), float(fare[zone, d])) for d in idx.tolist()], \
+            int(row.sum())
+
+    def corridors(self, hour=None, k=10):
+        """Top-k (origin, destination) pairs overall -> (rows, total trips)"""
+        count, fare = self.matrix(hour)
+        flat = np.asarray(count).reshape(-1)
+        idx = top_k(flat, k)
+        origins, dests = np.divmod(idx, self.n_zones)
+        return [self.flow_row(o, d, int(count[o, d]), float(fare[o, d]))
+                for o, d in zip(origins.tolist(), dests.tolist())], int(flat.sum())
@@ -0,0 +1,109 @@
+import heapq
+import math
+
+from scripts.ingest import GRID_SCALE
+
+# In-memory query index over one hourly_grid_counts-style result.
+#
+# For every hour (and for the whole day, hour=None, with one row per cell)
+# the rows are kept sorted busiest first, so top-k with an offset is a list
+# slice. The same tables hash each row by its (grid_x, grid_y) cell; the
+# cells already form a regular grid, so nearest-k walks square rings of
+# cells outwards from the query point and stops as soon as no unvisited
+# ring can hold anything closer than the k-th hit.
+
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320
+
+
+def day_rows(rows):
+    """Fold (cell, hour) rows into one all-day row per cell"""
+    cells = {}
+    for r in rows:
+        key = (r["grid_x"], r["grid_y"])
+        acc = cells.get(key)
+        if acc is None:
+            acc = cells[key] = [0, 0.0, 0.0]
+        acc[0] += r["count"]
+        acc[1] += r["avg_fare"] * r["count"]
+        acc[2] += r["avg_distance"] * r["count"]
+    return [{"count": n, "avg_fare": fare / n, "avg_distance": dist / n,
+             "grid_x": gx, "grid_y": gy, "grid_key": f"{gx}_{gy}"}
+            for (gx, gy), (n, fare, dist) in cells.items()]
+
+
+class HourTable:
+    """Rows of one hour, busiest first, plus a cell -> position hash"""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda r: r["count"], reverse=True)
+        self.cells = {(r["grid_x"], r["grid_y"]): i for i, r in enumerate(self.rows)}
+        xs = [x for x, _ in self.cells] or [0]
+        ys = [y for _, y in self.cells] or [0]
+        self.bounds = (min(xs), min(ys), max(xs), max(ys))
+
+
+def ring(qx, qy, r, bounds):
+    """Cells at Chebyshev distance r from (qx, qy), clipped to bounds"""
+    min_x, min_y, max_x, max_y = bounds
+    if r == 0:
+        yield qx, qy
+        return
+    x_lo, x_hi = max(qx - r, min_x), min(qx + r, max_x)
+    for y in (qy - r, qy + r):
+        if min_y <= y <= max_y:
+            for x in range(x_lo, x_hi + 1):
+                yield x, y
+    y_lo, y_hi = max(qy - r + 1, min_y), min(qy + r - 1, max_y)
+    for x in (qx - r, qx + r):
+        if min_x <= x <= max_x:
+            for y in range(y_lo, y_hi + 1):
+                yield x, y
+
+
+class HotspotIndex:
+    def __init__(self, rows, scale=GRID_SCALE):
+        self.scale = scale
+        by_hour = {}
+        for r in rows:
+            by_hour.setdefault(r["hour"], []).append(r)
+        self.tables = {hour: HourTable(hour_rows) for hour, hour_rows in by_hour.items()}
+        self.tables[None] = HourTable(day_rows(rows))
+
+    def top(self, hour=None, k=10, offset=0):
+        """(rows offset..offset+k of the hour, busiest first; total rows of the hour)"""
+        table = self.tables.get(hour)
+        if table is None:
+            return [], 0
+        return table.rows[offset:offset + k], len(table.rows)
+
+    def nearest(self, lat, lon, k=10, hour=None):
+        """The k cells of the hour whose centroids are closest to (lat, lon), nearest first"""
+        table = self.tables.get(hour)
+        if table is None or not table.rows:
+            return []
+        kx = KM_PER_DEG_LON * math.cos(math.radians(lat))
+        ky = KM_PER_DEG_LAT
+        qx, qy = math.floor(lon * self.scale), math.floor(lat * self.scale)
+        min_x, min_y, max_x, max_y = table.bounds
+        # No ring closer than the data's bounding box can hold a cell
+        first = max(min_x - qx, qx - max_x, min_y - qy, qy - max_y, 0)
+        last = max(qx - min_x, max_x - qx, qy - min_y, max_y - qy)
+
+        best = []  # max-heap of (-distance, position), at most k entries
+        for r in range(first, last + 1):
+            # A centroid in ring r is at least r - 0.5 cells away along some axis
+            if len(best) == k and -best[0][0] <= (r - 0.5) / self.scale * min(kx, ky):
+                break
+            for cell in ring(qx, qy, r, table.bounds):
+                pos = table.cells.get(cell)
+                if pos is None:
+                    continue
+                d = math.hypot(((cell[0] + 0.5) / self.scale - lon) * kx,
+                               ((cell[1] + 0.5) / self.scale - lat) * ky)
+                if len(best) < k:
+                    heapq.heappush(best, (-d, pos))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, pos))
+        return [dict(table.rows[pos], distance_km=-neg)
+                for neg, pos in sorted(best, reverse=True)]
@@ -0,0 +1,170 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pymongo import ASCENDING
+
+from scripts.ingest import ingest_data_streaming, unpack_cell, SUMS_COLLECTION
+from scripts.aggregate import detect_layout
+from scripts.mongo import get_client
+from scripts.columnar import write_columnar, write_json_atomic, EXPORT_SEPARATORS
+from scripts.instrumentation import write_step
+
+# Incremental aggregation.
+#
+# `hourly_grid_sums` holds running totals per (cell, hour): count,
+# fare_sum and dist_sum. Each ingest run tags its trips with a batch_id; only
+# that batch is grouped and $merge'd into the running sums, and only the
+# cells it touched are rewritten in hourly_grid_counts.json. Averages are
+# derived from the sums when read, so they stay exact as batches accumulate.
+
+BATCHES_COLLECTION = "ingest_batches"
+
+
+def new_batch_id():
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def group_stage(layout):
+    if layout == "compact":
+        return {"$group": {
+            "_id": {"cell": "$cell", "hour": "$hour"},
+            "count": {"$sum": 1},
+            "fare_sum": {"$sum": "$fare_amount"},
+            "dist_sum": {"$sum": "$trip_distance"}
+        }}
+    return {"$group": {
+        "_id": {"grid_key": "$grid_key", "hour": "$hour"},
+        "count": {"$sum": 1},
+        "fare_sum": {"$sum": "$fare_amount"},
+        "dist_sum": {"$sum": "$trip_distance"},
+        "grid_x": {"$first": "$grid_x"},
+        "grid_y": {"$first": "$grid_y"}
+    }}
+
+
+def merge_batch(db, batch_id):
+    """
+    Group one ingested batch and fold it into the running sums with $merge.
+
+    Cells touched by the batch are stamped with last_batch = batch_id so the
+    caller can read back exactly the affected rows.
+    """
+    sums = db[SUMS_COLLECTION]
+    sums.create_index([("last_batch", ASCENDING)])
+    db["taxi_trips"].aggregate([
+        {"$match": {"batch_id": batch_id}},
+        group_stage(detect_layout(db["taxi_trips"])),
+        {"$set": {"last_batch": {"$literal": batch_id}}},
+        {"$merge": {
+            "into": SUMS_COLLECTION,
+            "on": "_id",
+            "whenMatched": [{"$set": {
+                "count": {"$add": ["$count", "$$new.count"]},
+                "fare_sum": {"$add": ["$fare_sum", "$$new.fare_sum"]},
+                "dist_sum": {"$add": ["$dist_sum", "$$new.dist_sum"]},
+                "last_batch": "$$new.last_batch"
+            }}],
+            "whenNotMatched": "insert"
+        }}
+    ])
+    return list(sums.find({"last_batch": batch_id}))
+
+
+def rebuild_sums(db, batch_id=None):
+    """Recompute the running sums from every trip in taxi_trips"""
+    pipeline = [group_stage(detect_layout(db["taxi_trips"]))]
+    if batch_id is not None:
+        pipeline.append({"$set": {"last_batch": {"$literal": batch_id}}})
+    pipeline.append({"$out": SUMS_COLLECTION})
+    db["taxi_trips"].aggregate(pipeline)
+    db[SUMS_COLLECTION].create_index([("last_batch", ASCENDING)])
+    return list(db[SUMS_COLLECTION].find())
+
+
+def sums_to_row(doc):
+    """Derive the hourly_grid_counts.json row for one running-sum document"""
+    count = doc["count"]
+    if "cell" in doc["_id"]:
+        gx, gy = unpack_cell(doc["_id"]["cell"])
+    else:
+        gx, gy = doc["grid_x"], doc["grid_y"]
+    return {
+        "count": count,
+        "avg_fare": doc["fare_sum"] / count,
+        "avg_distance": doc["dist_sum"] / count,
+        "grid_x": gx,
+        "grid_y": gy,
+        "grid_key": f"{gx}_{gy}",
+        "hour": doc["_id"]["hour"]
+    }
+
+
+def update_results_file(docs, out_file, replace=False):
+    """
+    Rewrite only the affected (grid_key, hour) rows of `out_file`.
+
+    Rows for untouched cells are kept as they are; the file is replaced
+    atomically so readers never see a partial write.
+    """
+    rows = []
+    if not replace and os.path.exists(out_file):
+        with open(out_file) as f:
+            rows = json.load(f)
+    position = {(r["grid_key"], r["hour"]): i for i, r in enumerate(rows)}
+    for doc in docs:
+        row = sums_to_row(doc)
+        key = (row["grid_key"], row["hour"])
+        if key in position:
+            rows[position[key]] = row
+        else:
+            position[key] = len(rows)
+            rows.append(row)
+
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, rows, EXPORT_SEPARATORS)
+    write_columnar(rows, out_file)
+    return rows
+
+
+def run_incremental(csv_path, mongo_uri, db_name, out_file, sample_rows=None, chunk_size=100000,
+                    should_stop=None):
+    """
+    Append one CSV to taxi_trips and fold it into the aggregation results.
+
+    Cost is proportional to the new batch: only its trips are grouped and
+    only the cells it touches are rewritten. If the running sums do not
+    exist yet they are bootstrapped from the whole collection once.
+    `should_stop` is passed to the ingest; a stopped batch is still merged
+    for the rows that were inserted, so the sums keep matching taxi_trips.
+    """
+    db = get_client(mongo_uri)[db_name]
+    batch_id = new_batch_id()
+    # New batches must use the layout of the trips already stored
+    layout = detect_layout(db["taxi_trips"]) if db["taxi_trips"].find_one({}, {"_id": 1}) else "compact"
+
+    rows = ingest_data_streaming(csv_path, mongo_uri, db_name, sample_rows=sample_rows,
+                                 drop=False, chunk_size=chunk_size, batch_id=batch_id,
+                                 layout=layout, should_stop=should_stop)
+
+    if db[SUMS_COLLECTION].estimated_document_count() == 0:
+        print("No running sums yet, building them from all trips...")
+        affected = rebuild_sums(db, batch_id)
+        update_results_file(affected, out_file, replace=True)
+    else:
+        affected = merge_batch(db, batch_id)
+        update_results_file(affected, out_file)
+
+    db[BATCHES_COLLECTION].insert_one({
+        "_id": batch_id,
+        "csv_path": csv_path,
+        "rows": rows,
+        "cells": len(affected),
+        "stopped": bool(should_stop is not None and should_stop()),
+        "merged_at": datetime.now()
+    })
+    print(f"Incremental aggregation complete: batch {batch_id}, {rows} trips, "
+          f"{len(affected)} cells updated → {out_file}")
+    return affected
@@ -1,14 +1,42 @@
 import pandas as pd
+import numpy as np
 import math
 import argparse
 import os
-from pymongo import MongoClient, ASCENDING, GEOSPHERE
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pymongo import ASCENDING, GEOSPHERE
+
+from scripts.mongo import get_client
+from scripts.instrumentation import step, timed_chunks, call_with_metrics, merged, ROWS
+from scripts.trip_cache import (TRIP_COLUMNS, TRIP_DTYPES, PICKUP_FORMAT, read_trip_chunks,
+                                open_trip_cache, TripCache)
+
+# Collections derived from taxi_trips (see incremental.py); stale once it is dropped
+SUMS_COLLECTION = "hourly_grid_sums"
+DERIVED_COLLECTIONS = [SUMS_COLLECTION, "ingest_batches"]
+
+# Document layouts: "legacy" stores grid_x/grid_y/grid_key strings, "compact"
+# stores a single packed int64 `cell` covered by COVERING_INDEX
+LAYOUTS = ("legacy", "compact")
+COVERING_INDEX = [("cell", ASCENDING), ("hour", ASCENDING),
+                  ("fare_amount", ASCENDING), ("trip_distance", ASCENDING)]
+COVERING_INDEX_NAME = "cell_1_hour_1_fare_amount_1_trip_distance_1"
+
+# Grid cells are 1/GRID_SCALE degrees (0.01° ≈ 1km at NYC's latitude)
+GRID_SCALE = 100
+
+# Fallback coordinates for zones missing from the mapping (NYC center)
+DEFAULT_COORDINATES = (40.7128, -74.0060)
+
+ZONES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "data", "raw", "nyc_taxi_zones.csv")
 
 # Load NYC taxi zone coordinates mapping
 def load_zone_mapping():
     """Load PULocationID to lat/lon mapping from taxi zones file"""
-    zones_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 
-                              "data", "raw", "nyc_taxi_zones.csv")
+    zones_file = ZONES_FILE
     if not os.path.exists(zones_file):
         raise FileNotFoundError(f"NYC taxi zones mapping file not found: {zones_file}")
     
@@ -20,13 +48,378 @@ def load_zone_mapping():
         zone_mapping[location_id] = (float(row['Latitude']), float(row['Longitude']))
     return zone_mapping
 
+def load_zone_arrays():
+    """
+    Build dense lookup arrays (latitude, longitude) indexed by LocationID.
+
+    The last slot holds the default coordinates and is used for any ID that
+    is missing from the zones file or out of range (see zone_index).
+    """
+    zone_mapping = load_zone_mapping()
+    size = max(zone_mapping) + 2
+    lat = np.full(size, DEFAULT_COORDINATES[0], dtype=np.float64)
+    lon = np.full(size, DEFAULT_COORDINATES[1], dtype=np.float64)
+    for location_id, (zone_lat, zone_lon) in zone_mapping.items():
+        if location_id >= 0:
+            lat[location_id] = zone_lat
+            lon[location_id] = zone_lon
+    return lat, lon
+
+def zone_index(location_ids, size):
+    """Map raw LocationIDs onto lookup-array slots (unknown IDs -> default slot)"""
+    ids = np.asarray(location_ids, dtype=np.int64)
+    return np.where((ids >= 0) & (ids < size - 1), ids, size - 1)
+
+def pack_cell(grid_x, grid_y):
+    """
+    Pack grid_x/grid_y into one int64: grid_x in the high 32 bits, grid_y
+    (two's complement) in the low 32. Works on ints and NumPy arrays.
+    """
+    return (grid_x << 32) | (grid_y & 0xFFFFFFFF)
+
+def unpack_cell(cell):
+    """Inverse of pack_cell for a single int -> (grid_x, grid_y)"""
+    grid_y = cell & 0xFFFFFFFF
+    if grid_y >= 1 << 31:
+        grid_y -= 1 << 32
+    return cell >> 32, grid_y
+
+def transform_chunk(df, lat_lut, lon_lut):
+    """Vectorized version of the per-row transform used by ingest_data"""
+    pickup = pd.to_datetime(df["tpep_pickup_datetime"], format=PICKUP_FORMAT)
+    slots = zone_index(df["PULocationID"].to_numpy(), len(lat_lut))
+    lat = lat_lut[slots]
+    lon = lon_lut[slots]
+    grid_x = np.floor(lon * GRID_SCALE).astype(np.int64)
+    grid_y = np.floor(lat * GRID_SCALE).astype(np.int64)
+    return {
+        "pickup_datetime": pickup.dt.to_pydatetime(),
+        "hour": pickup.dt.hour.to_numpy(),
+        "trip_distance": df["trip_distance"].to_numpy(),
+        "fare_amount": df["fare_amount"].to_numpy(),
+        "pickup_longitude": lon,
+        "pickup_latitude": lat,
+        "grid_x": grid_x,
+        "grid_y": grid_y,
+        "cell": pack_cell(grid_x, grid_y),
+    }
+
+def build_documents(cols, batch_id=None, layout="compact"):
+    """
+    Turn transformed columns into Mongo documents.
+
+    layout="legacy" matches ingest_data; layout="compact" replaces grid_x,
+    grid_y and the grid_key string with the packed int64 `cell`. When
+    `batch_id` is set every document is tagged with it, so incremental
+    aggregation can pick out the trips of one ingest run.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown document layout: {layout}")
+    if layout == "compact":
+        docs = [{
+            "pickup_datetime": ts,
+            "hour": hour,
+            "trip_distance": dist,
+            "fare_amount": fare,
+            "pickup": {"type": "Point", "coordinates": [lon, lat]},
+            "cell": cell
+        } for ts, hour, dist, fare, lon, lat, cell in zip(
+            cols["pickup_datetime"], cols["hour"].tolist(),
+            cols["trip_distance"].tolist(), cols["fare_amount"].tolist(),
+            cols["pickup_longitude"].tolist(), cols["pickup_latitude"].tolist(),
+            cols["cell"].tolist())]
+        if batch_id is not None:
+            for doc in docs:
+                doc["batch_id"] = batch_id
+        return docs
+
+    docs = []
+    for ts, hour, dist, fare, lon, lat, gx, gy in zip(
+            cols["pickup_datetime"], cols["hour"].tolist(),
+            cols["trip_distance"].tolist(), cols["fare_amount"].tolist(),
+            cols["pickup_longitude"].tolist(), cols["pickup_latitude"].tolist(),
+            cols["grid_x"].tolist(), cols["grid_y"].tolist()):
+        docs.append({
+            "pickup_datetime": ts,
+            "hour": hour,
+            "trip_distance": dist,
+            "fare_amount": fare,
+            "pickup": {"type": "Point", "coordinates": [lon, lat]},
+            "grid_x": gx,
+            "grid_y": gy,
+            "grid_key": f"{gx}_{gy}"
+        })
+    if batch_id is not None:
+        for doc in docs:
+            doc["batch_id"] = batch_id
+    return docs
+
+def drop_trips(db):
+    db["taxi_trips"].drop()
+    for name in DERIVED_COLLECTIONS:
+        db[name].drop()
+
+def prepare_trips(db, drop, batch_id=None):
+    """
+    Drop taxi_trips before a full ingest. Trips appended without a batch_id
+    never reach the incremental running sums, so those are dropped instead
+    and the next incremental run rebuilds them from all trips.
+    """
+    if drop:
+        drop_trips(db)
+    elif batch_id is None and db[SUMS_COLLECTION].estimated_document_count():
+        print(f"Untagged append: dropping stale {SUMS_COLLECTION} "
+              f"(rebuilt by the next incremental run)")
+        db[SUMS_COLLECTION].drop()
+
+def create_indexes(coll, batch_index=False, layout="legacy"):
+    with step("index_build"):
+        coll.create_index([("pickup_datetime", ASCENDING)])
+        coll.create_index([("pickup", GEOSPHERE)])
+        if layout == "compact":
+            coll.create_index(COVERING_INDEX, name=COVERING_INDEX_NAME)
+        else:
+            coll.create_index([("grid_key", ASCENDING)])
+        if batch_index:
+            coll.create_index([("batch_id", ASCENDING)])
+    print("Indexes created successfully.")
+
+def insert_chunk(coll, df, lat_lut, lon_lut, batch_id=None, layout="compact"):
+    """Transform, build and bulk-insert one chunk (each step timed); returns rows inserted"""
+    with step("transform"):
+        cols = transform_chunk(df, lat_lut, lon_lut)
+    with step("build_documents"):
+        docs = build_documents(cols, batch_id, layout)
+    if docs:
+        with step("insert"):
+            coll.insert_many(docs, ordered=False)
+        ROWS.inc(len(docs), step="insert")
+    return len(docs)
+
+def ingest_data_streaming(csv_path, mongo_uri, db_name, sample_rows=None, drop=False,
+                          chunk_size=100000, batch_id=None, layout="compact", should_stop=None):
+    """
+    Streaming variant of ingest_data.
+
+    Reads the CSV in chunks of `chunk_size` rows, transforms each chunk with
+    vectorized NumPy lookups and writes it with an unordered bulk insert, so
+    peak memory depends on the chunk size rather than the file size.
+    `should_stop` is polled before every chunk; returning True ends the
+    ingest early (used for job cancellation).
+    """
+    db = get_client(mongo_uri)[db_name]
+    coll = db["taxi_trips"]
+
+    prepare_trips(db, drop, batch_id)
+
+    print(f"Streaming CSV: {csv_path} (chunk_size={chunk_size})")
+    lat_lut, lon_lut = load_zone_arrays()
+
+    total = 0
+    with read_trip_chunks(csv_path, chunk_size, sample_rows) as reader:
+        for i, df in enumerate(timed_chunks(reader)):
+            if should_stop is not None and should_stop():
+                print(f"Ingest stopped after {total} rows.")
+                return total
+            t0 = time.perf_counter()
+            rows = insert_chunk(coll, df, lat_lut, lon_lut, batch_id, layout)
+            elapsed = time.perf_counter() - t0
+            total += rows
+            rate = rows / elapsed if elapsed > 0 else float("inf")
+            print(f"Chunk {i}: {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+
+    if total:
+        print(f"Inserted {total} records into MongoDB.")
+    else:
+        print("No records inserted!")
+
+    create_indexes(coll, batch_index=batch_id is not None, layout=layout)
+    return total
+
+class CsvRangeReader:
+    """
+    Minimal file-like object that yields the CSV header followed by the
+    bytes in [start, end), so pandas can parse one byte range of the file.
+    """
+
+    def __init__(self, csv_path, header, start, end):
+        self.f = open(csv_path, "rb")
+        self.f.seek(start)
+        self.pending = header
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.pending) + self.remaining
+        out = self.pending[:size]
+        self.pending = self.pending[size:]
+        want = min(size - len(out), self.remaining)
+        if want > 0:
+            data = self.f.read(want)
+            self.remaining -= len(data)
+            out += data
+        return out
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def readline(self):
+        line = b""
+        while not line.endswith(b"\n"):
+            data = self.read(1 << 16 if not line else 1)
+            if not data:
+                break
+            line += data
+        return line
+
+    def close(self):
+        self.f.close()
+
+def offset_after_lines(f, n_lines, block_size=1 << 20):
+    """Byte offset just past the next `n_lines` newlines from the current position"""
+    pos = f.tell()
+    while n_lines > 0:
+        block = f.read(block_size)
+        if not block:
+            break
+        found = block.count(b"\n")
+        if found < n_lines:
+            n_lines -= found
+            pos += len(block)
+            continue
+        idx = -1
+        for _ in range(n_lines):
+            idx = block.index(b"\n", idx + 1)
+        pos += idx + 1
+        n_lines = 0
+    return pos
+
+def split_csv_ranges(csv_path, parts, sample_rows=None):
+    """
+    Split a CSV into `parts` line-aligned byte ranges.
+
+    Returns (header_bytes, [(start, end), ...]). When `sample_rows` is set the
+    ranges only cover the first `sample_rows` data lines, matching nrows.
+    Assumes no quoted newlines, which holds for the TLC trip files.
+    """
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        data_start = f.tell()
+        if sample_rows is not None:
+            data_end = offset_after_lines(f, sample_rows)
+        else:
+            data_end = os.fstat(f.fileno()).st_size
+
+        bounds = [data_start]
+        span = data_end - data_start
+        for i in range(1, parts):
+            target = data_start + span * i // parts
+            if target <= bounds[-1]:
+                continue
+            f.seek(target - 1)
+            f.readline()
+            cut = min(f.tell(), data_end)
+            if cut > bounds[-1]:
+                bounds.append(cut)
+        if data_end > bounds[-1]:
+            bounds.append(data_end)
+    ranges = [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+    return header, ranges
+
+def ingest_range(csv_path, header, start, end, mongo_uri, db_name, batch_size, batch_id=None,
+                 layout="compact"):
+    """Worker: parse, transform and bulk-insert one byte range with its process's client"""
+    coll = get_client(mongo_uri)[db_name]["taxi_trips"]
+    lat_lut, lon_lut = load_zone_arrays()
+    reader = CsvRangeReader(csv_path, header, start, end)
+    total = 0
+    t0 = time.perf_counter()
+    try:
+        with pd.read_csv(reader, usecols=TRIP_COLUMNS, dtype=TRIP_DTYPES,
+                         chunksize=batch_size) as chunks:
+            for df in timed_chunks(chunks):
+                total += insert_chunk(coll, df, lat_lut, lon_lut, batch_id, layout)
+    finally:
+        reader.close()
+    return total, time.perf_counter() - t0
+
+def split_rows(rows, parts):
+    """Split rows [0, rows) into `parts` contiguous (start, end) ranges"""
+    bounds = [rows * i // parts for i in range(parts + 1)]
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+def ingest_cached_range(cache_path, start, end, mongo_uri, db_name, batch_size, batch_id=None,
+                        layout="compact"):
+    """Worker: transform and bulk-insert rows [start, end) of the trip column cache"""
+    coll = get_client(mongo_uri)[db_name]["taxi_trips"]
+    lat_lut, lon_lut = load_zone_arrays()
+    total = 0
+    t0 = time.perf_counter()
+    for df in timed_chunks(TripCache(cache_path).chunks(batch_size, start=start, end=end),
+                           "cache_read"):
+        total += insert_chunk(coll, df, lat_lut, lon_lut, batch_id, layout)
+    return total, time.perf_counter() - t0
+
+def ingest_data_parallel(csv_path, mongo_uri, db_name, sample_rows=None, drop=False,
+                         workers=None, batch_size=100000, batch_id=None, layout="compact",
+                         should_stop=None):
+    """
+    Parallel variant of ingest_data.
+
+    Splits the CSV into line-aligned byte ranges (or, when the trip column
+    cache is current, row ranges of the cache) and ingests them in a process
+    pool, one pooled MongoClient per worker process. Indexes are built once,
+    after all workers are done, so inserts don't pay for index maintenance.
+    `should_stop` is polled as ranges complete; returning True cancels the
+    ranges that have not started yet.
+    """
+    workers = workers or os.cpu_count() or 1
+    db = get_client(mongo_uri)[db_name]
+    coll = db["taxi_trips"]
+    prepare_trips(db, drop, batch_id)
+
+    # A few ranges per worker keeps the pool busy when ranges finish unevenly
+    cache = open_trip_cache(csv_path, sample_rows)
+    if cache is not None:
+        ranges = split_rows(min(cache.rows, sample_rows or cache.rows), workers * 4)
+        worker, source = ingest_cached_range, (cache.path,)
+    else:
+        header, ranges = split_csv_ranges(csv_path, workers * 4, sample_rows)
+        worker, source = ingest_range, (csv_path, header)
+    print(f"Parallel ingest: {csv_path} in {len(ranges)} ranges on {workers} workers"
+          f"{' (trip cache)' if cache is not None else ''}")
+
+    total = 0
+    t0 = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # Each range also returns its worker's metrics (steps, rows, Mongo commands)
+        futures = [pool.submit(call_with_metrics, worker, *source, start, end,
+                               mongo_uri, db_name, batch_size, batch_id, layout)
+                   for start, end in ranges]
+        for fut in as_completed(futures):
+            if fut.cancelled():
+                continue
+            rows, elapsed = merged(fut.result())
+            total += rows
+            print(f"Range done: {rows} rows in {elapsed:.2f}s")
+            if should_stop is not None and should_stop():
+                for pending in futures:
+                    pending.cancel()
+                print(f"Ingest stopped after {total} rows.")
+                return total
+    elapsed = time.perf_counter() - t0
+    rate = total / elapsed if elapsed > 0 else float("inf")
+    print(f"Inserted {total} records into MongoDB ({rate:,.0f} rows/sec).")
+
+    create_indexes(coll, batch_index=batch_id is not None, layout=layout)
+    return total
+
 def ingest_data(csv_path, mongo_uri, db_name, sample_rows=None, drop=False):
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
+    db = get_client(mongo_uri)[db_name]
     coll = db["taxi_trips"]
 
-    if drop:
-        coll.drop()
+    prepare_trips(db, drop)
 
     print(f"Reading CSV: {csv_path}")
     df = pd.read_csv(csv_path, nrows=sample_rows)
@@ -78,8 +471,5 @@ def ingest_data(csv_path, mongo_uri, db_name, sample_rows=None, drop=False):
     else:
         print("No records inserted!")
 
-    coll.create_index([("pickup_datetime", ASCENDING)])
-    coll.create_index([("pickup", GEOSPHERE)])
-    coll.create_index([("grid_key", ASCENDING)])
-    print("Indexes created successfully.")
+    create_indexes(coll)
     return len(records)
@@ -0,0 +1,242 @@
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+# In-process metrics for the pipeline and the API, rendered in the
+# Prometheus text format by GET /metrics.
+#
+# Counters and histograms live in one module-level registry. Every series is
+# keyed by its label values and updated under the metric's lock, so timing a
+# step costs two perf_counter() calls and a dict update. Histograms use
+# fixed cumulative buckets (no quantiles), which Prometheus can aggregate
+# across scrapes and processes.
+#
+# The registry is per process. Work submitted to spawned pool workers
+# (parallel ingest, mapreduce, multimonth) goes through call_with_metrics:
+# the worker drains its registry after each task and the parent merges the
+# snapshot, so worker rows, sub-steps and Mongo commands are exported too.
+
+# Seconds; spans a cached API response up to a full-month pipeline stage
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def label_text(names, values, extra=()):
+    pairs = [f'{n}="{escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def drain(self):
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def merge(self, values):
+        with self.lock:
+            for key, v in values.items():
+                self.values[key] = self.values.get(key, 0) + v
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{label_text(self.labels, key)} {number(v)}" for key, v in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.series = {}  # label values -> [per-bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            s = self.series.get(key)
+            if s is None:
+                s = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            s[0][i] += 1
+            s[1] += seconds
+            s[2] += 1
+
+    def drain(self):
+        with self.lock:
+            series, self.series = self.series, {}
+        return series
+
+    def merge(self, series):
+        with self.lock:
+            for key, (counts, total, n) in series.items():
+                s = self.series.get(key)
+                if s is None:
+                    s = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+                s[0] = [a + b for a, b in zip(s[0], counts)]
+                s[1] += total
+                s[2] += n
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self.series.items())
+        lines = []
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = f'le="{number(bound)}"'
+                lines.append(f"{self.name}_bucket{label_text(self.labels, key, [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text(self.labels, key)} {number(total)}")
+            lines.append(f"{self.name}_count{label_text(self.labels, key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.add(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=BUCKETS):
+        return self.add(Histogram(name, help_text, labels, buckets))
+
+    def drain(self):
+        """Picklable {metric: series} snapshot of everything recorded so far; resets it"""
+        return {name: m.drain() for name, m in self.metrics.items()}
+
+    def merge(self, snapshot):
+        for name, series in snapshot.items():
+            if name in self.metrics:
+                self.metrics[name].merge(series)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for m in self.metrics.values():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "taxi_pipeline_stage_seconds", "Pipeline stage duration (cached stages excluded)", ("stage",))
+PIPELINE_SECONDS = REGISTRY.histogram(
+    "taxi_pipeline_seconds", "Pipeline wall time")
+STEP_SECONDS = REGISTRY.histogram(
+    "taxi_step_seconds", "Sub-step duration inside a stage", ("step",))
+ROWS = REGISTRY.counter(
+    "taxi_rows_processed_total", "Rows processed per sub-step", ("step",))
+BYTES = REGISTRY.counter(
+    "taxi_bytes_processed_total", "Bytes read or written per sub-step", ("step",))
+HTTP_SECONDS = REGISTRY.histogram(
+    "taxi_http_request_seconds", "API request latency", ("route", "method", "status"))
+HTTP_BYTES = REGISTRY.counter(
+    "taxi_http_response_bytes_total", "API response body bytes", ("route",))
+MONGO_SECONDS = REGISTRY.histogram(
+    "taxi_mongo_command_seconds", "MongoDB command duration as reported by the driver",
+    ("command", "outcome"))
+
+
+def step(name):
+    """Context manager timing one sub-step (csv_parse, transform, insert, ...)"""
+    return STEP_SECONDS.time(step=name)
+
+
+def timed_chunks(chunks, name="csv_parse"):
+    """Yield DataFrame chunks, timing the time spent producing each one and counting rows"""
+    chunks = iter(chunks)
+    while True:
+        t0 = time.perf_counter()
+        try:
+            df = next(chunks)
+        except StopIteration:
+            return
+        STEP_SECONDS.observe(time.perf_counter() - t0, step=name)
+        ROWS.inc(len(df), step=name)
+        yield df
+
+
+@contextmanager
+def write_step(name, path):
+    """step(name) around writing `path`, then count the bytes written"""
+    with step(name):
+        yield
+    BYTES.inc(os.path.getsize(path), step=name)
+
+
+def call_with_metrics(func, *args):
+    """
+    Pool worker entry point: (func(*args), this worker's metrics snapshot).
+    The parent passes the snapshot to REGISTRY.merge().
+    """
+    result = func(*args)
+    return result, REGISTRY.drain()
+
+
+def merged(outcome):
+    """Merge the snapshot of one call_with_metrics outcome and return the task's result"""
+    result, snapshot = outcome
+    REGISTRY.merge(snapshot)
+    return result
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """pymongo command listener feeding MONGO_SECONDS (insert, aggregate, getMore, ...)"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name, outcome="ok")
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name,
+                              outcome="error")
+
+
+MONGO_COMMANDS = MongoCommandTimer()
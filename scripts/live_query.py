@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+from scripts.aggregate import detect_layout, cell_row
+from scripts.mongo import get_client
+
+# Ad-hoc hotspot queries against taxi_trips.
+#
+# The filter is pushed into a $match that can use the indexes built at
+# ingest time: $geoWithin on the `pickup` 2dsphere index for the bounding
+# box and the `pickup_datetime` index for the date range. Grouping happens
+# in mongod, so only one row per (cell, hour) crosses the wire.
+
+
+def parse_bbox(text):
+    """"min_lon,min_lat,max_lon,max_lat" -> tuple of floats; raises ValueError"""
+    try:
+        parts = [float(p) for p in text.split(",")]
+    except ValueError:
+        parts = None
+    if parts is None or len(parts) != 4:
+        raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise ValueError(f"invalid bbox: {text}")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_date(text, end=False, name="date"):
+    """ISO date or datetime; a bare end date covers that whole day. `name` goes in the error"""
+    try:
+        value = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"{name} must be YYYY-MM-DD or an ISO datetime") from None
+    if end and len(text) == 10:
+        value += timedelta(days=1)
+    return value
+
+
+def bbox_polygon(bbox):
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return {"type": "Polygon", "coordinates": [[
+        [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat],
+        [min_lon, max_lat], [min_lon, min_lat]]]}
+
+
+def hour_list(hour_from, hour_to):
+    """Hours from..to inclusive; wraps past midnight when from > to (e.g. 22..2)"""
+    if hour_from <= hour_to:
+        return list(range(hour_from, hour_to + 1))
+    return list(range(hour_from, 24)) + list(range(0, hour_to + 1))
+
+
+def build_match(bbox=None, hours=None, date_from=None, date_to=None):
+    """$match for the filters given; date_to is exclusive"""
+    match = {}
+    if bbox is not None:
+        match["pickup"] = {"$geoWithin": {"$geometry": bbox_polygon(bbox)}}
+    if hours is not None and len(hours) < 24:
+        match["hour"] = {"$in": list(hours)}
+    if date_from is not None or date_to is not None:
+        match["pickup_datetime"] = {}
+        if date_from is not None:
+            match["pickup_datetime"]["$gte"] = date_from
+        if date_to is not None:
+            match["pickup_datetime"]["$lt"] = date_to
+    return match
+
+
+def query_hotspots(mongo_uri, db_name, bbox=None, hours=None, date_from=None, date_to=None,
+                   limit=None):
+    """
+    (cell, hour) rows in the hourly_grid_counts.json schema for trips matching
+    the filters, busiest first.
+    """
+    coll = get_client(mongo_uri)[db_name]["taxi_trips"]
+    stats = {"count": {"$sum": 1},
+             "avg_fare": {"$avg": "$fare_amount"},
+             "avg_distance": {"$avg": "$trip_distance"}}
+    compact = detect_layout(coll) == "compact"
+    if compact:
+        group = {"_id": {"cell": "$cell", "hour": "$hour"}, **stats}
+    else:
+        group = {"_id": {"grid_key": "$grid_key", "hour": "$hour"}, **stats,
+                 "grid_x": {"$first": "$grid_x"}, "grid_y": {"$first": "$grid_y"}}
+
+    pipeline = [{"$match": build_match(bbox, hours, date_from, date_to)},
+                {"$group": group},
+                {"$sort": {"count": -1}}]
+    if limit:
+        pipeline.append({"$limit": int(limit)})
+
+    rows = []
+    for r in coll.aggregate(pipeline):
+        if compact:
+            rows.append(cell_row(r["_id"]["cell"], r["_id"]["hour"], r["count"],
+                                 r["avg_fare"], r["avg_distance"]))
+        else:
+            rows.append({"count": r["count"], "avg_fare": r["avg_fare"],
+                         "avg_distance": r["avg_distance"], "grid_x": r["grid_x"],
+                         "grid_y": r["grid_y"], "grid_key": r["_id"]["grid_key"],
+                         "hour": r["_id"]["hour"]})
+    return rows
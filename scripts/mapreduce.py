@@ -1,58 +1,152 @@
-from pymongo import MongoClient
-import json
 import os
-def run_mapreduce(mongo_uri, db_name, out_file):
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    coll = db["taxi_trips"]
-
-    map_js = """
-        function() {
-            emit({grid_key: this.grid_key, hour: this.hour}, 
-                 {count: 1, fare_sum: this.fare_amount, dist_sum: this.trip_distance});
-        }
+import time
+import zlib
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts.ingest import unpack_cell
+from scripts.mongo import get_client
+from scripts.columnar import write_columnar, write_json_atomic, row_cells, EXPORT_SEPARATORS
+from scripts.instrumentation import step, write_step, call_with_metrics, merged, ROWS
+
+# Local MapReduce: the collection is split into _id ranges, each range is
+# mapped + combined in its own process over its own cursor, the partial sums
+# are shuffled by (grid_key, hour) and reduced in parallel. This replaces the
+# deprecated server-side mapReduce command (single-threaded inside mongod and
+# capped by the 16MB inline result limit) while keeping the same paradigm.
+
+def split_id_ranges(coll, parts, samples_per_part=100):
+    """
+    Split a collection into roughly equal _id ranges using a $sample of _ids.
+
+    Returns [(lo, hi), ...] where None means unbounded on that side.
     """
-    reduce_js = """
-        function(key, values) {
-            let res = {count: 0, fare_sum: 0, dist_sum: 0};
-            values.forEach(v => {
-                res.count += v.count;
-                res.fare_sum += v.fare_sum;
-                res.dist_sum += v.dist_sum;
-            });
-            return res;
-        }
+    total = coll.estimated_document_count()
+    if total == 0:
+        return []
+    if parts <= 1:
+        return [(None, None)]
+    size = min(total, parts * samples_per_part)
+    ids = sorted(d["_id"] for d in coll.aggregate([
+        {"$sample": {"size": size}},
+        {"$project": {"_id": 1}}
+    ]))
+    bounds = []
+    for i in range(1, parts):
+        b = ids[len(ids) * i // parts]
+        if not bounds or b > bounds[-1]:
+            bounds.append(b)
+    edges = [None] + bounds + [None]
+    return list(zip(edges, edges[1:]))
+
+def id_filter(lo, hi):
+    cond = {}
+    if lo is not None:
+        cond["$gte"] = lo
+    if hi is not None:
+        cond["$lt"] = hi
+    return {"_id": cond} if cond else {}
+
+def shuffle_partition(key, reducers):
+    # crc32 rather than hash(): str hashes are randomized per process
+    return zlib.crc32(f"{key[0]}|{key[1]}".encode()) % reducers
+
+def map_partition(mongo_uri, db_name, lo, hi, reducers):
     """
-    finalize_js = """
-        function(key, value) {
-            value.avg_fare = value.fare_sum / value.count;
-            value.avg_distance = value.dist_sum / value.count;
-            return value;
-        }
+    Map + combine one _id range.
+
+    emit((grid_key, hour), (1, fare, distance)) is folded straight into a
+    combiner dict, and the combined pairs are bucketed by reducer. Compact
+    documents emit their packed int `cell` instead of grid_key; it is
+    expanded once per key at reduce time.
     """
+    coll = get_client(mongo_uri)[db_name]["taxi_trips"]
+    combined = {}
+    cursor = coll.find(id_filter(lo, hi),
+                       {"_id": 0, "cell": 1, "grid_key": 1, "hour": 1,
+                        "fare_amount": 1, "trip_distance": 1},
+                       batch_size=10000)
+    mapped = 0
+    for doc in cursor:
+        mapped += 1
+        key = (doc.get("cell", doc.get("grid_key")), doc["hour"])
+        acc = combined.get(key)
+        if acc is None:
+            combined[key] = [1, doc["fare_amount"], doc["trip_distance"]]
+        else:
+            acc[0] += 1
+            acc[1] += doc["fare_amount"]
+            acc[2] += doc["trip_distance"]
+
+    buckets = [[] for _ in range(reducers)]
+    for key, (count, fare_sum, dist_sum) in combined.items():
+        buckets[shuffle_partition(key, reducers)].append((key, count, fare_sum, dist_sum))
+    ROWS.inc(mapped, step="map")
+    return buckets
 
-    result = db.command({
-        "mapReduce": "taxi_trips",
-        "map": map_js,
-        "reduce": reduce_js,
-        "finalize": finalize_js,
-        "out": {"inline": 1}
-    })
+def reduce_partition(pairs):
+    """Reduce + finalize: sum partials per key and derive averages"""
+    totals = {}
+    for key, count, fare_sum, dist_sum in pairs:
+        acc = totals.get(key)
+        if acc is None:
+            totals[key] = [count, fare_sum, dist_sum]
+        else:
+            acc[0] += count
+            acc[1] += fare_sum
+            acc[2] += dist_sum
 
     docs = []
-    for r in result["results"]:
-        k = r["_id"]
-        v = r["value"]
+    for (cell, hour), (count, fare_sum, dist_sum) in totals.items():
+        grid_key = cell if isinstance(cell, str) else "{}_{}".format(*unpack_cell(cell))
         docs.append({
-            "grid_key": k["grid_key"],
-            "hour": k["hour"],
-            "count": v["count"],
-            "avg_fare": v["avg_fare"],
-            "avg_distance": v["avg_distance"]
+            "grid_key": grid_key,
+            "hour": hour,
+            "count": count,
+            "avg_fare": fare_sum / count,
+            "avg_distance": dist_sum / count
         })
-    os.makedirs(os.path.dirname(out_file), exist_ok=True)    
+    return docs
+
+def run_mapreduce(mongo_uri, db_name, out_file, workers=None, partitions=None):
+    workers = workers or os.cpu_count() or 1
+    partitions = partitions or workers * 4
+    coll = get_client(mongo_uri)[db_name]["taxi_trips"]
+    ranges = split_id_ranges(coll, partitions)
+
+    t0 = time.perf_counter()
+    docs = []
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # Map phase: one task per _id range, each returning `workers` buckets
+        # call_with_metrics: each task also returns its worker's metrics (rows, Mongo commands)
+        with step("map"):
+            mapped = [merged(outcome) for outcome in pool.map(
+                call_with_metrics, [map_partition] * len(ranges),
+                [mongo_uri] * len(ranges), [db_name] * len(ranges),
+                [lo for lo, _ in ranges], [hi for _, hi in ranges], [workers] * len(ranges))]
+        # Shuffle: bucket r of every mapper goes to reducer r
+        with step("shuffle"):
+            shuffled = [[pair for buckets in mapped for pair in buckets[r]] for r in range(workers)]
+        # Reduce phase
+        with step("reduce"):
+            for outcome in pool.map(call_with_metrics, [reduce_partition] * len(shuffled),
+                                    shuffled):
+                docs.extend(merged(outcome))
+    print(f"MapReduce: {len(ranges)} map tasks, {workers} reducers in "
+          f"{time.perf_counter() - t0:.2f}s")
+
+    # Reducer order is arbitrary; export in the columnar store's (hour, cell)
+    # order so the JSON file and responses served from the store agree
+    order = np.lexsort((row_cells(docs), np.fromiter((d["hour"] for d in docs), dtype=np.int64,
+                                                     count=len(docs))))
+    docs = [docs[i] for i in order.tolist()]
+
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
 
-    with open(out_file, "w") as f:
-        json.dump(docs, f, indent=2)
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, docs, EXPORT_SEPARATORS)
+    write_columnar(docs, out_file)
     print(f"MapReduce complete: {len(docs)} rows → {out_file}")
     return docs
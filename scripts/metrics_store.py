@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Append-only store for pipeline and benchmark timings.
+#
+# One SQLite database in WAL mode: writers only ever INSERT (one transaction
+# per run), readers never block them, and concurrent writers from several
+# processes are serialized by SQLite's lock with a busy timeout instead of
+# losing each other's updates. Reads go through the (ts) and (engine, ts)
+# indexes with a LIMIT, so their cost depends on the window asked for, not on
+# how much history has accumulated.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRICS_DB = os.getenv("METRICS_DB", os.path.join(PROJECT_ROOT, "data", "results", "metrics.db"))
+BUSY_TIMEOUT_MS = 5000
+
+# runs: one row per pipeline/benchmark run; timings: one row per engine or stage
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT    PRIMARY KEY,
+    ts          REAL    NOT NULL,
+    source      TEXT    NOT NULL,
+    sample_rows INTEGER,
+    extra       TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_ts ON runs (ts);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id      TEXT    NOT NULL,
+    ts          REAL    NOT NULL,
+    engine      TEXT    NOT NULL,
+    seconds     REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_run ON timings (run_id);
+CREATE INDEX IF NOT EXISTS timings_engine_ts ON timings (engine, ts);
+"""
+
+
+class MetricsStore:
+    """Timings database at `path`; safe to share between threads (one connection each)"""
+
+    def __init__(self, path=METRICS_DB):
+        self.path = path
+        self.local = threading.local()
+        self.schema_ready = False
+        self.lock = threading.Lock()
+
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self.lock:
+                if not self.schema_ready:
+                    conn.executescript(SCHEMA)
+                    self.schema_ready = True
+            self.local.conn = conn
+        return conn
+
+    def record(self, source, timings, sample_rows=None, extra=None, run_id=None, ts=None):
+        """Append one run: {engine or stage: seconds}. Returns its run_id."""
+        run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        ts = time.time() if ts is None else ts
+        extra = json.dumps(extra) if extra else None
+        conn = self.connect()
+        with conn:
+            conn.execute("INSERT INTO runs (run_id, ts, source, sample_rows, extra) "
+                         "VALUES (?, ?, ?, ?, ?)", (run_id, ts, source, sample_rows, extra))
+            conn.executemany("INSERT INTO timings (run_id, ts, engine, seconds) VALUES (?, ?, ?, ?)",
+                             [(run_id, ts, engine, float(seconds))
+                              for engine, seconds in timings.items() if seconds is not None])
+        return run_id
+
+    @staticmethod
+    def window(clauses):
+        """WHERE clause + params for the (sql, value) pairs whose value is set"""
+        used = [(sql, value) for sql, value in clauses if value is not None]
+        if not used:
+            return "", []
+        return " WHERE " + " AND ".join(sql for sql, _ in used), [value for _, value in used]
+
+    def series(self, engine=None, source=None, since=None, until=None, limit=100):
+        """Individual timings, newest first, filtered by engine/source and [since, until) epoch seconds"""
+        where, params = self.window((("t.engine = ?", engine), ("r.source = ?", source),
+                                     ("t.ts >= ?", since), ("t.ts < ?", until)))
+        sql = ("SELECT t.ts, t.run_id, r.source, t.engine, t.seconds, r.sample_rows "
+               "FROM timings t JOIN runs r ON r.run_id = t.run_id"
+               + where + " ORDER BY t.ts DESC LIMIT ?")
+        return [dict(r) for r in self.connect().execute(sql, params + [limit])]
+
+    def runs(self, source=None, since=None, until=None, limit=20):
+        """
+        The latest `limit` runs, oldest first, one entry per run in the shape
+        of the old timing_history.json (timestamp, agg_time, mapr_time, engines).
+        """
+        where, params = self.window((("source = ?", source), ("ts >= ?", since),
+                                     ("ts < ?", until)))
+        conn = self.connect()
+        latest = conn.execute("SELECT run_id, ts, source, sample_rows FROM runs" + where
+                              + " ORDER BY ts DESC LIMIT ?", params + [limit]).fetchall()
+        if not latest:
+            return []
+        runs = {}
+        for r in reversed(latest):
+            runs[r["run_id"]] = {
+                "run_id": r["run_id"],
+                "source": r["source"],
+                "ts": r["ts"],
+                "timestamp": time.strftime("%H:%M:%S", time.localtime(r["ts"])),
+                "sample_rows": r["sample_rows"],
+                "engines": {},
+            }
+        marks = ",".join("?" * len(runs))
+        for r in conn.execute(f"SELECT run_id, engine, seconds FROM timings "
+                              f"WHERE run_id IN ({marks})", list(runs)):
+            runs[r["run_id"]]["engines"][r["engine"]] = r["seconds"]
+        for run in runs.values():
+            run["agg_time"] = run["engines"].get("aggregation")
+            run["mapr_time"] = run["engines"].get("mapreduce")
+        return list(runs.values())
@@ -0,0 +1,62 @@
+from scripts.ingest import COVERING_INDEX, COVERING_INDEX_NAME
+from scripts.mongo import get_client
+
+# Migration from the legacy trip layout (grid_x, grid_y and a "gx_gy"
+# grid_key string per document, single-field grid_key index) to the compact
+# layout: one packed int64 `cell` plus the (cell, hour, fare_amount,
+# trip_distance) index that covers the aggregation $group.
+
+TWO_32 = 1 << 32
+
+# Same packing as ingest.pack_cell, expressed as an update pipeline
+PACK_CELL_EXPR = {"$add": [
+    {"$multiply": [{"$toLong": "$grid_x"}, TWO_32]},
+    {"$cond": [{"$lt": ["$grid_y", 0]},
+               {"$add": [{"$toLong": "$grid_y"}, TWO_32]},
+               {"$toLong": "$grid_y"}]}
+]}
+
+
+def collection_stats(db, name="taxi_trips"):
+    stats = db.command("collStats", name)
+    return {
+        "count": stats.get("count"),
+        "size_bytes": stats.get("size"),
+        "avg_obj_size": stats.get("avgObjSize"),
+        "storage_bytes": stats.get("storageSize"),
+        "index_bytes": stats.get("totalIndexSize"),
+        "indexes": sorted(stats.get("indexSizes", {})),
+    }
+
+
+def migrate_to_compact(mongo_uri, db_name, compact=False):
+    """
+    Convert an existing taxi_trips collection in place to the compact layout.
+
+    Idempotent: documents that already have `cell` are left alone. The
+    running sums of incremental.py are keyed by grid_key in the legacy layout,
+    so they are dropped and rebuilt on the next incremental run.
+    """
+    db = get_client(mongo_uri)[db_name]
+    coll = db["taxi_trips"]
+
+    before = collection_stats(db)
+    result = coll.update_many(
+        {"cell": {"$exists": False}, "grid_x": {"$exists": True}},
+        [{"$set": {"cell": PACK_CELL_EXPR}},
+         {"$unset": ["grid_x", "grid_y", "grid_key"]}]
+    )
+    print(f"Migrated {result.modified_count} documents to the compact layout.")
+
+    coll.create_index(COVERING_INDEX, name=COVERING_INDEX_NAME)
+    if "grid_key_1" in coll.index_information():
+        coll.drop_index("grid_key_1")
+    db["hourly_grid_sums"].drop()
+    if compact:
+        # Return the freed space to the OS so storage_bytes reflects the change
+        db.command("compact", "taxi_trips")
+
+    after = collection_stats(db)
+    print(f"taxi_trips: {before['size_bytes']} → {after['size_bytes']} bytes, "
+          f"indexes {before['index_bytes']} → {after['index_bytes']} bytes")
+    return {"modified": result.modified_count, "before": before, "after": after}
@@ -0,0 +1,63 @@
+import os
+import threading
+from pymongo import MongoClient
+
+from scripts.instrumentation import MONGO_COMMANDS
+
+# Process-wide pooled MongoClient.
+#
+# A MongoClient is thread-safe and owns a connection pool, so each process
+# needs one per URI rather than one per call. Clients are keyed by pid as
+# well: a client must not be shared across fork(), and pool workers (spawned
+# processes) each build their own on first use and reuse it for every task.
+# Pool size and timeouts come from the environment. Every client reports
+# command durations to the instrumentation registry.
+
+
+def env_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+MONGO_MAX_POOL_SIZE = env_int("MONGO_MAX_POOL_SIZE", 50)
+MONGO_MIN_POOL_SIZE = env_int("MONGO_MIN_POOL_SIZE", 0)
+MONGO_MAX_IDLE_TIME_MS = env_int("MONGO_MAX_IDLE_TIME_MS")
+MONGO_CONNECT_TIMEOUT_MS = env_int("MONGO_CONNECT_TIMEOUT_MS", 10000)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)
+# None = no socket timeout; full-collection aggregations can run for minutes
+MONGO_SOCKET_TIMEOUT_MS = env_int("MONGO_SOCKET_TIMEOUT_MS")
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def client_options():
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+    }
+
+
+def get_client(mongo_uri):
+    """Shared MongoClient for `mongo_uri` in this process (do not close it)"""
+    key = (os.getpid(), mongo_uri)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = MongoClient(mongo_uri, event_listeners=[MONGO_COMMANDS],
+                                     **client_options())
+                _clients[key] = client
+    return client
+
+
+def close_clients():
+    """Close this process's clients (e.g. at shutdown or in tests)"""
+    with _lock:
+        for key in [k for k in _clients if k[0] == os.getpid()]:
+            _clients.pop(key).close()
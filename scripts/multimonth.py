@@ -0,0 +1,90 @@
+import argparse
+import glob
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from scripts.ingest import load_zone_arrays
+from scripts.bincount import zone_hour_sums, fold_zones_to_cells
+from scripts.columnar import write_columnar, write_json_atomic, EXPORT_SEPARATORS
+from scripts.instrumentation import call_with_metrics, merged, write_step
+
+# Out-of-core multi-month engine.
+#
+# Each monthly CSV is streamed in chunks by its own pool worker into dense
+# (zones x 24) count / fare_sum / dist_sum partials (see bincount.py), so a
+# worker holds one chunk plus a few hundred KB of sums no matter how many
+# trips the file has. The partials are summed in the parent and folded into
+# grid cells once, giving rows in the run_aggregation schema. MongoDB is not
+# involved, so a full year never has to fit in a collection.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_GLOB = os.path.join(PROJECT_ROOT, "data", "raw", "yellow_tripdata_*.csv")
+DEFAULT_OUT = os.path.join(PROJECT_ROOT, "data", "results", "multimonth_hourly_grid_counts.json")
+
+
+def month_partial(csv_path, size, sample_rows=None, chunk_size=500000):
+    """Worker: zone x hour partial sums of one file"""
+    t0 = time.perf_counter()
+    count, fare_sum, dist_sum = zone_hour_sums(csv_path, sample_rows, chunk_size, size=size)
+    return csv_path, count, fare_sum, dist_sum, time.perf_counter() - t0
+
+
+def run_multimonth(pattern, out_file, workers=None, sample_rows=None, chunk_size=500000):
+    """
+    Aggregate every CSV matching `pattern` (glob) into hourly grid cells.
+
+    `sample_rows` limits rows per file. Output has the same schema as
+    run_aggregation, plus the columnar store next to it.
+    """
+    files = sorted(glob.glob(pattern))
+    if not files:
+        raise FileNotFoundError(f"No trip files match {pattern}")
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    lat_lut, lon_lut = load_zone_arrays()
+    size = len(lat_lut)
+    print(f"Multi-month aggregation: {len(files)} files on {workers} workers")
+
+    totals = None
+    t0 = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [pool.submit(call_with_metrics, month_partial, path, size, sample_rows,
+                               chunk_size)
+                   for path in files]
+        # Merge partials as they arrive; only one set of sums is kept per file in flight
+        for fut in as_completed(futures):
+            path, count, fare_sum, dist_sum, elapsed = merged(fut.result())
+            print(f"  {os.path.basename(path)}: {int(count.sum())} trips in {elapsed:.2f}s")
+            if totals is None:
+                totals = [count, fare_sum, dist_sum]
+            else:
+                totals[0] += count
+                totals[1] += fare_sum
+                totals[2] += dist_sum
+
+    result = fold_zones_to_cells(*totals, lat_lut, lon_lut)
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, result, EXPORT_SEPARATORS)
+    write_columnar(result, out_file)
+    print(f"Multi-month aggregation complete: {int(totals[0].sum())} trips from {len(files)} "
+          f"files in {time.perf_counter() - t0:.2f}s, {len(result)} rows → {out_file}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate many monthly trip CSVs out of core")
+    parser.add_argument("--glob", default=DEFAULT_GLOB, help="pattern of trip CSV files")
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--sample-rows", type=int, default=None, help="rows per file")
+    parser.add_argument("--chunk-size", type=int, default=500000)
+    args = parser.parse_args()
+    run_multimonth(args.glob, args.out, workers=args.workers, sample_rows=args.sample_rows,
+                   chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from scripts.ingest import (load_zone_arrays, transform_chunk, build_documents, create_indexes,
+                            read_trip_chunks, pack_cell, PICKUP_FORMAT, COVERING_INDEX_NAME)
+from scripts.aggregate import detect_layout, cell_row
+from scripts.incremental import group_stage
+from scripts.mongo import get_client
+from scripts.columnar import write_columnar, write_json_atomic, EXPORT_SEPARATORS
+from scripts.instrumentation import write_step
+
+# Month-partitioned trip collections.
+#
+# Instead of one taxi_trips collection, trips go into one collection per
+# pickup month (taxi_trips_2019_01, ...), each with its own, smaller indexes.
+# A month is loaded into <name>__loading and renamed over the old partition
+# when complete, so reloading January never touches February. The
+# trip_partitions registry records which partitions are attached; detached
+# ones keep their data but are left out of aggregation.
+#
+# run_partitioned_aggregation() groups every attached partition (or only the
+# requested months) into count / fare_sum / dist_sum on its own thread over
+# the shared pooled client, so mongod works on several collections at once,
+# then merges the partial sums into the run_aggregation schema.
+
+PARTITION_PREFIX = "taxi_trips_"
+PARTITION_PATTERN = re.compile(r"^taxi_trips_(\d{4})_(\d{2})$")
+LOADING_SUFFIX = "__loading"
+REGISTRY = "trip_partitions"
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUT = os.path.join(PROJECT_ROOT, "data", "results", "partitioned_hourly_grid_counts.json")
+
+
+def partition_name(year, month):
+    return f"{PARTITION_PREFIX}{year:04d}_{month:02d}"
+
+
+def parse_month(text):
+    """"2019-01" -> (2019, 1)"""
+    year, month = (int(part) for part in text.split("-"))
+    if not 1 <= month <= 12:
+        raise ValueError(f"invalid month: {text}")
+    return year, month
+
+
+def register(db, name, rows, attached=True, **fields):
+    match = PARTITION_PATTERN.match(name)
+    if match is None:
+        raise ValueError(f"not a partition name: {name}")
+    db[REGISTRY].update_one({"_id": name}, {"$set": dict(
+        fields, year=int(match.group(1)), month=int(match.group(2)), rows=rows,
+        attached=attached, updated_at=datetime.now())}, upsert=True)
+
+
+def list_partitions(db, attached=None):
+    """Registry entries sorted by month; `attached` filters on the flag"""
+    query = {} if attached is None else {"attached": attached}
+    return list(db[REGISTRY].find(query).sort("_id", 1))
+
+
+def attach_partition(db, name):
+    """Include an existing partition collection (e.g. restored from a dump) in aggregation"""
+    if name not in db.list_collection_names():
+        raise ValueError(f"no such partition collection: {name}")
+    register(db, name, db[name].estimated_document_count(), attached=True)
+    print(f"Attached {name}")
+
+
+def detach_partition(db, name, drop=False):
+    """Leave a partition out of aggregation; with `drop`, delete its data as well"""
+    if db[REGISTRY].find_one({"_id": name}, {"_id": 1}) is None:
+        raise ValueError(f"no such partition: {name}")
+    if drop:
+        db[name].drop()
+        db[REGISTRY].delete_one({"_id": name})
+        print(f"Dropped {name}")
+    else:
+        db[REGISTRY].update_one({"_id": name}, {"$set": {"attached": False}})
+        print(f"Detached {name}")
+
+
+def month_keys(df):
+    """year * 12 + month - 1 per row; also leaves the pickup column parsed"""
+    pickup = pd.to_datetime(df["tpep_pickup_datetime"], format=PICKUP_FORMAT)
+    df["tpep_pickup_datetime"] = pickup
+    return (pickup.dt.year * 12 + pickup.dt.month - 1).to_numpy()
+
+
+def swap_in(db, name, rows, layout, source):
+    """Index a fully loaded month, rename it over the old partition and attach it"""
+    loading = db[name + LOADING_SUFFIX]
+    create_indexes(loading, layout=layout)
+    loading.rename(name, dropTarget=True)
+    register(db, name, rows, attached=True, layout=layout, source=source)
+    return name, rows
+
+
+def ingest_partitioned(csv_path, mongo_uri, db_name, sample_rows=None, chunk_size=100000,
+                       layout="compact", workers=None, should_stop=None):
+    """
+    Stream the CSV into one collection per pickup month.
+
+    Every month present in the file replaces its partition; other partitions
+    are not touched. Index builds and renames run on `workers` threads.
+    Returns {partition name: rows}.
+    """
+    db = get_client(mongo_uri)[db_name]
+    for stale in db.list_collection_names(filter={"name": {"$regex": f"{LOADING_SUFFIX}$"}}):
+        db[stale].drop()
+
+    print(f"Partitioned ingest: {csv_path} (chunk_size={chunk_size})")
+    lat_lut, lon_lut = load_zone_arrays()
+    counts = {}
+    t0 = time.perf_counter()
+    with read_trip_chunks(csv_path, chunk_size, sample_rows) as reader:
+        for i, df in enumerate(reader):
+            if should_stop is not None and should_stop():
+                for name in counts:
+                    db[name + LOADING_SUFFIX].drop()
+                print(f"Partitioned ingest stopped, {len(counts)} loading partitions dropped.")
+                return {}
+            keys = month_keys(df)
+            cols = transform_chunk(df, lat_lut, lon_lut)
+            for key in np.unique(keys).tolist():
+                sel = keys == key
+                name = partition_name(key // 12, key % 12 + 1)
+                docs = build_documents({k: v[sel] for k, v in cols.items()}, layout=layout)
+                db[name + LOADING_SUFFIX].insert_many(docs, ordered=False)
+                counts[name] = counts.get(name, 0) + len(docs)
+            print(f"Chunk {i}: {len(df)} rows into {len(np.unique(keys))} partitions")
+
+    source = os.path.basename(csv_path)
+    with ThreadPoolExecutor(max_workers=workers or min(len(counts), 8) or 1) as pool:
+        futures = [pool.submit(swap_in, db, name, rows, layout, source)
+                   for name, rows in counts.items()]
+        for fut in as_completed(futures):
+            name, rows = fut.result()
+            print(f"  {name}: {rows} trips")
+    print(f"Partitioned ingest complete: {sum(counts.values())} trips in {len(counts)} "
+          f"partitions in {time.perf_counter() - t0:.2f}s")
+    return counts
+
+
+def partition_sums(db, name):
+    """Worker: (cell, hour) -> [count, fare_sum, dist_sum] of one partition"""
+    t0 = time.perf_counter()
+    coll = db[name]
+    layout = detect_layout(coll)
+    # Compact partitions are grouped from the covering index alone
+    options = {"hint": COVERING_INDEX_NAME} if layout == "compact" else {}
+    sums = {}
+    for doc in coll.aggregate([group_stage(layout)], **options):
+        if layout == "compact":
+            cell = doc["_id"]["cell"]
+        else:
+            cell = pack_cell(doc["grid_x"], doc["grid_y"])
+        sums[(cell, doc["_id"]["hour"])] = [doc["count"], doc["fare_sum"], doc["dist_sum"]]
+    return name, sums, time.perf_counter() - t0
+
+
+def run_partitioned_aggregation(mongo_uri, db_name, out_file, months=None, workers=None):
+    """
+    Aggregate the attached partitions in parallel and merge their sums.
+
+    `months` ([(year, month), ...]) restricts the run to those partitions.
+    Output has the run_aggregation schema, plus the columnar store.
+    """
+    db = get_client(mongo_uri)[db_name]
+    names = [p["_id"] for p in list_partitions(db, attached=True)
+             if months is None or (p["year"], p["month"]) in months]
+    workers = min(workers or os.cpu_count() or 1, len(names)) or 1
+    print(f"Partitioned aggregation: {len(names)} partitions on {workers} threads")
+
+    totals = {}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(partition_sums, db, name) for name in names]
+        for fut in as_completed(futures):
+            name, sums, elapsed = fut.result()
+            print(f"  {name}: {len(sums)} (cell, hour) groups in {elapsed:.2f}s")
+            for key, (n, fare, dist) in sums.items():
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [n, fare, dist]
+                else:
+                    total[0] += n
+                    total[1] += fare
+                    total[2] += dist
+
+    result = [cell_row(cell, hour, n, fare / n, dist / n)
+              for (cell, hour), (n, fare, dist) in totals.items()]
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, result, EXPORT_SEPARATORS)
+    write_columnar(result, out_file)
+    print(f"Partitioned aggregation complete: {len(result)} rows from {len(names)} partitions "
+          f"in {time.perf_counter() - t0:.2f}s → {out_file}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage month-partitioned trip collections")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.getenv("MONGO_DB", "taxi_hotspot_db"))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest = sub.add_parser("ingest", help="load a trip CSV into monthly partitions")
+    ingest.add_argument("csv")
+    ingest.add_argument("--sample-rows", type=int, default=None)
+    ingest.add_argument("--chunk-size", type=int, default=100000)
+    ingest.add_argument("--layout", default="compact")
+
+    aggregate = sub.add_parser("aggregate", help="aggregate attached partitions")
+    aggregate.add_argument("--out", default=DEFAULT_OUT)
+    aggregate.add_argument("--months", default=None, help="e.g. 2019-01,2019-02")
+    aggregate.add_argument("--workers", type=int, default=None)
+
+    sub.add_parser("list", help="show registered partitions")
+    for command in ("attach", "detach"):
+        p = sub.add_parser(command, help=f"{command} a partition")
+        p.add_argument("month", help="YYYY-MM")
+        if command == "detach":
+            p.add_argument("--drop", action="store_true", help="also delete its trips")
+
+    args = parser.parse_args()
+    db = get_client(args.mongo_uri)[args.db]
+    if args.command == "ingest":
+        ingest_partitioned(args.csv, args.mongo_uri, args.db, sample_rows=args.sample_rows,
+                           chunk_size=args.chunk_size, layout=args.layout)
+    elif args.command == "aggregate":
+        months = [parse_month(m) for m in args.months.split(",")] if args.months else None
+        run_partitioned_aggregation(args.mongo_uri, args.db, args.out, months=months,
+                                    workers=args.workers)
+    elif args.command == "list":
+        for p in list_partitions(db):
+            state = "attached" if p["attached"] else "detached"
+            print(f"{p['_id']}: {p['rows']} trips, {state}")
+    elif args.command == "attach":
+        attach_partition(db, partition_name(*parse_month(args.month)))
+    else:
+        detach_partition(db, partition_name(*parse_month(args.month)), drop=args.drop)
+
+
+if __name__ == "__main__":
+    main()
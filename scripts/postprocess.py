@@ -1,63 +1,179 @@
 import json
 import numpy as np
+import pandas as pd
 import os
 
-def detect_anomalies(input_file, out_file, threshold=3.0):
+from scripts.ingest import pack_cell, unpack_cell
+from scripts.instrumentation import write_step
+from scripts.columnar import ColumnarResult, write_json_atomic, unpack_cells, EXPORT_SEPARATORS
+
+HOURS = 24
+# Scales MAD to be consistent with the standard deviation of a normal distribution
+MAD_SCALE = 0.6745
+# Cells are indexed through their (grid_x, grid_y) bounding box while it has at
+# most this many slots per stored row; sparser grids fall back to np.unique
+DENSE_BOX_RATIO = 4
+
+
+def build_count_matrix(data):
+    """
+    Pack aggregated rows into a single (n_cells x 24) count matrix.
+
+    Cells keep the order in which they first appear in `data`; missing hours
+    are 0 and a repeated (grid_key, hour) keeps the last count seen.
+    """
+    cell_idx, keys = pd.factorize(pd.Series([row["grid_key"] for row in data], dtype=object))
+    hours = np.fromiter((row.get("hour") for row in data), dtype=np.float64, count=len(data)).astype(np.int64)
+    counts = np.fromiter((row["count"] for row in data), dtype=np.float64, count=len(data))
+
+    matrix = np.zeros((len(keys), HOURS), dtype=np.float64)
+    matrix[cell_idx, hours] = counts
+    return np.asarray(keys, dtype=object), matrix
+
+
+def cell_index(cells):
+    """
+    (distinct packed cells, position of every entry among them). A compact
+    grid is indexed through its bounding box in linear time, no sort.
+    """
+    if len(cells) == 0:
+        return cells[:0], np.zeros(0, dtype=np.int64)
+    gx, gy = unpack_cells(cells)
+    x0, y0 = gx.min(), gy.min()
+    width = int(gy.max() - y0) + 1
+    box = (int(gx.max() - x0) + 1) * width
+    if box > DENSE_BOX_RATIO * len(cells):
+        return np.unique(cells, return_inverse=True)
+    slot = (gx - x0) * width + (gy - y0)
+    present = np.zeros(box, dtype=bool)
+    present[slot] = True
+    rank = np.cumsum(present) - 1
+    occupied = np.flatnonzero(present)
+    return pack_cell(occupied // width + x0, occupied % width + y0), rank[slot]
+
+
+def store_count_matrix(store):
+    """
+    (packed cells, n_cells x 24 count matrix) straight from the mapped cell,
+    hour and count columns of a columnar store (scripts/columnar.py).
+    """
+    cells, idx = cell_index(np.asarray(store.columns["cell"]))
+    counts = store.columns["count"]
+    # The store is sorted by hour: fill one contiguous hour row at a time
+    matrix = np.zeros((HOURS, len(cells)), dtype=np.float64)
+    for hour in range(HOURS):
+        lo, hi = store.hour_range(hour)
+        matrix[hour, idx[lo:hi]] = counts[lo:hi]
+    return cells, np.ascontiguousarray(matrix.T)
+
+
+def row_median(matrix, out=None):
+    """
+    Per-row median. One in-place sort of the short rows (into `out`, when
+    given) beats np.median and np.partition on 24-wide rows.
+    """
+    if out is None:
+        ordered = np.sort(matrix, axis=1)
+    else:
+        ordered = out
+        ordered.sort(axis=1)
+    mid = matrix.shape[1] // 2
+    if matrix.shape[1] % 2:
+        return ordered[:, mid:mid + 1].copy()
+    return (ordered[:, mid - 1:mid] + ordered[:, mid:mid + 1]) / 2
+
+
+def score_matrix(matrix, method="zscore"):
+    """
+    Score every (cell, hour) against that cell's 24-hour distribution in one pass.
+
+    method="zscore": (count - mean) / std
+    method="robust": 0.6745 * (count - median) / MAD
+    Cells with zero spread get NaN scores (never flagged).
+    """
+    if method == "zscore":
+        center = matrix.mean(axis=1, keepdims=True)
+        spread = matrix.std(axis=1, keepdims=True)
+    elif method == "robust":
+        center = row_median(matrix)
+        deviation = matrix - center
+        np.abs(deviation, out=deviation)
+        spread = row_median(deviation, out=deviation) / MAD_SCALE
+    else:
+        raise ValueError(f"Unknown anomaly scoring method: {method}")
+
+    # In place: one n_cells x 24 temporary in all
+    scores = matrix - center
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores /= spread
+    scores[spread[:, 0] == 0] = np.nan
+    return scores
+
+
+def find_anomalies(scores, threshold=3.0, top_n=None):
+    """
+    Return flat indices of flagged (cell, hour) entries.
+
+    By default every |score| > threshold in row-major order; with `top_n`,
+    only the N strongest, strongest first (partial sort via argpartition).
+    """
+    flat = np.abs(scores).ravel()
+    flagged = np.flatnonzero(flat > threshold)
+    if top_n is None or top_n >= len(flagged):
+        if top_n is not None:
+            flagged = flagged[np.argsort(-flat[flagged], kind="stable")]
+        return flagged
+    strongest = np.argpartition(-flat[flagged], top_n - 1)[:top_n]
+    strongest = strongest[np.argsort(-flat[flagged][strongest], kind="stable")]
+    return flagged[strongest]
+
+
+def detect_anomalies(input_file, out_file, threshold=3.0, method="zscore", top_n=None):
     """
     Detect anomalies based on z-score analysis per grid cell.
-    
+
     For each grid cell, compares the trip count for each hour against
-    the distribution of that grid cell across all 24 hours.
-    
+    the distribution of that grid cell across all 24 hours. All cells are
+    scored at once on an (n_cells x 24) matrix.
+
+    The matrix comes straight from the input's columnar store when it has
+    one; otherwise the JSON rows are parsed.
+
     Args:
         input_file: Path to aggregated hotspots JSON
         out_file: Path to save anomaly results
         threshold: Z-score threshold (default 3.0 = ~0.3% outliers)
+        method: "zscore" (mean/std) or "robust" (median/MAD)
+        top_n: If set, keep only the N strongest anomalies, strongest first
     """
-    with open(input_file) as f:
-        data = json.load(f)
-
-    # Group data by grid_key AND hour (preserve hour information)
-    df = {}
-    for row in data:
-        k = row["grid_key"]
-        hour = row.get("hour")
-        count = row["count"]
-        
-        if k not in df:
-            df[k] = {}
-        df[k][hour] = count
+    try:
+        store = ColumnarResult(input_file)
+    except (OSError, ValueError):
+        store = None
+    if store is not None:
+        packed, matrix = store_count_matrix(store)
+        grid_key = lambda c: "{}_{}".format(*unpack_cell(int(packed[c])))
+    else:
+        with open(input_file) as f:
+            data = json.load(f)
+        keys, matrix = build_count_matrix(data)
+        grid_key = keys.__getitem__
+    scores = score_matrix(matrix, method)
+    flat = find_anomalies(scores, threshold, top_n)
+    cells, hours = np.divmod(flat, HOURS)
 
     anomalies = []
-    
-    # For each grid cell, analyze all 24 hours
-    for grid_key, hours_dict in df.items():
-        # Get counts for all 24 hours (0 if hour not present)
-        counts = [hours_dict.get(h, 0) for h in range(24)]
-        
-        mean = np.mean(counts)
-        std = np.std(counts)
-        
-        # Check each hour for anomalies
-        for hour in range(24):
-            count = counts[hour]
-            
-            # Calculate z-score
-            if std > 0:
-                z_score = (count - mean) / std
-                
-                # Flag if z-score exceeds threshold
-                if abs(z_score) > threshold:
-                    anomalies.append({
-                        "grid_key": grid_key,
-                        "hour": hour,
-                        "count": count,
-                        "zscore": round(z_score, 2)
-                    })
-    
+    for c, h in zip(cells.tolist(), hours.tolist()):
+        anomalies.append({
+            "grid_key": grid_key(c),
+            "hour": h,
+            "count": int(matrix[c, h]),
+            "zscore": round(float(scores[c, h]), 2)
+        })
+
     os.makedirs(os.path.dirname(out_file), exist_ok=True)
-    with open(out_file, "w") as f:
-        json.dump(anomalies, f, indent=2)
-    
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, anomalies, EXPORT_SEPARATORS)
+
     print(f"Anomaly detection complete: {len(anomalies)} anomalies → {out_file}")
     return anomalies
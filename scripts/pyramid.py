@@ -0,0 +1,92 @@
+import os
+import numpy as np
+
+from scripts.ingest import load_zone_arrays
+from scripts.bincount import zone_hour_sums, fold_zones_to_cells
+from scripts.instrumentation import write_step
+from scripts.columnar import write_json_atomic, EXPORT_SEPARATORS
+
+# Multi-resolution grid pyramid.
+#
+# Every pickup sits on its zone centroid, so the zone x hour sums from
+# bincount.zone_hour_sums fold exactly into cells of any size. One pass over
+# the CSV yields every level; each level is a fold of ~263 zones. Rows keep
+# the hourly_grid_counts.json schema, with grid_x/grid_y in units of
+# 1/scale degrees.
+
+# (resolution in degrees, cells per degree), finest first
+LEVELS = [(0.005, 200), (0.01, 100), (0.05, 20), (0.1, 10)]
+
+# Minimum Leaflet zoom at which each level is used; coarser levels below
+ZOOM_LEVELS = [(14, 0.005), (12, 0.01), (10, 0.05), (0, 0.1)]
+
+
+def level_for_zoom(zoom):
+    """Resolution (degrees) to draw at a map zoom level"""
+    for min_zoom, resolution in ZOOM_LEVELS:
+        if zoom >= min_zoom:
+            return resolution
+    return ZOOM_LEVELS[-1][1]
+
+
+def build_pyramid(count, fare_sum, dist_sum, lat_lut, lon_lut, levels=LEVELS):
+    """Fold zone x hour sums into every level -> {"levels": [{resolution, scale, rows}]}"""
+    out = []
+    for resolution, scale in levels:
+        rows = fold_zones_to_cells(count, fare_sum, dist_sum, lat_lut, lon_lut, scale=scale)
+        # Busiest first, so a viewport query can stop after `limit` rows
+        rows.sort(key=lambda r: r["count"], reverse=True)
+        out.append({"resolution": resolution, "scale": scale, "rows": rows})
+    return {"levels": out}
+
+
+def run_pyramid(csv_path, out_file, sample_rows=None, chunk_size=500000, levels=LEVELS):
+    lat_lut, lon_lut = load_zone_arrays()
+    count, fare_sum, dist_sum = zone_hour_sums(csv_path, sample_rows, chunk_size, size=len(lat_lut))
+    pyramid = build_pyramid(count, fare_sum, dist_sum, lat_lut, lon_lut, levels)
+
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, pyramid, EXPORT_SEPARATORS)
+    sizes = ", ".join(f"{l['resolution']}°: {len(l['rows'])}" for l in pyramid["levels"])
+    print(f"Grid pyramid complete ({sizes} rows) → {out_file}")
+    return sum(len(l["rows"]) for l in pyramid["levels"])
+
+
+class PyramidIndex:
+    """
+    Column arrays per level for viewport queries over a loaded pyramid.
+
+    Rows stay in their busiest-first order, so the first `limit` matches of
+    a mask are the top cells in the viewport.
+    """
+
+    def __init__(self, pyramid):
+        self.levels = {}
+        for level in pyramid["levels"]:
+            rows = level["rows"]
+            self.levels[level["resolution"]] = {
+                "scale": level["scale"],
+                "rows": rows,
+                "grid_x": np.array([r["grid_x"] for r in rows], dtype=np.int64),
+                "grid_y": np.array([r["grid_y"] for r in rows], dtype=np.int64),
+                "hour": np.array([r["hour"] for r in rows], dtype=np.int64),
+            }
+
+    def query(self, resolution, bbox=None, hour=None, limit=None):
+        """Rows of one level whose cell intersects bbox, optionally for one hour"""
+        level = self.levels[resolution]
+        mask = np.ones(len(level["rows"]), dtype=bool)
+        if hour is not None:
+            mask &= level["hour"] == hour
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            scale = level["scale"]
+            gx, gy = level["grid_x"], level["grid_y"]
+            mask &= ((gx + 1) / scale > min_lon) & (gx / scale < max_lon)
+            mask &= ((gy + 1) / scale > min_lat) & (gy / scale < max_lat)
+        idx = np.flatnonzero(mask)
+        total = len(idx)
+        if limit is not None:
+            idx = idx[:limit]
+        return [level["rows"][i] for i in idx.tolist()], total
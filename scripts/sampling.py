@@ -0,0 +1,341 @@
+import argparse
+import json
+import math
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from scripts.ingest import load_zone_arrays, zone_index, PICKUP_FORMAT
+from scripts.bincount import zone_cells, HOURS
+from scripts.trip_cache import (read_trip_chunks, open_trip_cache, build_trip_cache, source_key,
+                                TRIP_COLUMNS)
+from scripts.columnar import store_stem, write_json_atomic, write_columnar, EXPORT_SEPARATORS
+from scripts.instrumentation import write_step
+
+# Sampled hotspot estimates with error bounds.
+#
+# sample_rows used to mean "the first N rows", which for a monthly file is
+# mostly its first day. Here the sample is drawn from the whole file:
+#
+#   uniform     every row gets a random key and the N smallest keys are kept
+#               (a bottom-k reservoir, one pass, any file size)
+#   stratified  strata are pickup (day, hour); a first pass counts them, the
+#               second keeps the smallest keys of each stratum with N split
+#               proportionally to stratum size
+#
+# Each sampled trip stands for N_s / n_s trips of its stratum. Counts per
+# (cell, hour) are the weighted sums, with the usual stratified variance
+# (finite population correction included) giving a confidence interval.
+#
+# Progressive mode reads the trip cache in a random row order and publishes
+# refined estimates after each step (1%, 2%, 5%, ... of the target), so a
+# running API serves usable numbers after the first seconds. Every prefix of
+# a random order is a uniform sample; "stratified" post-stratifies it.
+#
+# The pipeline uses the same draw to pick its sample_rows rows: with
+# row_sampling="uniform"|"stratified", write_sample_csv() copies the drawn
+# lines (in file order) to a sample CSV that every engine reads in place of
+# the source; "first" keeps the old head-of-file rows.
+
+SAMPLING_METHODS = ("uniform", "stratified")
+ROW_SAMPLINGS = ("first",) + SAMPLING_METHODS
+PROGRESSIVE_STEPS = (0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Per-row fields beyond the hourly_grid_counts schema, kept as extra columnar columns
+INTERVAL_COLUMNS = ("count_low", "count_high", "sampled")
+Z_SCORES = {0.9: 1.6448536269514722, 0.95: 1.959963984540054, 0.99: 2.5758293035489004}
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CSV = os.path.join(PROJECT_ROOT, "data", "raw", "yellow_tripdata_2019-01.csv")
+DEFAULT_OUT = os.path.join(PROJECT_ROOT, "data", "results", "sampled_hourly_grid_counts.json")
+SAMPLE_DIR = os.getenv("SAMPLE_DIR", os.path.join(PROJECT_ROOT, "data", "cache", "samples"))
+# Fixed, so rerunning with the same parameters reads the same rows (and hits the stage cache)
+SAMPLE_SEED = 0
+
+
+def sampling_meta_path(json_path):
+    return f"{store_stem(json_path)}.sampling.json"
+
+
+class TripFeatures:
+    """Per-row stratum, (cell, hour) group, fare and distance of trip chunks"""
+
+    def __init__(self):
+        lat_lut, lon_lut = load_zone_arrays()
+        self.size = len(lat_lut)
+        self.cells, self.inverse = zone_cells(lat_lut, lon_lut)
+
+    def __call__(self, df, method):
+        pickup = pd.to_datetime(df["tpep_pickup_datetime"], format=PICKUP_FORMAT)
+        cell = self.inverse[zone_index(df["PULocationID"].to_numpy(), self.size)]
+        return {
+            "stratum": stratum_ids(pickup) if method == "stratified"
+            else np.zeros(len(df), dtype=np.int64),
+            "group": cell * HOURS + pickup.dt.hour.to_numpy(),
+            "fare": df["fare_amount"].to_numpy(dtype=np.float64),
+            "dist": df["trip_distance"].to_numpy(dtype=np.float64),
+        }
+
+
+def stratum_ids(pickup):
+    """(day, hour) stratum of every pickup, as hours since the epoch"""
+    return pickup.to_numpy().astype("datetime64[h]").astype(np.int64)
+
+
+def concat(a, b):
+    return {k: np.concatenate([a[k], b[k]]) for k in b} if a else b
+
+
+def keep_smallest(sample, quota):
+    """The rows with the smallest keys of each stratum, quota(strata) rows at most"""
+    order = np.lexsort((sample["key"], sample["stratum"]))
+    strata = sample["stratum"][order]
+    starts = np.flatnonzero(np.r_[True, strata[1:] != strata[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    keep = order[rank < quota(strata)]
+    return {k: v[keep] for k, v in sample.items()}
+
+
+def stratum_sizes(csv_path, chunk_size=500000):
+    """Sorted stratum ids and their trip counts over the whole file"""
+    ids, sizes = [], []
+    with read_trip_chunks(csv_path, chunk_size) as reader:
+        for df in reader:
+            u, n = np.unique(stratum_ids(pd.to_datetime(df["tpep_pickup_datetime"],
+                                                        format=PICKUP_FORMAT)),
+                             return_counts=True)
+            ids.append(u)
+            sizes.append(n)
+    ids, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+    return ids, np.bincount(inverse, weights=np.concatenate(sizes)).astype(np.int64)
+
+
+def allocate(sizes, n):
+    """Proportional allocation of n rows, at least 2 per stratum (for the variance)"""
+    alloc = np.round(sizes * (n / sizes.sum())).astype(np.int64)
+    return np.minimum(sizes, np.maximum(alloc, 2))
+
+
+def draw_sample(csv_path, n, method="stratified", rng=None, chunk_size=500000):
+    """
+    Stream the whole file once (twice for "stratified") and keep a sample of
+    about `n` rows (None: every row). Returns (sample, stratum ids, stratum sizes).
+    """
+    rng = rng or np.random.default_rng()
+    features = TripFeatures()
+    if method == "stratified":
+        ids, sizes = stratum_sizes(csv_path, chunk_size)
+        alloc = sizes if n is None else allocate(sizes, n)
+        quota = lambda strata: alloc[np.searchsorted(ids, strata)]
+    else:
+        quota = lambda strata: len(strata) if n is None else n
+
+    sample, total = None, 0
+    with read_trip_chunks(csv_path, chunk_size) as reader:
+        for df in reader:
+            chunk = features(df, method)
+            chunk["key"] = rng.random(len(df))
+            chunk["row"] = np.arange(total, total + len(df))
+            sample = keep_smallest(concat(sample, chunk), quota)
+            total += len(df)
+    if method != "stratified":
+        ids, sizes = np.zeros(1, dtype=np.int64), np.array([total])
+    return sample, ids, sizes
+
+
+def sample_csv_path(csv_path, n, method):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(SAMPLE_DIR, f"{stem}.{method}-{n}.csv")
+
+
+def write_sample_csv(csv_path, n, method="uniform", seed=SAMPLE_SEED, chunk_size=500000):
+    """
+    Copy the header and an n-row `method` sample of the whole file's lines,
+    in file order, to sample_csv_path(). Reused while the source and the
+    parameters are unchanged. Returns the number of sampled rows.
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method: {method}")
+    out = sample_csv_path(csv_path, n, method)
+    key = dict(source_key(csv_path), rows=n, method=method, seed=seed)
+    try:
+        with open(f"{out}.json") as f:
+            meta = json.load(f)
+        if {k: meta.get(k) for k in key} == key and os.path.exists(out):
+            print(f"Sample up to date: {meta['sampled']} rows ({out})")
+            return meta["sampled"]
+    except (OSError, ValueError):
+        pass
+
+    t0 = time.perf_counter()
+    build_trip_cache(csv_path)
+    sample, _, _ = draw_sample(csv_path, n, method, np.random.default_rng(seed), chunk_size)
+    wanted = iter(np.sort(sample["row"]).tolist())
+    os.makedirs(SAMPLE_DIR, exist_ok=True)
+    tmp = f"{out}.tmp-{os.getpid()}"
+    with open(csv_path, "rb") as src, open(tmp, "wb") as dst:
+        dst.write(src.readline())
+        row, target = 0, next(wanted, None)
+        for line in src:
+            if target is None:
+                break
+            # Row numbers follow read_csv, which skips blank lines
+            if not line.strip():
+                continue
+            if row == target:
+                dst.write(line if line.endswith(b"\n") else line + b"\n")
+                target = next(wanted, None)
+            row += 1
+    os.replace(tmp, out)
+    write_json_atomic(f"{out}.json", dict(key, sampled=len(sample["row"])))
+    print(f"Sampled {len(sample['row'])} rows ({method}) in {time.perf_counter() - t0:.2f}s → {out}")
+    return len(sample["row"])
+
+
+def progressive_samples(csv_path, n=None, method="stratified", rng=None, steps=PROGRESSIVE_STEPS):
+    """
+    Yield (sample, stratum ids, stratum sizes) for growing prefixes of a random
+    row order, up to `n` rows (default: the whole file). Reads the trip cache,
+    building it first if needed.
+    """
+    rng = rng or np.random.default_rng()
+    cache = open_trip_cache(csv_path)
+    if cache is None:
+        build_trip_cache(csv_path)
+        cache = open_trip_cache(csv_path)
+    features = TripFeatures()
+    if method == "stratified":
+        pickup = cache.frame(0, cache.rows, [TRIP_COLUMNS[0]])[TRIP_COLUMNS[0]]
+        ids, sizes = np.unique(stratum_ids(pickup), return_counts=True)
+    else:
+        ids, sizes = np.zeros(1, dtype=np.int64), np.array([cache.rows])
+
+    target = min(n or cache.rows, cache.rows)
+    order = rng.permutation(cache.rows)[:target]
+    sample, done = None, 0
+    for fraction in steps:
+        upto = max(int(target * fraction), 1)
+        if upto <= done:
+            continue
+        # Sorted indices turn the random gather into a forward scan of the mmap
+        chunk = features(cache.take(np.sort(order[done:upto])), method)
+        sample = concat(sample, chunk)
+        done = upto
+        yield sample, ids, sizes
+
+
+def estimate(sample, ids, sizes, cells, confidence=0.95):
+    """
+    Scale a sample up to (cell, hour) rows in the hourly_grid_counts.json
+    schema, plus count_low / count_high (confidence interval) and `sampled`.
+    """
+    z = Z_SCORES[confidence]
+    strata = len(ids)
+    pos = np.searchsorted(ids, sample["stratum"])
+    taken = np.bincount(pos, minlength=strata)
+    weight = sizes[pos] / taken[pos]
+    n_groups = len(cells) * HOURS
+    count = np.bincount(sample["group"], weights=weight, minlength=n_groups)
+    fare = np.bincount(sample["group"], weights=weight * sample["fare"], minlength=n_groups)
+    dist = np.bincount(sample["group"], weights=weight * sample["dist"], minlength=n_groups)
+    sampled = np.bincount(sample["group"], minlength=n_groups)
+
+    # Var(N_hat) = sum_s N_s^2 (1 - n_s/N_s) p_s (1 - p_s) / (n_s - 1), p_s = share of
+    # stratum s in the group; strata without a trip of the group contribute nothing
+    pairs, m = np.unique(sample["group"] * strata + pos, return_counts=True)
+    group, s = pairs // strata, pairs % strata
+    n_s, big_n = taken[s], sizes[s]
+    p = m / n_s
+    term = big_n ** 2 * (1 - n_s / big_n) * p * (1 - p) / np.maximum(n_s - 1, 1)
+    se = np.sqrt(np.bincount(group, weights=term, minlength=n_groups))
+
+    rows = []
+    for g in np.flatnonzero(sampled).tolist():
+        n_hat = float(count[g])
+        gx, gy = int(cells[g // HOURS, 0]), int(cells[g // HOURS, 1])
+        rows.append({
+            "count": round(n_hat),
+            "avg_fare": float(fare[g]) / n_hat,
+            "avg_distance": float(dist[g]) / n_hat,
+            "grid_x": gx,
+            "grid_y": gy,
+            "grid_key": f"{gx}_{gy}",
+            "hour": g % HOURS,
+            "count_low": max(int(sampled[g]), math.floor(n_hat - z * se[g])),
+            "count_high": math.ceil(n_hat + z * se[g]),
+            "sampled": int(sampled[g]),
+        })
+    meta = {
+        "population_rows": int(sizes.sum()),
+        "sample_rows": int(len(pos)),
+        "fraction": len(pos) / float(sizes.sum()),
+        "strata": int(strata),
+        # Strata the sample has not reached yet (progressive mode) are left out of the estimate
+        "uncovered_rows": int(sizes[taken == 0].sum()),
+        "confidence": confidence,
+    }
+    return rows, meta
+
+
+def publish(rows, meta, out_file):
+    """
+    Write rows (compact JSON plus a columnar store that keeps the interval
+    columns) and the sampling meta, each file atomically.
+    """
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with write_step("json_write", out_file):
+        write_json_atomic(out_file, rows, EXPORT_SEPARATORS)
+    write_columnar(rows, out_file, extra=INTERVAL_COLUMNS)
+    write_json_atomic(sampling_meta_path(out_file), meta)
+
+
+def run_sampled(csv_path, out_file, sample_rows=100000, method="stratified", seed=None,
+                progressive=False, confidence=0.95, chunk_size=500000, preview_file=None):
+    """
+    Estimate hourly grid counts from a sample of `sample_rows` trips drawn
+    from the whole file. With `progressive`, publish after every step; steps
+    before the last go to `preview_file` when given (a pipeline job's staged
+    output only goes live when the job finishes).
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method: {method}")
+    rng = np.random.default_rng(seed)
+    cells = TripFeatures().cells
+    t0 = time.perf_counter()
+    if progressive:
+        for sample, ids, sizes in progressive_samples(csv_path, sample_rows, method, rng):
+            rows, meta = estimate(sample, ids, sizes, cells, confidence)
+            meta.update(method=method, seed=seed, progressive=True,
+                        complete=meta["sample_rows"] >= min(sample_rows or math.inf,
+                                                            meta["population_rows"]))
+            publish(rows, meta, out_file if meta["complete"] else preview_file or out_file)
+            print(f"  {meta['sample_rows']} trips ({meta['fraction']:.1%}): {len(rows)} rows "
+                  f"published after {time.perf_counter() - t0:.2f}s")
+    else:
+        sample, ids, sizes = draw_sample(csv_path, sample_rows, method, rng, chunk_size)
+        rows, meta = estimate(sample, ids, sizes, cells, confidence)
+        meta.update(method=method, seed=seed, progressive=False, complete=True)
+        publish(rows, meta, out_file)
+    print(f"Sampled estimate complete ({method}): {meta['sample_rows']} of "
+          f"{meta['population_rows']} trips, {len(rows)} rows in "
+          f"{time.perf_counter() - t0:.2f}s → {out_file}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate hotspots from a sample of the trips")
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--sample-rows", type=int, default=100000,
+                        help="sample size (progressive: final size, 0 = whole file)")
+    parser.add_argument("--method", choices=SAMPLING_METHODS, default="stratified")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--confidence", type=float, choices=sorted(Z_SCORES), default=0.95)
+    parser.add_argument("--progressive", action="store_true")
+    args = parser.parse_args()
+    run_sampled(args.csv, args.out, sample_rows=args.sample_rows or None, method=args.method,
+                seed=args.seed, progressive=args.progressive, confidence=args.confidence)
+
+
+if __name__ == "__main__":
+    main()
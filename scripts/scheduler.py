@@ -0,0 +1,137 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Minimal DAG stage scheduler.
+#
+# A pipeline is a list of Stage(name, func, deps). A stage starts as soon as
+# all of its deps have finished, so independent stages (e.g. MapReduce and
+# anomaly detection) overlap on the thread pool. The heavy lifting inside
+# stages already happens in mongod, NumPy or process pools, so threads are
+# enough to overlap them. End-to-end time approaches the critical path
+# (longest chain of dependent stages) instead of the sum of all stages.
+
+
+class Stage:
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, deps={self.deps})"
+
+
+def topological_order(stages):
+    """Stage names in dependency order; raises ValueError on unknown deps or cycles"""
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage: {stage.name}")
+        by_name[stage.name] = stage
+    for stage in stages:
+        missing = [d for d in stage.deps if d not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {missing}")
+
+    order, state = [], {}
+
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for dep in by_name[name].deps:
+            visit(dep, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for stage in stages:
+        visit(stage.name, [])
+    return order
+
+
+def critical_path(stages, seconds):
+    """Longest chain of dependent stages by duration -> (names, total seconds)"""
+    by_name = {s.name: s for s in stages}
+    finish, via = {}, {}
+    for name in topological_order(stages):
+        deps = by_name[name].deps
+        prev = max(deps, key=lambda d: finish[d]) if deps else None
+        finish[name] = seconds.get(name, 0.0) + (finish[prev] if prev else 0.0)
+        via[name] = prev
+    if not finish:
+        return [], 0.0
+    name = max(finish, key=finish.get)
+    total = finish[name]
+    path = []
+    while name is not None:
+        path.append(name)
+        name = via[name]
+    return path[::-1], total
+
+
+def run_stages(stages, max_workers=4, on_start=None, on_finish=None):
+    """
+    Run stages concurrently in dependency order.
+
+    Each stage func is called with no arguments. on_start(name) runs on the
+    worker thread right before a stage (raising there aborts it, e.g. for
+    cancellation); on_finish(name, seconds, result) right after it. The first
+    failure stops new stages from being scheduled and is re-raised once the
+    running ones have finished.
+
+    Returns {"results", "timings", "critical_path", "critical_path_seconds",
+    "wall_seconds"}.
+    """
+    topological_order(stages)
+    by_name = {s.name: s for s in stages}
+    pending = {s.name: set(s.deps) for s in stages}
+    results, timings = {}, {}
+    t0 = time.perf_counter()
+
+    def execute(stage):
+        if on_start is not None:
+            on_start(stage.name)
+        start = time.perf_counter()
+        result = stage.func()
+        end = time.perf_counter()
+        timings[stage.name] = {"start": round(start - t0, 3), "end": round(end - t0, 3),
+                               "seconds": round(end - start, 3)}
+        if on_finish is not None:
+            on_finish(stage.name, end - start, result)
+        return result
+
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as pool:
+        running = {}
+        while pending or running:
+            if error is None:
+                ready = [name for name, deps in pending.items() if not deps]
+                for name in ready:
+                    del pending[name]
+                    running[pool.submit(execute, by_name[name])] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    results[name] = fut.result()
+                except BaseException as e:
+                    if error is None:
+                        error = e
+                    continue
+                for deps in pending.values():
+                    deps.discard(name)
+    if error is not None:
+        raise error
+
+    path, path_seconds = critical_path(stages, {n: t["seconds"] for n, t in timings.items()})
+    return {
+        "results": results,
+        "timings": timings,
+        "critical_path": path,
+        "critical_path_seconds": round(path_seconds, 3),
+        "wall_seconds": round(time.perf_counter() - t0, 3),
+    }
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+# Content-addressed cache for pipeline stages.
+#
+# Every stage gets a fingerprint: a SHA-256 over its parameters, the content
+# hashes of its input files and the fingerprints of its upstream stages. The
+# manifest (data/results/stage_manifest.json) remembers, per stage, the
+# fingerprint it last ran with and the size/mtime of the outputs it wrote.
+# A stage whose fingerprint matches and whose outputs are still in place is
+# skipped. Input files are only re-hashed when their size or mtime change.
+
+MANIFEST_NAME = "stage_manifest.json"
+HASH_BLOCK = 1 << 20
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def output_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class StageCache:
+    def __init__(self, results_dir, force=False):
+        self.results_dir = results_dir
+        self.path = os.path.join(results_dir, MANIFEST_NAME)
+        self.force = force
+        self.lock = threading.Lock()
+        self.manifest = {"files": {}, "stages": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.manifest = json.load(f)
+        self.pending = {}
+        self.skipped = set()
+
+    def file_fingerprint(self, path):
+        """{size, mtime_ns, sha256} of an input file, re-hashing only if it changed"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self.lock:
+            known = self.manifest["files"].get(path)
+        if known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+            return known
+        print(f"Hashing {path}...")
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256_file(path)}
+        with self.lock:
+            self.manifest["files"][path] = entry
+        return entry
+
+    def fingerprint(self, name, params=None, inputs=(), upstream=()):
+        """Fingerprint of one stage run: params + input file hashes + upstream fingerprints"""
+        payload = {
+            "stage": name,
+            "params": params or {},
+            "inputs": {os.path.basename(p): self.file_fingerprint(p)["sha256"] for p in inputs},
+            "upstream": list(upstream),
+        }
+        blob = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(blob).hexdigest()
+
+    def is_fresh(self, name, fingerprint, outputs=(), check=None):
+        """
+        True if `name` last ran with `fingerprint` and its outputs are unchanged.
+
+        `outputs` are file names inside results_dir; `check(record)` can add
+        a test for outputs that are not files (e.g. a Mongo collection).
+        """
+        if self.force:
+            return False
+        record = self.manifest["stages"].get(name)
+        if record is None or record["fingerprint"] != fingerprint:
+            return False
+        for out in outputs:
+            if output_signature(os.path.join(self.results_dir, out)) != record["outputs"].get(out):
+                return False
+        return check is None or bool(check(record))
+
+    def record(self, name, fingerprint, outputs=(), written_dir=None, rows=None):
+        """
+        Remember a finished stage. Outputs are read from `written_dir` (e.g. a
+        staging directory whose files are later renamed into results_dir,
+        which keeps their size and mtime). Recorded only in memory until save().
+        """
+        written_dir = written_dir or self.results_dir
+        with self.lock:
+            self.pending[name] = {
+                "fingerprint": fingerprint,
+                "outputs": {out: output_signature(os.path.join(written_dir, out)) for out in outputs},
+                "rows": rows,
+                "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+
+    def rows(self, name):
+        record = self.manifest["stages"].get(name) or {}
+        return record.get("rows")
+
+    def save(self):
+        """Merge recorded stages into the manifest and write it atomically"""
+        with self.lock:
+            self.manifest["stages"].update(self.pending)
+            self.pending = {}
+            os.makedirs(self.results_dir, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.manifest, f, indent=2)
+            os.replace(tmp, self.path)
+
+
+def cached_stage(cache, name, fingerprint, func, outputs=(), written_dir=None, check=None):
+    """
+    Wrap a stage function: skip it when its fingerprint and outputs match the
+    manifest, otherwise run it and record the new fingerprint.
+
+    A skipped stage's published outputs are copied into `written_dir` so
+    downstream stages (and publishing) find them there. Returns the stage's
+    result, or the recorded row count when skipped.
+    """
+    def run():
+        if cache.is_fresh(name, fingerprint, outputs, check):
+            print(f"⏭️ {name}: inputs unchanged, skipping")
+            if written_dir and os.path.abspath(written_dir) != os.path.abspath(cache.results_dir):
+                for out in outputs:
+                    shutil.copy2(os.path.join(cache.results_dir, out), os.path.join(written_dir, out))
+            with cache.lock:
+                cache.skipped.add(name)
+            return cache.rows(name)
+        result = func()
+        rows = result if isinstance(result, int) else len(result) if isinstance(result, list) else None
+        cache.record(name, fingerprint, outputs, written_dir, rows)
+        return result
+    return run
@@ -0,0 +1,209 @@
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+# Columnar cache of the raw trip CSV.
+#
+# Parsing the CSV text is the most expensive CPU step of a run, and every
+# engine that reads the CSV used to repeat it. build_trip_cache() converts the
+# columns the pipeline uses once into typed binary column files:
+#
+#     data/cache/trips/<csv name>/meta.json
+#     data/cache/trips/<csv name>/<column>.bin     raw little-endian arrays
+#
+# which read_trip_chunks() then serves with np.memmap instead of pandas'
+# CSV parser. The cache is keyed to the source file (path, size, mtime) and
+# may cover only the first N rows (sample runs); it is rebuilt when the CSV
+# changes or a run needs more rows. With TRIP_CACHE_FORMAT=parquet and
+# pyarrow installed, a single trips.parquet is written instead.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRIP_CACHE_DIR = os.getenv("TRIP_CACHE_DIR", os.path.join(PROJECT_ROOT, "data", "cache", "trips"))
+TRIP_CACHE_FORMAT = os.getenv("TRIP_CACHE_FORMAT", "npy")
+
+# Columns the pipeline actually uses, with explicit dtypes so pandas skips type inference
+TRIP_COLUMNS = ["tpep_pickup_datetime", "PULocationID", "trip_distance", "fare_amount"]
+TRIP_DTYPES = {"PULocationID": "int32", "trip_distance": "float64", "fare_amount": "float64"}
+PICKUP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# The cache also keeps DOLocationID (origin-destination analysis)
+CACHE_COLUMNS = TRIP_COLUMNS + ["DOLocationID"]
+CACHE_DTYPES = dict(TRIP_DTYPES, tpep_pickup_datetime="datetime64[s]", DOLocationID="int32")
+CONVERT_CHUNK = 1000000
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+
+def source_key(csv_path):
+    st = os.stat(csv_path)
+    return {"source": os.path.abspath(csv_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def cache_dir(csv_path):
+    return os.path.join(TRIP_CACHE_DIR, os.path.basename(csv_path))
+
+
+class TripCache:
+    """One converted CSV: typed columns, memory-mapped on first access"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.rows = self.meta["rows"]
+        self.columns = {}
+        self.table = None
+
+    def covers(self, sample_rows=None):
+        if self.meta["complete"]:
+            return True
+        return sample_rows is not None and sample_rows <= self.rows
+
+    def column(self, name):
+        if name not in self.columns:
+            self.columns[name] = np.memmap(os.path.join(self.path, f"{name}.bin"),
+                                           dtype=CACHE_DTYPES[name], mode="r",
+                                           shape=(self.rows,))
+        return self.columns[name]
+
+    def parquet_table(self):
+        if self.table is None:
+            self.table = pq.read_table(os.path.join(self.path, "trips.parquet"),
+                                       columns=CACHE_COLUMNS, memory_map=True)
+        return self.table
+
+    def frame(self, start, end, columns=TRIP_COLUMNS):
+        """Rows [start, end) as a DataFrame shaped like read_csv(usecols=columns)"""
+        if self.meta["format"] == "parquet":
+            return self.parquet_table().slice(start, end - start).select(columns).to_pandas()
+        return pd.DataFrame({name: self.column(name)[start:end] for name in columns})
+
+    def take(self, indices, columns=TRIP_COLUMNS):
+        """Rows at `indices` (sorted, for locality) as a DataFrame"""
+        if self.meta["format"] == "parquet":
+            return self.parquet_table().take(pyarrow.array(indices)).select(columns).to_pandas()
+        return pd.DataFrame({name: self.column(name)[indices] for name in columns})
+
+    def chunks(self, chunk_size, sample_rows=None, columns=TRIP_COLUMNS, start=0, end=None):
+        end = min(self.rows if end is None else end,
+                  self.rows if sample_rows is None else sample_rows)
+        for lo in range(start, end, chunk_size):
+            yield self.frame(lo, min(lo + chunk_size, end), columns)
+
+
+def open_trip_cache(csv_path, sample_rows=None):
+    """TripCache for `csv_path` if it is current and covers `sample_rows`, else None"""
+    path = cache_dir(csv_path)
+    try:
+        cache = TripCache(path)
+    except (OSError, ValueError):
+        return None
+    try:
+        key = source_key(csv_path)
+    except OSError:
+        return None
+    if any(cache.meta.get(k) != v for k, v in key.items()) or not cache.covers(sample_rows):
+        return None
+    return cache
+
+
+def build_trip_cache(csv_path, sample_rows=None, fmt=TRIP_CACHE_FORMAT):
+    """
+    Convert the CSV (or its first `sample_rows` rows) into the column cache.
+
+    A no-op when a current cache already covers the rows. Written to a
+    temporary directory and swapped in, so readers never see a partial cache.
+    Returns the number of cached rows.
+    """
+    existing = open_trip_cache(csv_path, sample_rows)
+    if existing is not None:
+        print(f"Trip cache up to date: {existing.rows} rows ({existing.path})")
+        return existing.rows
+    if fmt == "parquet" and pyarrow is None:
+        print("pyarrow not installed, caching trips as .bin columns")
+        fmt = "npy"
+
+    target = cache_dir(csv_path)
+    tmp = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    print(f"Converting {csv_path} to a {fmt} trip cache...")
+    t0 = time.perf_counter()
+
+    rows = 0
+    files = {name: open(os.path.join(tmp, f"{name}.bin"), "wb") for name in CACHE_COLUMNS} \
+        if fmt == "npy" else {}
+    writer = None
+    try:
+        with pd.read_csv(csv_path, usecols=CACHE_COLUMNS,
+                         dtype={k: v for k, v in CACHE_DTYPES.items() if k != TRIP_COLUMNS[0]},
+                         nrows=sample_rows, chunksize=CONVERT_CHUNK) as reader:
+            for df in reader:
+                df[TRIP_COLUMNS[0]] = pd.to_datetime(df[TRIP_COLUMNS[0]], format=PICKUP_FORMAT)
+                if fmt == "parquet":
+                    table = pyarrow.Table.from_pandas(df[CACHE_COLUMNS], preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(os.path.join(tmp, "trips.parquet"), table.schema)
+                    writer.write_table(table)
+                else:
+                    for name, f in files.items():
+                        df[name].to_numpy().astype(CACHE_DTYPES[name], copy=False).tofile(f)
+                rows += len(df)
+    finally:
+        for f in files.values():
+            f.close()
+        if writer is not None:
+            writer.close()
+
+    meta = dict(source_key(csv_path), rows=rows, complete=sample_rows is None or rows < sample_rows,
+                format=fmt, columns={k: CACHE_DTYPES[k] for k in CACHE_COLUMNS})
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old = f"{target}.old-{os.getpid()}"
+    if os.path.exists(target):
+        os.replace(target, old)
+    os.replace(tmp, target)
+    shutil.rmtree(old, ignore_errors=True)
+    print(f"Trip cache built: {rows} rows in {time.perf_counter() - t0:.2f}s → {target}")
+    return rows
+
+
+class CachedChunkReader:
+    """Context manager + iterator over cache chunks, interchangeable with read_csv(chunksize=)"""
+
+    def __init__(self, cache, chunk_size, sample_rows=None, columns=TRIP_COLUMNS):
+        self.iterator = cache.chunks(chunk_size, sample_rows, columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self.iterator
+
+    def close(self):
+        self.iterator.close()
+
+
+def read_trip_chunks(csv_path, chunk_size=100000, sample_rows=None, columns=TRIP_COLUMNS):
+    """
+    Stream the trip data in fixed-size chunks, reading only the columns we
+    need: from the column cache when it is current, otherwise the CSV.
+    `columns` may be any subset of CACHE_COLUMNS.
+    """
+    cache = open_trip_cache(csv_path, sample_rows)
+    if cache is not None:
+        return CachedChunkReader(cache, chunk_size, sample_rows, columns)
+    dtypes = {k: v for k, v in CACHE_DTYPES.items() if k in columns and k != TRIP_COLUMNS[0]}
+    return pd.read_csv(csv_path, usecols=columns, dtype=dtypes,
+                       nrows=sample_rows, chunksize=chunk_size)
@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+import pytest
+
+from scripts.columnar import (ColumnarResult, write_columnar, row_cells, unpack_cells,
+                              HOURS)
+from scripts.ingest import pack_cell
+
+
+def grid_row(gx, gy, hour, count):
+    return {"count": count, "avg_fare": 10.0 + count, "avg_distance": count / 4,
+            "grid_x": gx, "grid_y": gy, "grid_key": f"{gx}_{gy}", "hour": hour}
+
+
+def mapreduce_row(gx, gy, hour, count):
+    row = grid_row(gx, gy, hour, count)
+    return {k: row[k] for k in ("grid_key", "hour", "count", "avg_fare", "avg_distance")}
+
+
+ROWS = [(-7398, 4075, 7, 12), (-7401, 4071, 0, 3), (-7398, 4075, 0, 5), (-7350, 4110, 23, 1)]
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "hourly_grid_counts.json")
+
+
+def test_rows_round_trip_sorted_by_hour_and_cell(store_path):
+    rows = [grid_row(*r) for r in ROWS]
+    write_columnar(rows, store_path)
+    store = ColumnarResult(store_path)
+    expected = sorted(rows, key=lambda r: (r["hour"], int(pack_cell(r["grid_x"], r["grid_y"]))))
+    assert len(store) == 4
+    assert store.rows() == expected
+    assert store.hour_rows(0) == expected[:2]
+    assert store.hour_rows(5) == []
+    assert store.offsets.tolist() == [0] + [2] * 7 + [3] * 16 + [4]
+    assert len(store.offsets) == HOURS + 1
+
+
+def test_rows_keep_the_shape_of_mapreduce_rows(store_path):
+    rows = [mapreduce_row(*r) for r in ROWS]
+    write_columnar(rows, store_path)
+    store = ColumnarResult(store_path)
+    assert [list(r) for r in store.rows()] == [list(rows[0])] * 4
+    assert sorted(map(json.dumps, store.rows())) == sorted(map(json.dumps, rows))
+    # full=True adds the unpacked coordinates for readers that need them
+    assert all(r["grid_key"] == f"{r['grid_x']}_{r['grid_y']}" for r in store.rows(full=True))
+
+
+def test_row_cells_accepts_grid_key_rows():
+    rows = [mapreduce_row(*r) for r in ROWS]
+    gx, gy = unpack_cells(row_cells(rows))
+    assert list(zip(gx.tolist(), gy.tolist())) == [(r[0], r[1]) for r in ROWS]
+
+
+def test_inconsistent_store_is_rejected(store_path):
+    write_columnar([grid_row(*r) for r in ROWS], store_path)
+    np.save(store_path.replace(".json", ".count.npy"), np.zeros(3, dtype=np.int64))
+    with pytest.raises(ValueError):
+        ColumnarResult(store_path)
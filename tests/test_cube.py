@@ -0,0 +1,75 @@
+import json
+from datetime import date
+
+import numpy as np
+import pytest
+
+from scripts.cube import Cube, parse_dows, CUBE_ARRAYS, CUBE_PREFIX, CUBE_META
+from scripts.live_query import hour_list
+
+# 2019-01-07 is a Monday; 14 days cover two full weeks
+START = date(2019, 1, 7)
+DAYS = 14
+CELLS = np.array([[10, 20], [11, 20]], dtype=np.int64)
+
+
+@pytest.fixture
+def cube(tmp_path):
+    count = np.zeros((len(CELLS), DAYS, 24), dtype=np.int64)
+    # Cell 0: one trip every (day, hour); cell 1: day * 100 + hour trips at hour 23 only
+    count[0] = 1
+    count[1, :, 23] = np.arange(DAYS) * 100 + 23
+    arrays = {"count": count, "fare_sum": count * 10.0, "dist_sum": count * 2.0}
+    for name in CUBE_ARRAYS:
+        np.save(tmp_path / f"{CUBE_PREFIX}{name}.npy", arrays[name])
+    np.save(tmp_path / f"{CUBE_PREFIX}cells.npy", CELLS)
+    (tmp_path / CUBE_META).write_text(json.dumps({
+        "start_date": START.isoformat(), "days": DAYS, "hours": 24, "cells": len(CELLS),
+        "scale": 100, "rows": int(count.sum()), "dropped_rows": 0}))
+    return Cube(str(tmp_path))
+
+
+def test_parse_dows():
+    assert parse_dows("weekday") == [0, 1, 2, 3, 4]
+    assert parse_dows("weekend") == [5, 6]
+    assert parse_dows("6,0,6") == [0, 6]
+    for text in ("7", "mon", "1,,2"):
+        with pytest.raises(ValueError, match="dow must be"):
+            parse_dows(text)
+
+
+def test_day_indices_follow_weekdays_and_dates(cube):
+    assert cube.end == date(2019, 1, 20)
+    assert cube.day_indices(dows=[0]).tolist() == [0, 7]
+    assert cube.day_indices(dows=parse_dows("weekend")).tolist() == [5, 6, 12, 13]
+    assert cube.day_indices(date(2019, 1, 12), date(2019, 1, 14)).tolist() == [5, 6, 7]
+    # Dates outside the cube are clipped, an empty window selects nothing
+    assert len(cube.day_indices(date(2018, 1, 1), date(2030, 1, 1))) == DAYS
+    assert cube.day_indices(date(2019, 1, 15), date(2019, 1, 14)).tolist() == []
+
+
+def test_hour_window_wraps_past_midnight(cube):
+    rows = cube.query(hours=hour_list(22, 1), group_by="hour")
+    assert sorted({r["hour"] for r in rows}) == [0, 1, 22, 23]
+    by_key = {(r["grid_key"], r["hour"]): r["count"] for r in rows}
+    assert by_key[("10_20", 22)] == DAYS
+    assert by_key[("11_20", 23)] == sum(d * 100 + 23 for d in range(DAYS))
+    assert ("11_20", 0) not in by_key
+
+
+def test_weekend_night_totals(cube):
+    rows = cube.query(dows=parse_dows("weekend"), hours=hour_list(23, 0))
+    by_key = {r["grid_key"]: r for r in rows}
+    assert by_key["10_20"]["count"] == 4 * 2
+    assert by_key["11_20"]["count"] == sum(d * 100 + 23 for d in (5, 6, 12, 13))
+    assert by_key["11_20"]["avg_fare"] == pytest.approx(10.0)
+    assert [r["grid_key"] for r in rows] == ["11_20", "10_20"]
+
+
+def test_daily_series_and_limit(cube):
+    days = cube.query(date(2019, 1, 19), group_by="day", hours=[23])
+    assert [d["date"] for d in days] == ["2019-01-19", "2019-01-20"]
+    assert days[0]["count"] == 1 + 12 * 100 + 23
+    assert len(cube.query(limit=1)) == 1
+    with pytest.raises(ValueError, match="unknown group_by"):
+        cube.query(group_by="week")
@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import pytest
+
+from scripts.flows import FlowTensor, top_k, FLOW_ARRAYS, FLOWS_PREFIX, FLOWS_META
+
+ZONES = 5  # four known zones plus the unknown-ID slot
+
+
+def test_top_k_orders_largest_first():
+    values = np.array([0, 5, 0, 9, 1, 5, 0])
+    idx = top_k(values, 3).tolist()
+    assert idx[0] == 3 and sorted(idx[1:]) == [1, 5]
+    assert top_k(values, 1).tolist() == [3]
+
+
+def test_top_k_skips_zeros():
+    values = np.array([0, 0, 2, 0, 1])
+    assert top_k(values, 10).tolist() == [2, 4]
+    assert top_k(np.zeros(1000, dtype=np.int64), 10).tolist() == []
+    assert top_k(values, 0).tolist() == []
+
+
+def test_top_k_matches_a_full_sort():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 50, 10000) * (rng.random(10000) < 0.1)
+    idx = top_k(values, 25)
+    assert values[idx].tolist() == sorted(values, reverse=True)[:25]
+
+
+@pytest.fixture
+def flows(tmp_path):
+    count = np.zeros((24, ZONES, ZONES), dtype=np.int64)
+    count[8, 1, 2] = 30
+    count[8, 1, 3] = 10
+    count[9, 1, 3] = 25
+    count[8, 2, 1] = 5
+    count[8, 1, 4] = 99  # unknown destination slot: never reported
+    fare = count * 12.0
+    for name, arr in zip(FLOW_ARRAYS, (count, fare)):
+        np.save(tmp_path / f"{FLOWS_PREFIX}{name}.npy", arr)
+    np.save(tmp_path / f"{FLOWS_PREFIX}zones.npy", np.zeros((ZONES, 2)))
+    (tmp_path / FLOWS_META).write_text(json.dumps({"zones": ZONES, "hours": 24}))
+    return FlowTensor(str(tmp_path))
+
+
+def test_destinations_of_one_zone(flows):
+    rows, total = flows.destinations(1, hour=8, k=5)
+    assert [(r["destination"], r["count"]) for r in rows] == [(2, 30), (3, 10)]
+    assert total == 40
+    rows, total = flows.destinations(1, k=1)
+    assert [(r["destination"], r["count"]) for r in rows] == [(3, 35)]
+    assert rows[0]["avg_fare"] == pytest.approx(12.0)
+    assert total == 65
+
+
+def test_corridors(flows):
+    rows, total = flows.corridors(hour=8, k=2)
+    assert [(r["origin"], r["destination"]) for r in rows] == [(1, 2), (1, 3)]
+    assert total == 45
+    rows, _ = flows.corridors(k=10)
+    assert [(r["origin"], r["destination"], r["count"]) for r in rows] == [
+        (1, 3, 35), (1, 2, 30), (2, 1, 5)]
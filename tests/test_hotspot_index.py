@@ -0,0 +1,49 @@
+import math
+import random
+
+import pytest
+
+from scripts.hotspot_index import HotspotIndex, KM_PER_DEG_LAT, KM_PER_DEG_LON
+from scripts.ingest import GRID_SCALE
+
+
+def make_rows(n_cells=400, seed=0):
+    rng = random.Random(seed)
+    cells = {(rng.randint(-7410, -7370), rng.randint(4060, 4090)) for _ in range(n_cells)}
+    return [{"count": rng.randint(1, 500), "avg_fare": 12.5, "avg_distance": 2.5,
+             "grid_x": gx, "grid_y": gy, "grid_key": f"{gx}_{gy}", "hour": rng.randrange(24)}
+            for gx, gy in sorted(cells)]
+
+
+def brute_force(rows, lat, lon, k):
+    kx = KM_PER_DEG_LON * math.cos(math.radians(lat))
+    cells = {(r["grid_x"], r["grid_y"]) for r in rows}
+    distances = sorted(math.hypot(((gx + 0.5) / GRID_SCALE - lon) * kx,
+                                  ((gy + 0.5) / GRID_SCALE - lat) * KM_PER_DEG_LAT)
+                       for gx, gy in cells)
+    return distances[:k]
+
+
+@pytest.mark.parametrize("k", [1, 5, 50, 1000])
+@pytest.mark.parametrize("lat, lon", [(40.75, -73.98), (40.61, -74.09), (41.5, -72.0),
+                                      (40.0, -75.0)])
+def test_nearest_matches_brute_force(lat, lon, k):
+    rows = make_rows()
+    index = HotspotIndex(rows)
+    got = [r["distance_km"] for r in index.nearest(lat, lon, k=k)]
+    assert got == pytest.approx(brute_force(rows, lat, lon, k))
+
+
+def test_nearest_within_one_hour():
+    rows = make_rows(seed=1)
+    index = HotspotIndex(rows)
+    hour_rows = [r for r in rows if r["hour"] == 9]
+    got = index.nearest(40.72, -73.99, k=5, hour=9)
+    assert all(r["hour"] == 9 for r in got)
+    assert [r["distance_km"] for r in got] == pytest.approx(
+        brute_force(hour_rows, 40.72, -73.99, 5))
+
+
+def test_nearest_of_missing_hour_is_empty():
+    index = HotspotIndex([r for r in make_rows() if r["hour"] != 3])
+    assert index.nearest(40.75, -73.98, hour=3) == []
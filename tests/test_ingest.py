@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts.ingest import (CsvRangeReader, split_csv_ranges, pack_cell, unpack_cell,
+                            prepare_trips, SUMS_COLLECTION)
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "trips.csv"
+    lines = ["id,value"] + [f"{i},{'x' * (i % 17)}" for i in range(1000)]
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def read_ranges(path, parts, sample_rows=None):
+    header, ranges = split_csv_ranges(path, parts, sample_rows)
+    ids = []
+    for start, end in ranges:
+        reader = CsvRangeReader(path, header, start, end)
+        try:
+            ids.extend(pd.read_csv(reader, keep_default_na=False)["id"].tolist())
+        finally:
+            reader.close()
+    return ids
+
+
+@pytest.mark.parametrize("parts", [1, 2, 3, 7, 64, 5000])
+def test_ranges_cover_every_row_once(csv_file, parts):
+    assert read_ranges(csv_file, parts) == list(range(1000))
+
+
+@pytest.mark.parametrize("sample_rows", [1, 10, 999, 1000, 5000])
+def test_ranges_stop_at_sample_rows(csv_file, sample_rows):
+    assert read_ranges(csv_file, 4, sample_rows) == list(range(min(sample_rows, 1000)))
+
+
+def test_ranges_are_line_aligned(csv_file):
+    data = csv_file.read_bytes()
+    _, ranges = split_csv_ranges(csv_file, 9)
+    for start, end in ranges:
+        assert data[start - 1:start] == b"\n"
+        assert data[end - 1:end] == b"\n"
+
+
+@pytest.mark.parametrize("grid_x, grid_y", [(0, 0), (-7403, 4072), (7403, -4072),
+                                            (-1, -1), (2**31 - 1, -2**31)])
+def test_pack_cell_round_trip(grid_x, grid_y):
+    assert unpack_cell(pack_cell(grid_x, grid_y)) == (grid_x, grid_y)
+
+
+def test_pack_cell_arrays_match_scalars():
+    rng = np.random.default_rng(0)
+    xs = rng.integers(-10000, 10000, 100)
+    ys = rng.integers(-10000, 10000, 100)
+    packed = pack_cell(xs, ys)
+    assert packed.dtype == np.int64
+    assert [unpack_cell(int(c)) for c in packed] == list(zip(xs.tolist(), ys.tolist()))
+
+
+class FakeCollection:
+    def __init__(self, docs=0):
+        self.docs = docs
+        self.dropped = False
+
+    def estimated_document_count(self):
+        return self.docs
+
+    def drop(self):
+        self.dropped = True
+        self.docs = 0
+
+
+class FakeDb(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+
+@pytest.mark.parametrize("drop, batch_id, trips_dropped, sums_dropped", [
+    (True, None, True, True),
+    (False, None, False, True),
+    (False, "batch-1", False, False),
+])
+def test_prepare_trips_keeps_sums_consistent(drop, batch_id, trips_dropped, sums_dropped):
+    db = FakeDb(taxi_trips=FakeCollection(10), **{SUMS_COLLECTION: FakeCollection(5)})
+    prepare_trips(db, drop, batch_id)
+    assert db["taxi_trips"].dropped is trips_dropped
+    assert db[SUMS_COLLECTION].dropped is sums_dropped
@@ -0,0 +1,86 @@
+import re
+
+from scripts.instrumentation import Registry, REGISTRY, call_with_metrics, merged
+
+
+def registry():
+    reg = Registry()
+    rows = reg.counter("rows_total", "Rows processed", ("step",))
+    seconds = reg.histogram("step_seconds", "Step duration", ("step",), buckets=(0.1, 1.0))
+    return reg, rows, seconds
+
+
+def test_counter_exposition():
+    reg, rows, _ = registry()
+    rows.inc(3, step="insert")
+    rows.inc(2, step="insert")
+    rows.inc(1, step='say "hi"\n')
+    text = reg.render()
+    assert "# HELP rows_total Rows processed\n# TYPE rows_total counter\n" in text
+    assert 'rows_total{step="insert"} 5\n' in text
+    assert 'rows_total{step="say \\"hi\\"\\n"} 1\n' in text
+    assert text.endswith("\n")
+
+
+def test_histogram_buckets_are_cumulative():
+    reg, _, seconds = registry()
+    for value in (0.05, 0.1, 0.5, 3.0):
+        seconds.observe(value, step="insert")
+    lines = reg.render().splitlines()
+    assert "# TYPE step_seconds histogram" in lines
+    assert lines[-5:] == [
+        'step_seconds_bucket{step="insert",le="0.1"} 2',
+        'step_seconds_bucket{step="insert",le="1.0"} 3',
+        'step_seconds_bucket{step="insert",le="+Inf"} 4',
+        'step_seconds_sum{step="insert"} 3.65',
+        'step_seconds_count{step="insert"} 4',
+    ]
+
+
+def test_unlabelled_histogram():
+    reg = Registry()
+    reg.histogram("wall_seconds", "Wall time", buckets=(1.0,)).observe(2.0)
+    assert 'wall_seconds_bucket{le="+Inf"} 1' in reg.render()
+    assert "wall_seconds_count 1" in reg.render()
+
+
+def test_drain_and_merge_carry_worker_metrics():
+    worker, rows, seconds = registry()
+    rows.inc(7, step="insert")
+    seconds.observe(0.5, step="insert")
+    snapshot = worker.drain()
+    assert "rows_total{" not in worker.render()
+
+    parent, _, _ = registry()
+    parent.merge(snapshot)
+    parent.merge(snapshot)
+    text = parent.render()
+    assert 'rows_total{step="insert"} 14' in text
+    assert 'step_seconds_count{step="insert"} 2' in text
+
+
+def count(text, series):
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_call_with_metrics_round_trip():
+    series = 'taxi_rows_processed_total{step="test_round_trip"}'
+
+    def work(n):
+        REGISTRY.metrics["taxi_rows_processed_total"].inc(n, step="test_round_trip")
+        return n * 2
+
+    outcome = call_with_metrics(work, 4)
+    # The worker's registry is drained into the outcome, so nothing is counted twice
+    assert count(REGISTRY.render(), series) == 0
+    assert merged(outcome) == 8
+    assert count(REGISTRY.render(), series) == 4
+
+
+def test_metrics_endpoint():
+    from backend.app import app
+    resp = app.test_client().get("/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    assert "# TYPE taxi_pipeline_stage_seconds histogram" in resp.get_data(as_text=True)
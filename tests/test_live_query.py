@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pytest
+
+from scripts.live_query import parse_bbox, parse_date, hour_list, build_match
+
+
+def test_parse_date():
+    assert parse_date("2019-01-31") == datetime(2019, 1, 31)
+    assert parse_date("2019-01-31", end=True) == datetime(2019, 2, 1)
+    assert parse_date("2019-01-31T08:30", end=True) == datetime(2019, 1, 31, 8, 30)
+
+
+@pytest.mark.parametrize("text", ["bad", "2019-13-01", "31/01/2019"])
+def test_parse_date_names_the_parameter(text):
+    with pytest.raises(ValueError, match="^date_from must be YYYY-MM-DD or an ISO datetime$"):
+        parse_date(text, name="date_from")
+
+
+@pytest.mark.parametrize("text", ["1,2,3", "a,b,c,d", "-73.9,40.7,-74.0,40.8", ""])
+def test_parse_bbox_rejects_bad_boxes(text):
+    with pytest.raises(ValueError, match="bbox"):
+        parse_bbox(text)
+
+
+def test_hour_list_wraps_past_midnight():
+    assert hour_list(8, 10) == [8, 9, 10]
+    assert hour_list(22, 1) == [22, 23, 0, 1]
+
+
+def test_build_match_skips_all_day_hours():
+    assert build_match(hours=list(range(24))) == {}
+    match = build_match(hours=[1, 2], date_to=datetime(2019, 2, 1))
+    assert match == {"hour": {"$in": [1, 2]}, "pickup_datetime": {"$lt": datetime(2019, 2, 1)}}
+
+
+@pytest.fixture
+def client():
+    from backend.app import app
+    return app.test_client()
+
+
+@pytest.mark.parametrize("route, query, error", [
+    ("/api/cube", "dow=mon", "dow must be 0 (Mon) .. 6 (Sun), weekday or weekend"),
+    ("/api/cube", "dow=1,9", "dow must be 0 (Mon) .. 6 (Sun), weekday or weekend"),
+    ("/api/cube", "date_from=bad", "date_from must be YYYY-MM-DD or an ISO datetime"),
+    ("/api/cube", "date_to=2019-02-30", "date_to must be YYYY-MM-DD or an ISO datetime"),
+    ("/api/hotspots/query", "date_to=bad", "date_to must be YYYY-MM-DD or an ISO datetime"),
+    ("/api/hotspots/query", "bbox=x", "bbox must be min_lon,min_lat,max_lon,max_lat"),
+    ("/api/trend", "since=yesterday", "since must be YYYY-MM-DD or an ISO datetime"),
+])
+def test_bad_filters_get_readable_errors(client, route, query, error):
+    resp = client.get(f"{route}?{query}")
+    assert resp.status_code == 400
+    assert resp.get_json() == {"error": error}
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from scripts.metrics_store import MetricsStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MetricsStore(str(tmp_path / "metrics" / "metrics.db"))
+
+
+def test_runs_keep_the_timing_history_shape(store):
+    run_id = store.record("pipeline", {"aggregation": 1.5, "mapreduce": 2.0, "ingest": None},
+                          sample_rows=1000, extra={"force": True}, ts=1000.0)
+    [run] = store.runs()
+    assert run["run_id"] == run_id
+    assert run["source"] == "pipeline"
+    assert run["sample_rows"] == 1000
+    assert run["engines"] == {"aggregation": 1.5, "mapreduce": 2.0}
+    assert (run["agg_time"], run["mapr_time"]) == (1.5, 2.0)
+
+
+def test_runs_returns_the_latest_window_oldest_first(store):
+    for i in range(5):
+        store.record("pipeline" if i % 2 else "benchmark", {"aggregation": i}, ts=1000.0 + i)
+    assert [r["ts"] for r in store.runs(limit=3)] == [1002.0, 1003.0, 1004.0]
+    assert [r["ts"] for r in store.runs(source="pipeline")] == [1001.0, 1003.0]
+    assert [r["ts"] for r in store.runs(since=1001.0, until=1003.0)] == [1001.0, 1002.0]
+    assert store.runs(since=2000.0) == []
+
+
+def test_series_filters_by_engine_newest_first(store):
+    for i in range(4):
+        store.record("pipeline", {"aggregation": i, "mapreduce": 10 + i}, ts=1000.0 + i)
+    series = store.series(engine="mapreduce", limit=2)
+    assert [(s["ts"], s["seconds"]) for s in series] == [(1003.0, 13.0), (1002.0, 12.0)]
+    assert len(store.series()) == 8
+
+
+def test_concurrent_writers_keep_every_run(store):
+    def write(n):
+        # A second store on the same file stands in for another process
+        other = MetricsStore(store.path) if n % 2 else store
+        for i in range(10):
+            other.record("benchmark", {"aggregation": float(i)})
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(store.runs(limit=100)) == 40
+    assert len(store.series(limit=100)) == 40
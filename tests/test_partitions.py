@@ -0,0 +1,77 @@
+import pytest
+
+from scripts.partitions import (attach_partition, detach_partition, parse_month, partition_name,
+                                REGISTRY)
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+        self.dropped = False
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+    def update_one(self, query, update, upsert=False):
+        if query["_id"] in self.docs or upsert:
+            self.docs.setdefault(query["_id"], {"_id": query["_id"]}).update(update["$set"])
+
+    def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def drop(self):
+        self.dropped = True
+        self.docs = {}
+
+
+class FakeDb(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+    def list_collection_names(self):
+        return [name for name, coll in self.items() if not coll.dropped]
+
+
+@pytest.fixture
+def db():
+    db = FakeDb()
+    db[REGISTRY] = FakeCollection([{"_id": "taxi_trips_2019_01", "attached": True}])
+    db["taxi_trips_2019_01"] = FakeCollection([{"_id": 1}])
+    return db
+
+
+def test_parse_month():
+    assert partition_name(*parse_month("2019-01")) == "taxi_trips_2019_01"
+    with pytest.raises(ValueError):
+        parse_month("2019-13")
+
+
+def test_detach_keeps_data(db):
+    detach_partition(db, "taxi_trips_2019_01")
+    assert db[REGISTRY].docs["taxi_trips_2019_01"]["attached"] is False
+    assert not db["taxi_trips_2019_01"].dropped
+
+
+def test_detach_drop_removes_partition(db):
+    detach_partition(db, "taxi_trips_2019_01", drop=True)
+    assert db["taxi_trips_2019_01"].dropped
+    assert "taxi_trips_2019_01" not in db[REGISTRY].docs
+
+
+@pytest.mark.parametrize("drop", [False, True])
+def test_detach_unknown_partition_raises(db, drop):
+    db["taxi_trips_2019_02"] = FakeCollection([{"_id": 1}])
+    with pytest.raises(ValueError, match="no such partition"):
+        detach_partition(db, "taxi_trips_2019_02", drop=drop)
+    assert not db["taxi_trips_2019_02"].dropped
+    assert set(db[REGISTRY].docs) == {"taxi_trips_2019_01"}
+
+
+def test_attach_unknown_collection_raises(db):
+    with pytest.raises(ValueError, match="no such partition collection"):
+        attach_partition(db, "taxi_trips_2019_03")
+    assert set(db[REGISTRY].docs) == {"taxi_trips_2019_01"}
@@ -0,0 +1,78 @@
+import json
+
+import numpy as np
+import pytest
+
+from scripts import postprocess
+from scripts.columnar import ColumnarResult, write_columnar
+from scripts.ingest import pack_cell
+
+
+def make_rows(seed=0, n_cells=60):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for c in range(n_cells):
+        gx, gy = -7420 + c % 12, 4060 + c // 12
+        for hour in range(24):
+            if (c, hour) == (5, 9) or rng.random() < 0.8:
+                count = int(rng.poisson(400 if (c, hour) == (5, 9) else 20)) + 1
+                rows.append({"count": count, "avg_fare": 10.0, "avg_distance": 2.0,
+                             "grid_x": gx, "grid_y": gy, "grid_key": f"{gx}_{gy}",
+                             "hour": hour})
+    return rows
+
+
+def by_key(anomalies):
+    return sorted(anomalies, key=lambda a: (a["grid_key"], a["hour"]))
+
+
+@pytest.mark.parametrize("method", ["zscore", "robust"])
+def test_columnar_input_matches_json_input(tmp_path, method):
+    rows = make_rows()
+    json_only, with_store = tmp_path / "a" / "rows.json", tmp_path / "b" / "rows.json"
+    for path in (json_only, with_store):
+        path.parent.mkdir()
+        path.write_text(json.dumps(rows))
+    write_columnar(rows, str(with_store))
+
+    expected = postprocess.detect_anomalies(str(json_only), str(tmp_path / "a.json"),
+                                            threshold=2.5, method=method)
+    got = postprocess.detect_anomalies(str(with_store), str(tmp_path / "b.json"),
+                                       threshold=2.5, method=method)
+    assert expected and by_key(got) == by_key(expected)
+    assert {"grid_key": "-7415_4060", "hour": 9} in [
+        {k: a[k] for k in ("grid_key", "hour")} for a in got]
+
+
+@pytest.mark.parametrize("ratio", [postprocess.DENSE_BOX_RATIO, 0])
+def test_cell_index_dense_and_sorted_paths(monkeypatch, ratio):
+    monkeypatch.setattr(postprocess, "DENSE_BOX_RATIO", ratio)
+    cells = pack_cell(np.array([-7400, -7390, -7400, -7395]), np.array([4070, -3, 4070, 4081]))
+    distinct, idx = postprocess.cell_index(cells)
+    assert sorted(distinct.tolist()) == sorted(set(cells.tolist()))
+    assert (distinct[idx] == cells).all()
+
+
+def test_store_count_matrix_places_every_count(tmp_path):
+    rows = make_rows(seed=1)
+    path = str(tmp_path / "rows.json")
+    write_columnar(rows, path)
+    cells, matrix = postprocess.store_count_matrix(ColumnarResult(path))
+    position = {c: i for i, c in enumerate(cells.tolist())}
+    expected = np.zeros_like(matrix)
+    for r in rows:
+        expected[position[int(pack_cell(r["grid_x"], r["grid_y"]))], r["hour"]] = r["count"]
+    assert (matrix == expected).all()
+
+
+def test_robust_scores_match_numpy_median():
+    rng = np.random.default_rng(2)
+    matrix = rng.poisson(10, (500, 24)).astype(np.float64)
+    matrix[:3] = 4.0  # zero spread: never flagged
+    median = np.median(matrix, axis=1, keepdims=True)
+    mad = np.median(np.abs(matrix - median), axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = postprocess.MAD_SCALE * (matrix - median) / mad
+    expected[mad[:, 0] == 0] = np.nan
+    np.testing.assert_allclose(postprocess.score_matrix(matrix, "robust"), expected)
+    assert np.isnan(postprocess.score_matrix(matrix, "zscore")[:3]).all()
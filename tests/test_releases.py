@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pytest
+
+from backend.releases import publish, prune, current_release, CURRENT, RELEASES
+from scripts.columnar import write_json_atomic, write_columnar, ColumnarResult
+
+
+def stage(results_dir, name, files):
+    staging = results_dir / f".staging-{name}"
+    staging.mkdir()
+    for entry, text in files.items():
+        (staging / entry).write_text(text)
+    return staging
+
+
+def release_files(results_dir):
+    releases = results_dir / RELEASES
+    return {(name, entry): (releases / name / entry).read_bytes()
+            for name in os.listdir(releases) for entry in os.listdir(releases / name)}
+
+
+@pytest.fixture
+def results_dir(tmp_path):
+    # Two releases: j2 rewrites a.json and carries j1's b.json over as a hard link
+    publish(stage(tmp_path, "j1", {"a.json": "A1", "b.json": "B1"}), tmp_path, "j1")
+    publish(stage(tmp_path, "j2", {"a.json": "A2"}), tmp_path, "j2")
+    return tmp_path
+
+
+def test_publish_links_names_into_current(results_dir):
+    assert os.readlink(results_dir / CURRENT).startswith(RELEASES + os.sep)
+    assert os.readlink(results_dir / "a.json") == os.path.join(CURRENT, "a.json")
+    assert (results_dir / "a.json").read_text() == "A2"
+    assert (results_dir / "b.json").read_text() == "B1"
+    assert current_release(results_dir).endswith("-j2")
+
+
+def test_publish_prunes_old_releases(results_dir):
+    publish(stage(results_dir, "j3", {"b.json": "B3"}), results_dir, "j3")
+    names = sorted(os.listdir(results_dir / RELEASES))
+    assert len(names) == 2 and current_release(results_dir).endswith("-j3")
+    assert (results_dir / "a.json").read_text() == "A2"
+    assert (results_dir / "b.json").read_text() == "B3"
+
+
+def test_json_write_replaces_link_instead_of_writing_through(results_dir):
+    before = release_files(results_dir)
+    write_json_atomic(str(results_dir / "b.json"), {"from": "cli"})
+    assert not os.path.islink(results_dir / "b.json")
+    assert "cli" in (results_dir / "b.json").read_text()
+    assert release_files(results_dir) == before
+
+
+def test_columnar_write_replaces_links_instead_of_writing_through(results_dir):
+    rows = [{"count": 3, "avg_fare": 10.0, "avg_distance": 1.5, "grid_x": -7398,
+             "grid_y": 4075, "grid_key": "-7398_4075", "hour": 5}]
+    staged = stage(results_dir, "j3", {})
+    write_columnar(rows, str(staged / "grid.json"))
+    publish(staged, results_dir, "j3")
+    before = release_files(results_dir)
+    published = {entry for _, entry in before}
+
+    write_columnar([dict(rows[0], count=99)], str(results_dir / "grid.json"))
+    assert release_files(results_dir) == before
+    for entry in published - {"a.json", "b.json"}:
+        assert not os.path.islink(results_dir / entry)
+    assert ColumnarResult(str(results_dir / "grid.json")).rows()[0]["count"] == 99
+
+
+def test_second_publish_turns_plain_file_back_into_link(results_dir):
+    write_json_atomic(str(results_dir / "a.json"), "cli")
+    publish(stage(results_dir, "j3", {"a.json": "A3"}), results_dir, "j3")
+    assert os.path.islink(results_dir / "a.json")
+    assert (results_dir / "a.json").read_text() == "A3"
+
+
+def test_prune_keeps_newest_and_never_current(tmp_path):
+    releases = tmp_path / RELEASES
+    for i, name in enumerate(["r1", "r2", "r3", "r4"]):
+        (releases / name).mkdir(parents=True)
+        os.utime(releases / name, (1000 + i, 1000 + i))
+    prune(str(releases), current=str(releases / "r1"), keep=2)
+    assert sorted(os.listdir(releases)) == ["r1", "r3", "r4"]
+
+
+def test_publish_empties_staging_and_keeps_hard_links_shared(results_dir):
+    staged = stage(results_dir, "j3", {"c.json": "C3"})
+    release = publish(staged, results_dir, "j3")
+    assert os.listdir(staged) == []
+    previous = sorted(os.listdir(results_dir / RELEASES))[0]
+    assert os.path.samefile(os.path.join(release, "b.json"),
+                            results_dir / RELEASES / previous / "b.json")
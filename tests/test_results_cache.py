@@ -0,0 +1,125 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from backend.results_cache import ResultsCache, check_hour
+from scripts.columnar import write_columnar, write_json_atomic
+
+ROWS = [
+    {"count": 3, "avg_fare": 10.0, "avg_distance": 1.5, "grid_x": 1, "grid_y": 2,
+     "grid_key": "1_2", "hour": 0},
+    {"count": 5, "avg_fare": 12.25, "avg_distance": 2.125, "grid_x": 4, "grid_y": 2,
+     "grid_key": "4_2", "hour": 0},
+    {"count": 7, "avg_fare": 8.5, "avg_distance": 0.75, "grid_x": 1, "grid_y": 2,
+     "grid_key": "1_2", "hour": 23},
+]
+
+
+@pytest.fixture
+def result_file(tmp_path):
+    path = str(tmp_path / "hourly_grid_counts.json")
+    write_json_atomic(path, ROWS)
+    return path
+
+
+def bump_mtime(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+@pytest.mark.parametrize("hour", [None, 0, 23])
+def test_check_hour_accepts_valid_hours(hour):
+    check_hour(hour)
+
+
+@pytest.mark.parametrize("hour", [-1, 24, 10**6])
+def test_check_hour_rejects_other_hours(hour):
+    with pytest.raises(ValueError, match="hour must be 0-23"):
+        check_hour(hour)
+
+
+def test_entry_is_reused_until_the_file_changes(result_file):
+    cache = ResultsCache()
+    entry = cache.get(result_file)
+    assert cache.get(result_file) is entry
+    assert json.loads(entry.body) == ROWS
+
+    write_json_atomic(result_file, ROWS[:1])
+    bump_mtime(result_file)
+    changed = cache.get(result_file)
+    assert changed is not entry
+    assert changed.etag != entry.etag
+    assert json.loads(changed.body) == ROWS[:1]
+
+    os.remove(result_file)
+    assert cache.get(result_file) is None
+
+
+def test_hour_bodies_and_etags(result_file):
+    entry = ResultsCache().get(result_file)
+    body, etag = entry.hour_body(0)
+    assert json.loads(body) == ROWS[:2]
+    assert etag == f"{entry.etag}-h0"
+    assert entry.hour_body(5)[0] == b"[]"
+    with pytest.raises(ValueError):
+        entry.hour_body(24)
+
+
+def test_wire_bodies_are_cached_per_hour_and_encoding(result_file):
+    entry = ResultsCache().get(result_file)
+    body, etag = entry.wire(None)
+    payload = json.loads(body)
+    assert payload["hour_offsets"][0] == 0 and payload["hour_offsets"][1] == 2
+    assert payload["hour_offsets"][-1] == 3
+    assert payload["columns"]["count"] == [3, 5, 7]
+
+    gz_body, gz_etag = entry.wire(None, gzipped=True)
+    assert gzip.decompress(gz_body) == body
+    assert gz_etag == f"{etag}-gz"
+    assert entry.wire(None)[0] is body
+    with pytest.raises(ValueError):
+        entry.wire(-1)
+
+
+def test_columnar_store_is_used_unless_the_json_is_newer(result_file):
+    cache = ResultsCache()
+    assert cache.columnar(result_file) is None
+
+    write_columnar(ROWS, result_file)
+    store = cache.columnar(result_file)
+    assert store is not None
+    body, etag = store.body(23)
+    assert json.loads(body) == ROWS[2:]
+    assert etag == f"{store.etag}-h23"
+
+    write_json_atomic(result_file, ROWS)
+    bump_mtime(result_file)
+    assert cache.columnar(result_file) is None
+
+
+@pytest.fixture
+def client(monkeypatch, result_file):
+    import backend.app as app_module
+    monkeypatch.setitem(app_module.ENGINE_OUTPUTS, "aggregation", result_file)
+    monkeypatch.setattr(app_module, "results_cache", ResultsCache())
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize("query", ["", "?hour=0", "?format=columnar"])
+def test_matching_etag_answers_304(client, query):
+    first = client.get(f"/api/hotspots{query}")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    again = client.get(f"/api/hotspots{query}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    stale = client.get(f"/api/hotspots{query}", headers={"If-None-Match": '"stale"'})
+    assert stale.status_code == 200
+
+
+def test_bad_hour_is_rejected(client):
+    resp = client.get("/api/hotspots?hour=24")
+    assert resp.status_code == 400
+    assert resp.get_json() == {"error": "hour must be 0-23"}
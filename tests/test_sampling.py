@@ -0,0 +1,99 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import sampling, trip_cache
+from scripts.columnar import ColumnarResult
+from scripts.sampling import TripFeatures, draw_sample, estimate
+
+
+@pytest.fixture
+def trips_csv(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 3000
+    pickup = pd.Timestamp("2019-01-01") + pd.to_timedelta(rng.integers(0, 3 * 86400, n), unit="s")
+    df = pd.DataFrame({
+        "tpep_pickup_datetime": pickup.strftime("%Y-%m-%d %H:%M:%S"),
+        "PULocationID": rng.integers(1, 264, n),
+        "DOLocationID": rng.integers(1, 264, n),
+        "trip_distance": rng.uniform(0.1, 20, n).round(2),
+        "fare_amount": rng.uniform(2.5, 80, n).round(2),
+    })
+    path = tmp_path / "trips.csv"
+    df.to_csv(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize("method", ["uniform", "stratified"])
+def test_full_sample_estimates_the_population(trips_csv, method):
+    sample, ids, sizes = draw_sample(trips_csv, None, method, np.random.default_rng(1),
+                                     chunk_size=700)
+    rows, meta = estimate(sample, ids, sizes, TripFeatures().cells)
+
+    assert meta["sample_rows"] == meta["population_rows"] == 3000
+    assert meta["fraction"] == 1.0
+    assert sum(r["count"] for r in rows) == 3000
+    # Every trip has weight 1, so each group is its exact count with a zero-width interval
+    for r in rows:
+        assert r["count"] == r["sampled"] == r["count_low"] == r["count_high"]
+
+    df = pd.read_csv(trips_csv, parse_dates=["tpep_pickup_datetime"])
+    per_hour = df.groupby(df["tpep_pickup_datetime"].dt.hour).agg(
+        count=("fare_amount", "size"), fare=("fare_amount", "sum"), dist=("trip_distance", "sum"))
+    for hour, expected in per_hour.iterrows():
+        hour_rows = [r for r in rows if r["hour"] == hour]
+        assert sum(r["count"] for r in hour_rows) == expected["count"]
+        assert sum(r["avg_fare"] * r["count"] for r in hour_rows) == pytest.approx(expected["fare"])
+        assert sum(r["avg_distance"] * r["count"] for r in hour_rows) == pytest.approx(
+            expected["dist"])
+
+def test_weights_scale_strata_to_their_size():
+    # Two strata of 10 and 40 trips, 2 sampled from each: every trip stands for 5 and 20
+    sample = {"stratum": np.array([0, 0, 1, 1]), "group": np.array([0, 1, 0, 0]),
+              "fare": np.array([10.0, 20.0, 30.0, 50.0]), "dist": np.ones(4)}
+    cells = np.array([[-7398, 4075]])
+    rows, meta = estimate(sample, np.array([0, 1]), np.array([10, 40]), cells)
+    by_hour = {r["hour"]: r for r in rows}
+    assert by_hour[0]["count"] == 45 and by_hour[1]["count"] == 5
+    assert by_hour[0]["avg_fare"] == pytest.approx((5 * 10 + 20 * 30 + 20 * 50) / 45)
+    assert meta["population_rows"] == 50 and meta["uncovered_rows"] == 0
+
+
+@pytest.mark.parametrize("method", ["uniform", "stratified"])
+def test_sample_csv_draws_whole_lines_from_the_whole_file(trips_csv, tmp_path, monkeypatch,
+                                                          method):
+    monkeypatch.setattr(sampling, "SAMPLE_DIR", str(tmp_path / "samples"))
+    monkeypatch.setattr(trip_cache, "TRIP_CACHE_DIR", str(tmp_path / "trips"))
+    n = sampling.write_sample_csv(trips_csv, 300, method)
+    path = sampling.sample_csv_path(trips_csv, 300, method)
+
+    full, sample = pd.read_csv(trips_csv), pd.read_csv(path)
+    assert len(sample) == n and 250 <= n < 400
+    # Every sampled line is a source line, in file order
+    positions = sample.merge(full.reset_index(), how="left", on=list(full.columns))["index"]
+    assert positions.notna().all() and positions.is_monotonic_increasing
+    # Not the head of the file: all three days are represented
+    assert pd.to_datetime(sample["tpep_pickup_datetime"]).dt.day.nunique() == 3
+
+    # Same parameters: the file is reused, not redrawn
+    mtime = os.stat(path).st_mtime_ns
+    assert sampling.write_sample_csv(trips_csv, 300, method) == n
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_publish_keeps_the_interval_in_the_columnar_store(tmp_path):
+    rows = [{"count": 40, "avg_fare": 11.5, "avg_distance": 2.0, "grid_x": -7398, "grid_y": 4075,
+             "grid_key": "-7398_4075", "hour": 8, "count_low": 31, "count_high": 52, "sampled": 4},
+            {"count": 7, "avg_fare": 9.0, "avg_distance": 1.0, "grid_x": -7401, "grid_y": 4071,
+             "grid_key": "-7401_4071", "hour": 2, "count_low": 7, "count_high": 12, "sampled": 1}]
+    out = str(tmp_path / "sampled_hourly_grid_counts.json")
+    sampling.publish(rows, {"population_rows": 100}, out)
+
+    store = ColumnarResult(out)
+    assert store.extra == list(sampling.INTERVAL_COLUMNS)
+    assert store.rows() == sorted(rows, key=lambda r: r["hour"])
+    with open(out) as f:
+        assert f.read() == json.dumps(rows, separators=(",", ":"))
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from scripts.scheduler import Stage, topological_order, critical_path, run_stages
+
+
+def diamond(func=lambda: None):
+    return [
+        Stage("anomaly", func, ["aggregation"]),
+        Stage("aggregation", func, ["ingest"]),
+        Stage("mapreduce", func, ["ingest"]),
+        Stage("ingest", func),
+    ]
+
+
+def test_topological_order_puts_deps_first():
+    order = topological_order(diamond())
+    assert sorted(order) == ["aggregation", "anomaly", "ingest", "mapreduce"]
+    for stage in diamond():
+        for dep in stage.deps:
+            assert order.index(dep) < order.index(stage.name)
+
+
+def test_topological_order_rejects_cycles():
+    stages = [Stage("a", None, ["c"]), Stage("b", None, ["a"]), Stage("c", None, ["b"])]
+    with pytest.raises(ValueError, match="Dependency cycle"):
+        topological_order(stages)
+
+
+def test_topological_order_rejects_self_dependency():
+    with pytest.raises(ValueError, match="Dependency cycle: a -> a"):
+        topological_order([Stage("a", None, ["a"])])
+
+
+def test_topological_order_rejects_unknown_and_duplicate_stages():
+    with pytest.raises(ValueError, match="unknown stages"):
+        topological_order([Stage("a", None, ["missing"])])
+    with pytest.raises(ValueError, match="Duplicate stage"):
+        topological_order([Stage("a", None), Stage("a", None)])
+
+
+def test_critical_path_follows_longest_chain():
+    seconds = {"ingest": 2.0, "aggregation": 1.0, "anomaly": 0.5, "mapreduce": 3.0}
+    assert critical_path(diamond(), seconds) == (["ingest", "mapreduce"], 5.0)
+    seconds["anomaly"] = 2.5
+    assert critical_path(diamond(), seconds) == (["ingest", "aggregation", "anomaly"], 5.5)
+
+
+def test_critical_path_of_no_stages():
+    assert critical_path([], {}) == ([], 0.0)
+
+
+def test_run_stages_respects_deps():
+    finished, lock = [], threading.Lock()
+
+    def record(name):
+        def func():
+            with lock:
+                finished.append(name)
+            return name
+        return func
+
+    stages = [Stage(s.name, record(s.name), s.deps) for s in diamond()]
+    report = run_stages(stages)
+    assert report["results"] == {name: name for name in finished}
+    for stage in stages:
+        for dep in stage.deps:
+            assert finished.index(dep) < finished.index(stage.name)
+    assert report["critical_path"][0] == "ingest"
+
+
+def test_run_stages_stops_scheduling_after_a_failure():
+    ran = []
+
+    def fail():
+        raise RuntimeError("ingest failed")
+
+    stages = [Stage("ingest", fail), Stage("aggregation", lambda: ran.append(1), ["ingest"])]
+    with pytest.raises(RuntimeError, match="ingest failed"):
+        run_stages(stages)
+    assert ran == []
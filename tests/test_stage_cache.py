@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+from scripts.stage_cache import StageCache, cached_stage
+
+
+@pytest.fixture
+def results_dir(tmp_path):
+    path = tmp_path / "results"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def trips(tmp_path):
+    path = tmp_path / "trips.csv"
+    path.write_text("id\n1\n2\n")
+    return path
+
+
+def run_stage(cache, fingerprint, out_dir, calls, outputs=("out.json",)):
+    def func():
+        calls.append(fingerprint)
+        for out in outputs:
+            (out_dir / out).write_text(fingerprint)
+        return 2
+    return cached_stage(cache, "aggregation", fingerprint, func, outputs)()
+
+
+def test_unchanged_stage_is_skipped_after_save(results_dir, trips):
+    calls = []
+    cache = StageCache(str(results_dir))
+    fp = cache.fingerprint("aggregation", {"rows": 2}, [trips])
+    assert run_stage(cache, fp, results_dir, calls) == 2
+    cache.save()
+
+    cache = StageCache(str(results_dir))
+    assert cache.fingerprint("aggregation", {"rows": 2}, [trips]) == fp
+    assert run_stage(cache, fp, results_dir, calls) == 2
+    assert calls == [fp]
+    assert cache.skipped == {"aggregation"}
+
+
+def test_recorded_stage_is_not_fresh_until_saved(results_dir, trips):
+    calls = []
+    cache = StageCache(str(results_dir))
+    fp = cache.fingerprint("aggregation", None, [trips])
+    run_stage(cache, fp, results_dir, calls)
+    assert not cache.is_fresh("aggregation", fp, ["out.json"])
+
+
+def test_changed_params_or_input_change_fingerprint(results_dir, trips):
+    cache = StageCache(str(results_dir))
+    fp = cache.fingerprint("aggregation", {"rows": 2}, [trips])
+    assert cache.fingerprint("aggregation", {"rows": 3}, [trips]) != fp
+    assert cache.fingerprint("aggregation", {"rows": 2}, [trips], upstream=["x"]) != fp
+    trips.write_text("id\n1\n2\n3\n")
+    assert cache.fingerprint("aggregation", {"rows": 2}, [trips]) != fp
+
+
+def test_touched_input_is_rehashed_but_keeps_fingerprint(results_dir, trips):
+    cache = StageCache(str(results_dir))
+    fp = cache.fingerprint("aggregation", None, [trips])
+    st = os.stat(trips)
+    os.utime(trips, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.fingerprint("aggregation", None, [trips]) == fp
+
+
+def test_changed_or_missing_output_reruns_stage(results_dir, trips):
+    calls = []
+    cache = StageCache(str(results_dir))
+    fp = cache.fingerprint("aggregation", None, [trips])
+    run_stage(cache, fp, results_dir, calls)
+    cache.save()
+
+    (results_dir / "out.json").write_text("edited by hand")
+    assert not cache.is_fresh("aggregation", fp, ["out.json"])
+    (results_dir / "out.json").unlink()
+    assert not cache.is_fresh("aggregation", fp, ["out.json"])
+
+
+def test_force_and_check_override_a_fresh_stage(results_dir, trips):
+    calls = []
+    cache = StageCache(str(results_dir))
+    fp = cache.fingerprint("aggregation", None, [trips])
+    run_stage(cache, fp, results_dir, calls)
+    cache.save()
+
+    assert cache.is_fresh("aggregation", fp, ["out.json"])
+    assert not cache.is_fresh("aggregation", fp, ["out.json"], check=lambda record: False)
+    assert not StageCache(str(results_dir), force=True).is_fresh("aggregation", fp, ["out.json"])
+
+
+def test_skipped_stage_copies_outputs_to_written_dir(results_dir, trips, tmp_path):
+    calls = []
+    cache = StageCache(str(results_dir))
+    fp = cache.fingerprint("aggregation", None, [trips])
+    run_stage(cache, fp, results_dir, calls)
+    cache.save()
+
+    staging = tmp_path / "staging"
+    staging.mkdir()
+    cached_stage(cache, "aggregation", fp, lambda: calls.append("ran"), ["out.json"],
+                 written_dir=str(staging))()
+    assert calls == [fp]
+    assert (staging / "out.json").read_text() == fp
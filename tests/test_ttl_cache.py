@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+import backend.ttl_cache as ttl_cache
+from backend.ttl_cache import TTLCache
+
+
+def test_concurrent_misses_compute_once():
+    cache = TTLCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "rows"
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_or_compute("q", compute)))
+    owner.start()
+    started.wait(5)
+    # The owner holds the key: every later caller waits for its result
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_compute("q", compute)))
+                 for _ in range(8)]
+    for t in followers:
+        t.start()
+    release.set()
+    for t in [owner] + followers:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [("rows", False)] + [("rows", True)] * 8
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 8
+
+
+def test_failed_owner_lets_the_next_caller_compute():
+    cache = TTLCache()
+
+    def fail():
+        raise RuntimeError("mongod went away")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("q", fail)
+    assert cache.inflight == {}
+    assert cache.get_or_compute("q", lambda: "rows") == ("rows", False)
+    assert cache.get_or_compute("q", lambda: "other") == ("rows", True)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(ttl_cache.time, "monotonic", lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.put("q", "rows")
+    now[0] += 9
+    assert cache.get("q") == "rows"
+    now[0] += 2
+    assert cache.get("q") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)